@@ -1,12 +1,29 @@
 import streamlit as st
 import pandas as pd
 import polars as pl
-from mesa import Agent, Model
-from mesa.time import RandomActivation
-import random
 import numpy as np
 import requests
-from patientVis import predict_willingness_scores  # Import the willingness score function
+import json
+from simutrial.engine import simulate_scenario_consent_counts, compare_scenarios
+from simutrial.simulation import ADAPTIVE_ENGINES, ENGINE_SAMPLING, run_simulations, run_enrollment_simulation
+from simutrial.model_cache import load_or_train_willingness_model, training_fingerprint
+from simutrial.patient_cache import load_or_ingest_upload, cohort_key
+from simutrial.snapshots import apply_snapshot, list_panels
+from simutrial.patientVis import adjustment_key
+from simutrial.cohort_index import build_cohort_index, cohort_rows, cohort_summary
+from simutrial.jobs import submit_job, job_status, job_result, start_worker_pool
+from simutrial.result_cache import result_key, is_cacheable, load_result, store_result
+from simutrial.calibration import list_calibrations, load_calibration
+
+# Historical participation data the willingness model is trained on
+TRAINING_DATA_PATH = 'editedclinicaltrial_copy.csv'
+
+# Local worker processes running background simulation jobs
+JOB_WORKERS = 2
+
+# Snapshot panel offered before any panel has been stored, and the choice that names a new one
+DEFAULT_PANEL = "emr"
+NEW_PANEL = "New panel..."
 
 # Load JSON mapping
 column_mapping = {
@@ -17,90 +34,66 @@ column_mapping = {
   "health_issues": ["Conditions", "health_conditions", "Issues", "hypertension", "heart_disease"]
 }
 
-# Function to normalize columns with race aggregation
-def normalize_columns(df, mapping):
-    for standard_name, possible_names in mapping.items():
-        for col in possible_names:
-            if col in df.columns:
-                df = df.rename({col: standard_name})
-                break
-
-    race_cols = [col for col in df.columns if col.startswith("race:")]
-    if race_cols:
-        df = df.with_columns(
-            pl.concat_list([df[col] for col in race_cols]).alias("race_ethnicity")
-        )
-        df = df.drop(race_cols)
-    
-    return df
-
-class PatientAgent(Agent):
-    def __init__(self, unique_id, model, age, gender, race, region, health_issues, willingness_score):
-        super().__init__(unique_id, model)
-        self.age = age
-        self.gender = gender
-        self.race = race
-        self.region = region
-        self.health_issues = health_issues
-        self.willingness_score = willingness_score
-        self.consented = False
-
-    def step(self):
-        self.consented = random.random() < self.willingness_score
-
-class RecruitmentModel(Model):
-    def __init__(self, df, consent_rate_min, consent_rate_max):
-        self.df = df
-        self.consent_rate_min = consent_rate_min
-        self.consent_rate_max = consent_rate_max
-        self.schedule = RandomActivation(self)
-
-        for i, row in df.iterrows():
-            age = row.get('age', None)
-            gender = row.get('gender', None)
-            race = row.get('race_ethnicity', None)
-            region = row.get('region', None)
-            health_issues = row.get('health_issues', None)
-            willingness_score = row.get('WillingnessScore', None)
-            
-            agent = PatientAgent(i, self, age, gender, race, region, health_issues, willingness_score)
-            self.schedule.add(agent)
-
-    def step(self):
-        self.schedule.step()
-
-def run_simulations(df, consent_rate_min, consent_rate_max, num_simulations):
-    consent_results = []
-    staff_requirements = []
-    site_recommendations = []
-
-    for i in range(num_simulations):
-        model = RecruitmentModel(df, consent_rate_min, consent_rate_max)
-        for _ in range(1):
-            model.step()
-        consented_agents = sum([1 for agent in model.schedule.agents if agent.consented])
-        consent_results.append(min(consented_agents, len(df)))
-
-        staff_needed = max(1, int(consented_agents / 50))
-        sites_needed = max(1, int(consented_agents / 100))
-        staff_requirements.append(staff_needed)
-        site_recommendations.append(sites_needed)
-
-        st.session_state.progress.progress((i + 1) / num_simulations)
-    
-    mean_consent_rate = (np.mean(consent_results) / len(df)) * 100
-    confidence_interval = (np.std(consent_results) * 1.96 / np.sqrt(num_simulations)) / len(df) * 100
-    mean_staff = np.mean(staff_requirements)
-    mean_sites = np.mean(site_recommendations)
-    
-    return {
-        "mean_consent_rate": mean_consent_rate,
-        "confidence_interval": confidence_interval,
-        "staff_requirements": staff_requirements,
-        "site_recommendations": site_recommendations,
-        "mean_staff": mean_staff,
-        "mean_sites": mean_sites
-    }
+# Willingness model shared by every rerun; the fingerprint keys the cache on training data contents
+@st.cache_resource
+def get_willingness_model(training_path, fingerprint):
+    return load_or_train_willingness_model(training_path, fingerprint=fingerprint)
+
+# Bitmap index over the cohort's demographic strata, built once per cohort hash
+@st.cache_resource
+def get_cohort_index(cohort_hash, _df_scored):
+    return build_cohort_index(_df_scored)
+
+# Worker pool for background jobs, started once per server process and shared by every session
+@st.cache_resource
+def get_job_workers():
+    return start_worker_pool(JOB_WORKERS)
+
+def display_simulation_results(simulation_results, adaptive=False):
+    st.write(f"Mean Consent Rate: {simulation_results['mean_consent_rate']}%")
+    if "consent_rate_interval" in simulation_results:
+        # Analytic engine: the mean is exact, so show the range of a single trial's consent rate instead
+        low, high = simulation_results['consent_rate_interval']
+        coverage = simulation_results['consent_rate_coverage'] * 100
+        st.write(f"{coverage:g}% Range of a Single Trial's Consent Rate: {low}% to {high}%")
+    else:
+        st.write(f"Confidence Interval: +/- {simulation_results['confidence_interval']}")
+    if adaptive and "num_simulations" in simulation_results:
+        st.write(f"Simulations Run: {simulation_results['num_simulations']}")
+    if simulation_results.get("sampling", "independent") != "independent":
+        st.write(f"Variance Reduction: {simulation_results['variance_reduction']:.1f}x over independent sampling")
+    st.write(f"Average Staff Needed: {simulation_results['mean_staff']}")
+    st.write(f"Average Sites Needed: {simulation_results['mean_sites']}")
+
+def display_enrollment(enrollment, engine=None):
+    num_periods = len(enrollment["mean_curve"])
+    st.subheader("Enrollment Over Time")
+    if engine is not None and enrollment.get("engine", engine) != engine:
+        st.caption(f"The {engine} engine has no enrollment simulation; "
+                   f"these curves were drawn with the {enrollment['engine']} engine")
+    curve = pd.DataFrame({"Mean": enrollment["mean_curve"]}, index=pd.RangeIndex(1, num_periods + 1, name="Week"))
+    for p, band in enrollment["curve_percentiles"].items():
+        curve[f"P{p}"] = band
+    st.line_chart(curve)
+    for p, weeks in enrollment["time_to_target_percentiles"].items():
+        st.write(f"P{p} Weeks to Reach Study Size: {weeks if np.isfinite(weeks) else f'not within {num_periods} weeks'}")
+    st.write(f"Probability of Reaching Study Size: {enrollment['probability_target_reached'] * 100}%")
+
+# Ways of drawing the consent uniforms (see engine.uniform_batches); simulation.ENGINE_SAMPLING lists each engine's
+SAMPLING_METHODS = {
+    "Independent": "independent",
+    "Antithetic Pairs": "antithetic",
+    "Sobol (Quasi-Random)": "sobol"
+}
+
+# Engines selectable in the UI
+SIMULATION_ENGINES = {
+    "Vectorized": "vectorized",
+    "Stratified": "stratified",
+    "Parallel": "parallel",
+    "Analytic": "analytic",
+    "Mesa (reference)": "mesa"
+}
 
 # Streamlit App Configuration
 st.set_page_config(page_title="Patient Recruitment Simulation", layout="wide")
@@ -121,8 +114,46 @@ st.markdown(
 data_file = st.file_uploader("Connect to EMR", type=["csv", "tsv"], label_visibility='collapsed')
 
 if data_file is not None:
-    df = pl.read_csv(data_file)
-    df_normalized = normalize_columns(df, column_mapping)
+    # Trained once per training-data fingerprint and reused across reruns and sessions
+    model_fingerprint = training_fingerprint(TRAINING_DATA_PATH)
+    willingness_model = get_willingness_model(TRAINING_DATA_PATH, model_fingerprint)
+
+    # Race and age adjustments: the hand-tuned defaults or a parameter set fitted by `simutrial calibrate`
+    calibration = st.selectbox("Willingness Adjustment", ["Hand-tuned"] + list_calibrations())
+    adjustment = None
+    if calibration != "Hand-tuned":
+        adjustment = load_calibration(calibration)
+        model_fingerprint = f"{model_fingerprint}:{adjustment_key(adjustment)}"  # Scored cohorts are cached per parameter set
+
+    # Parse the upload once; scores are attached before targeting so they stay aligned with rows.
+    # Cohorts seen before are memory-mapped from the on-disk cache instead of being re-parsed and re-scored
+    # Daily EMR exports with a stable patient ID are diffed against the previous snapshot,
+    # so only inserted and updated patients are normalized and rescored
+    patient_id_column = st.text_input("Patient ID Column (incremental refresh)", "")
+    if patient_id_column:
+        # Each panel keeps its own snapshot under a name chosen once per source system, not taken from
+        # the export's file name, which changes with every dated daily export
+        known_panels = list_panels()
+        panel = st.selectbox("Panel", known_panels + [NEW_PANEL]) if known_panels else NEW_PANEL
+        if panel == NEW_PANEL:
+            panel = st.text_input("New Panel Name", DEFAULT_PANEL,
+                                  help="Use the same name for every export of one source system")
+
+        # Applied once per upload: reruns (any widget change) reuse the result instead of
+        # re-diffing the export against the snapshot it just wrote
+        cohort_hash = cohort_key(data_file.getvalue(), column_mapping, model_fingerprint)
+        snapshot_key = (cohort_hash, panel, patient_id_column)
+        if st.session_state.get('snapshot_key') != snapshot_key:
+            st.session_state['snapshot'] = apply_snapshot(data_file, patient_id_column, column_mapping, willingness_model,
+                                                          panel, adjustment=adjustment)
+            st.session_state['snapshot_key'] = snapshot_key
+        df_scored, snapshot_changes = st.session_state['snapshot']
+        st.caption(f"Snapshot refresh: {snapshot_changes['inserted']} inserted, {snapshot_changes['updated']} updated, "
+                   f"{snapshot_changes['deleted']} deleted, {snapshot_changes['unchanged']} unchanged")
+    else:
+        df_scored, cohort_hash = load_or_ingest_upload(data_file, column_mapping, willingness_model, model_fingerprint,
+                                                       adjustment=adjustment)
+    cohort_index = get_cohort_index(cohort_hash, df_scored)
 
     # Filtering based on inputs from Streamlit
     st.subheader("Recruitment Settings") 
@@ -130,68 +161,161 @@ if data_file is not None:
     consent_rate_min = st.slider("Consent Rate - Min", 0.0, 1.0, 0.2)
     consent_rate_max = st.slider("Consent Rate - Max", 0.0, 1.0, 0.8)
 
-    if st.checkbox("Target by Age Group"):
-        st.write("Filtering by age group greater than 18...")
-        df_normalized = df_normalized.filter(pl.col("age") > 18)  # Example filter
-    
-    if st.checkbox("Target by Gender"):
-        if st.checkbox('Female'):
-            df_normalized = df_normalized.filter(pl.col("gender") == "Female")  # Example filter
-        if st.checkbox("Male"):
-            df_normalized = df_normalized.filter(pl.col("gender") == "Male")  # Example filter
-    
-    if st.checkbox("Target by Ethnicity"):
-        ethnicity_conditions = []
+    # Targeting choices are collected into one spec and resolved against the cohort bitmap index
+    targeting_spec = {}
 
-        if st.checkbox('African American'):
-            ethnicity_conditions.append(pl.col("race_ethnicity") == 1)
+    if st.checkbox("Target by Age Group"):
+        targeting_spec['age'] = st.slider("Age Range", 0, 120, (18, 120))
 
-        if st.checkbox('Caucasian'):
-            ethnicity_conditions.append(pl.col("race_ethnicity") == 1)
+    if st.checkbox("Target by Gender"):
+        targeting_spec['gender'] = [gender for gender in ["Female", "Male"] if st.checkbox(gender)]
 
-        if st.checkbox('Hispanic'):
-            ethnicity_conditions.append(pl.col("race_ethnicity") == 1)
+    if st.checkbox("Target by Ethnicity"):
+        ethnicity_options = {
+            'African American': 'AfricanAmerican',
+            'Caucasian': 'Caucasian',
+            'Hispanic': 'Hispanic',
+            'Asian': 'Asian'
+        }
+        targeting_spec['race'] = [race for label, race in ethnicity_options.items() if st.checkbox(label)]
 
-        if st.checkbox('Asian'):
-            ethnicity_conditions.append(pl.col("race_ethnicity") == 1)
+    if st.checkbox("Target by Region"):
+        targeting_spec['region'] = st.multiselect("Census Regions", ["Northeast", "Midwest", "South", "West"])
 
-        # Apply combined ethnicity filter only if there are conditions selected
-        if ethnicity_conditions:
-            df_normalized = df_normalized.filter(pl.any(ethnicity_conditions))
+    targeted_rows = cohort_rows(cohort_index, targeting_spec)
+    targeted_summary = cohort_summary(cohort_index, targeting_spec)
 
     # Display filtered DataFrame
-    st.write("Filtered Data Preview:", df_normalized.head().to_pandas())
+    st.write(f"Targeted Patients: {targeted_summary['count']}, Mean Willingness Score: {targeted_summary['mean_willingness'] * 100}%")
+    st.write("Filtered Data Preview:", df_scored[targeted_rows[:5]].to_pandas())
 
     num_simulations = st.number_input("Number of Simulations", min_value=1, max_value=500, value=100)
-
-    training_data = pd.read_csv('editedclinicaltrial_copy.csv')
-    X_train = training_data[['Age', 'CENSREG', 'BirthGender', 'RaceEthn']]
-    y_train = training_data['ParticipatedClinTrial']
-
-    # Predict willingness scores for patients
-    csv_path = data_file.name  # Use the uploaded file as input
-    results_df = predict_willingness_scores(csv_path, X_train, y_train)
-
-    df_normalized_pd = df_normalized.to_pandas()
-    df_normalized_pd['WillingnessScore'] = results_df['WillingnessScore']
+    engine = st.selectbox("Simulation Engine", list(SIMULATION_ENGINES))
+    seed = st.number_input("Random Seed", min_value=0, value=0)
+    # Only the sampling methods and early stopping the selected engine supports are offered
+    sampling = st.selectbox("Sampling", [name for name, method in SAMPLING_METHODS.items()
+                                         if method in ENGINE_SAMPLING[SIMULATION_ENGINES[engine]]],
+                            help="Variance reduction: Antithetic Pairs for the Vectorized and Parallel engines, "
+                                 "Sobol for the Vectorized engine")
+
+    # Sequential mode: Number of Simulations becomes a cap and replicates stop once precise enough
+    target_half_width = None
+    can_stop_early = SIMULATION_ENGINES[engine] in ADAPTIVE_ENGINES
+    stop_early = st.checkbox("Stop Early at Target Precision", disabled=not can_stop_early,
+                             help=None if can_stop_early else f"Not available for the {engine} engine")
+    if stop_early and can_stop_early:
+        target_half_width = st.number_input("Target Confidence Interval (+/- % points)", min_value=0.001, max_value=10.0, value=0.1)
+    study_size = st.number_input("Study Size", min_value=1, max_value=10000, value=100)
+    compare_full_cohort = st.checkbox("Compare Targeting Against Full Cohort")
+
+    # Time-resolved recruitment over repeated screening windows
+    time_resolved = st.checkbox("Simulate Enrollment Over Time")
+    if time_resolved:
+        num_periods = st.number_input("Screening Windows (Weeks)", min_value=1, max_value=260, value=52)
+
+    # Background jobs run in the local worker pool and survive page reloads
+    run_in_background = st.checkbox("Run in Background")
 
     if st.button("Run Simulation"):
-        st.session_state.progress = st.progress(0)
-
-        simulation_results = run_simulations(df_normalized_pd, consent_rate_min, consent_rate_max, num_simulations)
-        
-        st.write(f"Mean Consent Rate: {simulation_results['mean_consent_rate']}%")
-        st.write(f"Confidence Interval: +/- {simulation_results['confidence_interval']}")
-        st.write(f"Average Staff Needed: {simulation_results['mean_staff']}")
-        st.write(f"Average Sites Needed: {simulation_results['mean_sites']}")
+        # Gather only what the engine needs; the Mesa reference engine builds agents from full rows
+        if SIMULATION_ENGINES[engine] == "mesa":
+            df_normalized = df_scored[targeted_rows]
+        else:
+            df_normalized = df_scored.select('WillingnessScore')[targeted_rows]
+
+        simulation_params = dict(consent_rate_min=consent_rate_min, consent_rate_max=consent_rate_max,
+                                 num_simulations=num_simulations, engine=SIMULATION_ENGINES[engine], seed=seed,
+                                 target_half_width=target_half_width, sampling=SAMPLING_METHODS[sampling])
+        enrollment_params = None
+        if time_resolved:
+            enrollment_params = dict(consent_rate_min=consent_rate_min, consent_rate_max=consent_rate_max,
+                                     num_simulations=num_simulations, num_periods=num_periods, study_size=study_size,
+                                     seed=seed, engine=SIMULATION_ENGINES[engine], sampling=SAMPLING_METHODS[sampling])
+
+        # Identical runs on the same cohort are served from the on-disk result cache
+        run_params = {'simulation': simulation_params, 'enrollment': enrollment_params}
+        cache_key = result_key(cohort_hash, targeting_spec, run_params) if is_cacheable(simulation_params) else None
+        run_results = load_result(cache_key) if cache_key is not None else None
+
+        if run_results is not None:
+            st.caption("Loaded from result cache")
+        elif run_in_background:
+            get_job_workers()
+            job_id = submit_job('simulate', {**run_params, 'result_key': cache_key}, df_normalized)
+            st.query_params['job'] = job_id  # Kept in the URL so a reload finds the job again
+            st.write(f"Submitted Job: {job_id}")
+        else:
+            st.session_state.progress = st.progress(0)
+            run_results = {'simulation': run_simulations(df_normalized, **simulation_params,
+                                                         progress=st.session_state.progress.progress)}
+            if enrollment_params:
+                run_results['enrollment'] = run_enrollment_simulation(df_normalized, **enrollment_params,
+                                                                      progress=st.session_state.progress.progress)
+            st.session_state.progress.empty()
+            if cache_key is not None:
+                store_result(cache_key, run_results)
+
+        if run_results is not None:
+            display_simulation_results(run_results['simulation'], adaptive=bool(target_half_width))
+
+            if compare_full_cohort and len(targeted_rows):
+                # Common random numbers: every patient gets the same draws in both scenarios
+                scenario_counts = simulate_scenario_consent_counts(
+                    df_scored['WillingnessScore'].to_numpy(), [None, targeted_rows], num_simulations,
+                    rng=seed, sampling=SAMPLING_METHODS[sampling]
+                )
+                comparison = compare_scenarios(scenario_counts, [len(df_scored), len(targeted_rows)],
+                                               sampling=SAMPLING_METHODS[sampling])[1]
+                st.write(f"Targeting vs Full Cohort: {comparison['difference']:+.3f} +/- {comparison['difference_interval']:.3f} percentage points "
+                         f"(variance reduction {comparison['variance_reduction']:.1f}x over independent runs)")
+
+            if run_results.get('enrollment'):
+                display_enrollment(run_results['enrollment'], SIMULATION_ENGINES[engine])
 
         st.subheader("Calculated Willingness Scores")
-        st.dataframe(results_df[['Age', 'CENSREG', 'BirthGender', 'RaceEthn', 'WillingnessScore']], height=500)  # Show top 10 entries for brevity
+        st.dataframe(df_scored.select(pl.col('age').alias('Age'), 'CENSREG', 'BirthGender', 'RaceEthn', 'WillingnessScore').to_pandas(), height=500)  # Show top 10 entries for brevity
 
-        mean_will = (results_df["WillingnessScore"].sum())/len(results_df)
+        mean_will = (df_scored["WillingnessScore"].sum())/len(df_scored)
 
         mean_will_perc = mean_will * 100
 
         st.write(f"Mean Willingness Score Across Agents: {mean_will_perc}%")
-        
-        st.session_state.progress.empty()
+
+    # Scenario sweeps (see sweep.py) run as background jobs; the grid starts from the current targeting
+    st.subheader("Scenario Sweep")
+    default_grid = {'targeting': {'All Patients': {}, 'Current Targeting': targeting_spec}, 'study_size': [study_size]}
+    sweep_grid = st.text_area("Scenario Grid (JSON: targeting, location, study_size)", json.dumps(default_grid))
+    if st.button("Run Sweep in Background"):
+        try:
+            grid = json.loads(sweep_grid)
+        except json.JSONDecodeError as error:
+            st.error(f"Invalid scenario grid: {error}")
+        else:
+            get_job_workers()
+            job_id = submit_job('sweep', {'grid': grid, 'num_simulations': num_simulations, 'seed': seed,
+                                          'sampling': SAMPLING_METHODS[sampling]}, df_scored)
+            st.query_params['job'] = job_id
+            st.write(f"Submitted Job: {job_id}")
+
+# Poll a background job and show its results; the job ID comes from the URL after a reload
+st.subheader("Background Jobs")
+job_id = st.text_input("Job ID", st.query_params.get("job", ""))
+if job_id:
+    job = job_status(job_id)
+    if job is None:
+        st.write("Unknown job ID")
+    else:
+        st.write(f"Status: {job['status']}")
+        if job['status'] in ('queued', 'running'):
+            st.progress(job['progress'])
+            st.button("Refresh Job Status")
+        elif job['status'] == 'failed':
+            st.code(job['error'])
+        elif job['kind'] == 'sweep':
+            st.dataframe(job_result(job_id).to_pandas())  # One row per scenario
+        else:
+            job_results = job_result(job_id)
+            display_simulation_results(job_results['simulation'],
+                                       adaptive=bool(json.loads(job['params'])['simulation'].get('target_half_width')))
+            if job_results.get('enrollment'):
+                display_enrollment(job_results['enrollment'], json.loads(job['params'])['enrollment']['engine'])
@@ -0,0 +1,3 @@
+# Patient recruitment simulation for clinical trials: willingness scoring, cohort targeting, the
+# simulation engines and the ClinicalTrials.gov data tools. The Streamlit apps and the scraper live
+# at the top level of the repository and import from this package.
@@ -0,0 +1,6 @@
+import sys
+
+from simutrial.cli import main
+
+# `python -m simutrial ...` runs the command line (see cli.py)
+sys.exit(main())
@@ -0,0 +1,105 @@
+import numpy as np
+from scipy.signal import fftconvolve
+from scipy.special import ndtr
+from scipy.stats import binom
+
+from simutrial.engine import PATIENTS_PER_STAFF, PATIENTS_PER_SITE
+
+# Cohorts larger than this use the normal approximation unless an exact PMF is requested
+NORMAL_APPROX_THRESHOLD = 100_000
+
+# Number of patients combined by direct recursion before switching to FFT products
+LEAF_SIZE = 64
+
+# Exact Poisson-binomial PMF: recursion within small leaves, then a pairwise FFT product tree
+def _exact_pmf(probs):
+    n_patients = len(probs)
+    n_leaves = max(1, -(-n_patients // LEAF_SIZE))
+    padded = np.zeros(n_leaves * LEAF_SIZE)
+    padded[:n_patients] = probs
+    leaf_probs = padded.reshape(n_leaves, LEAF_SIZE)
+
+    # Every leaf is updated together, one patient column at a time
+    polys = np.zeros((n_leaves, LEAF_SIZE + 1))
+    polys[:, 0] = 1.0
+    for j in range(LEAF_SIZE):
+        p = leaf_probs[:, j:j + 1]
+        polys[:, 1:] = polys[:, 1:] * (1 - p) + polys[:, :-1] * p
+        polys[:, 0] *= 1 - p[:, 0]
+
+    while len(polys) > 1:
+        if len(polys) % 2:
+            identity = np.zeros((1, polys.shape[1]))
+            identity[0, 0] = 1.0
+            polys = np.vstack([polys, identity])
+        polys = fftconvolve(polys[0::2], polys[1::2], axes=1)
+        np.clip(polys, 0.0, None, out=polys)  # FFT round-off can go slightly negative
+
+    pmf = polys[0][:n_patients + 1]
+    return pmf / pmf.sum()
+
+# Normal approximation with continuity correction, evaluated on every count 0..n
+def _normal_pmf(probs):
+    mean = probs.sum()
+    std = np.sqrt(np.sum(probs * (1 - probs)))
+    counts = np.arange(len(probs) + 1)
+    if std == 0:
+        pmf = (counts == np.rint(mean)).astype(float)
+    else:
+        pmf = ndtr((counts + 0.5 - mean) / std) - ndtr((counts - 0.5 - mean) / std)
+    return pmf / pmf.sum()
+
+# Distribution of the number of consenting patients when patient i consents with probability probs[i]
+def poisson_binomial_pmf(probs, method="auto"):
+    probs = np.nan_to_num(np.asarray(probs, dtype=np.float64), nan=0.0)  # NaN scores never consent
+    probs = np.clip(probs, 0.0, 1.0)
+    if method == "auto":
+        method = "normal" if len(probs) > NORMAL_APPROX_THRESHOLD else "exact"
+    if method == "exact":
+        return _exact_pmf(probs)
+    if method == "normal":
+        return _normal_pmf(probs)
+    raise ValueError(f"Unknown PMF method: {method}")
+
+# Distribution of a derived quantity (staff or sites) as {value: probability}
+def _derived_distribution(pmf, patients_per_unit):
+    units = np.maximum(1, np.arange(len(pmf)) // patients_per_unit)
+    probabilities = np.bincount(units, weights=pmf)
+    return {int(value): float(probabilities[value]) for value in np.flatnonzero(probabilities)}
+
+# Turn an exact consent-count PMF into the result dict shown in the app
+def summarize_consent_pmf(pmf, n_patients, coverage=0.95):
+    counts = np.arange(len(pmf))
+    cdf = np.cumsum(pmf)
+    tail = (1 - coverage) / 2
+    low = int(np.searchsorted(cdf, tail))
+    high = int(min(np.searchsorted(cdf, 1 - tail), n_patients))
+
+    staff_distribution = _derived_distribution(pmf, PATIENTS_PER_STAFF)
+    site_distribution = _derived_distribution(pmf, PATIENTS_PER_SITE)
+
+    # The mean is exact, so the confidence interval on it is 0; the spread of a single trial's consent
+    # rate is reported separately as the central interval of the PMF
+    return {
+        "mean_consent_rate": float(pmf @ counts) / n_patients * 100,
+        "confidence_interval": 0.0,
+        "consent_rate_interval": (low / n_patients * 100, high / n_patients * 100),
+        "consent_rate_coverage": coverage,
+        "consent_pmf": pmf,
+        "staff_distribution": staff_distribution,
+        "site_distribution": site_distribution,
+        "mean_staff": sum(value * p for value, p in staff_distribution.items()),
+        "mean_sites": sum(value * p for value, p in site_distribution.items())
+    }
+
+# Analytic counterpart of run_simulations for per-patient willingness scores
+def analytic_consent_results(willingness, method="auto", coverage=0.95):
+    pmf = poisson_binomial_pmf(willingness, method=method)
+    return summarize_consent_pmf(pmf, len(pmf) - 1, coverage=coverage)
+
+# Analytic counterpart for a consent probability drawn uniformly from [min, max] per patient
+def analytic_uniform_consent_results(n_patients, consent_rate_min, consent_rate_max, coverage=0.95):
+    # Averaging the uniform draw makes each patient Bernoulli((min + max) / 2), so the count is binomial
+    p = (consent_rate_min + consent_rate_max) / 2
+    pmf = binom.pmf(np.arange(n_patients + 1), n_patients, p)
+    return summarize_consent_pmf(pmf, n_patients, coverage=coverage)
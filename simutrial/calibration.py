@@ -0,0 +1,279 @@
+import json
+import os
+import re
+import time
+
+import numpy as np
+import polars as pl
+
+from simutrial.disk_cache import atomic_write
+from simutrial.patientVis import DEFAULT_ADJUSTMENT, feature_cell_statistics, model_features, race_mapping
+from simutrial.patientVis import raw_feature_scores
+
+# Fits the willingness adjustment parameters (the race assumption rates and the under-30 boost,
+# see adjust_willingness_scores) so that the demographic mix of simulated consenters matches the
+# baseline race and sex tables of completed trials (trial_api.py).
+#
+# During fitting the simulation is replaced by its expectation: patient i consents with probability
+# proportional to its adjusted score, so the expected share of category k among consenters is
+#   sum_{i in k} count_i * (raw_i * rate_race(i) * race_multiplier * boost_i + 0.01) / sum_i (...)
+# (the rescaling into [0, 0.5] divides every score by the same maximum and cancels). The trials'
+# baseline counts are multinomial draws from these shares, so their log-likelihood only depends on
+# the counts summed per population, and thousands of trials cost one pass over the cohort cells.
+# The race multiplier and the rates are only identifiable as a product, so the multiplier is kept
+# and the rates are fitted.
+
+# Directory holding fitted parameter sets, loaded by the app by name
+CALIBRATION_DIR = os.path.join('.simutrial_cache', 'calibration')
+
+# Race categories in race_mapping order, then the sexes; the columns of a trial targets frame
+RACE_CATEGORIES = list(race_mapping)
+SEX_CATEGORIES = ['Female', 'Male']
+TARGET_COLUMNS = RACE_CATEGORIES + SEX_CATEGORIES
+
+# Constant added to every adjusted score (see adjust_willingness_scores)
+SCORE_OFFSET = 0.01
+
+# Fitted rates are bounded like participation rates; the boost is in percent per year under young_age
+RATE_BOUNDS = (0.0, 1.0)
+BOOST_BOUNDS = (0.0, 10.0)
+
+# Labels of non-Hispanic participants ('Not Hispanic or Latino', 'White, Non-Hispanic'); matched before
+# the Hispanic keywords, which they contain
+NOT_HISPANIC = re.compile(r'\b(?:non|not)[- ](?:hispanic(?: or latino)?|latino)')
+
+# Race category of a baseline table row (None for unknown or not reported)
+def _race_category(title):
+    name = title.lower()
+    if 'unknown' in name or 'not reported' in name:
+        return None
+    name = NOT_HISPANIC.sub('', name)
+    if not re.search(r'[a-z]', name):
+        return None  # A bare non-Hispanic label says nothing about race
+    if 'hispanic' in name or 'latino' in name:
+        return 'Hispanic'
+    if 'white' in name or 'caucasian' in name:
+        return 'Caucasian'
+    if 'black' in name or 'african' in name:
+        return 'AfricanAmerican'
+    if 'asian' in name:
+        return 'Asian'
+    return 'Other'
+
+# Ethnicity of an NIH/OMB ethnicity row: 'Hispanic', 'Not Hispanic', or None for unknown or not reported
+def _ethnicity_category(title):
+    name = title.lower()
+    if 'unknown' in name or 'not reported' in name:
+        return None
+    if NOT_HISPANIC.search(name):
+        return 'Not Hispanic'
+    if 'hispanic' in name or 'latino' in name:
+        return 'Hispanic'
+    return None
+
+# Participants of a baseline measure across all arms, per category title
+def _total_counts(study, title):
+    from simutrial.trial_api import measure_counts
+
+    counts = measure_counts(study, title)
+    if 'Total' in counts.columns:
+        return counts['Total']
+    return counts.sum(axis=1)  # Single-arm studies report no separate total
+
+# Baseline counts of a study in TARGET_COLUMNS order. Hispanic ethnicity is reported separately from
+# race (NIH/OMB), so the known-race counts are split by the study's Hispanic share
+def trial_targets(study):
+    from simutrial.trial_api import ETHNICITY_MEASURE, RACE_MEASURE, SEX_MEASURE
+
+    race = dict.fromkeys(RACE_CATEGORIES, 0.0)
+    for title, count in _total_counts(study, RACE_MEASURE).items():
+        category = _race_category(title)
+        if category is not None:
+            race[category] += count
+
+    ethnicity = {}
+    for title, count in _total_counts(study, ETHNICITY_MEASURE).items():
+        category = _ethnicity_category(title)
+        if category is not None:
+            ethnicity[category] = ethnicity.get(category, 0.0) + count
+    hispanic = float(ethnicity.get('Hispanic', 0.0))
+    reported = float(sum(ethnicity.values()))
+    if reported > 0 and race['Hispanic'] == 0:
+        known = sum(race.values())
+        share = hispanic / reported
+        race = {category: count * (1 - share) for category, count in race.items()}
+        race['Hispanic'] = known * share
+
+    sex = _total_counts(study, SEX_MEASURE)
+    return [race[category] for category in RACE_CATEGORIES] + [float(sex.get(category, 0)) for category in SEX_CATEGORIES]
+
+# One row per study with posted baseline characteristics: nct_id, CENSREG (the region whose patients
+# the study is compared with, or null for the whole cohort) and the TARGET_COLUMNS counts
+def trial_targets_frame(studies, regions=None):
+    from simutrial.trial_api import has_baseline
+
+    regions = regions or {}
+    rows = [
+        [nct_id, regions.get(nct_id)] + trial_targets(study)
+        for nct_id, study in studies.items() if has_baseline(study)
+    ]
+    schema = {'nct_id': pl.String, 'CENSREG': pl.Float64, **{column: pl.Float64 for column in TARGET_COLUMNS}}
+    return pl.DataFrame(rows, schema=schema, orient='row')
+
+# Cohort cells as arrays: counts, raw model probabilities, race category index, female flag, age
+# and population membership (row 0 is the whole cohort, rows 1-4 the CENSREG regions)
+def _cohort_arrays(cells, model):
+    features = cells.select(model_features).to_numpy().astype(float)
+    counts = cells['count'].to_numpy().astype(float)
+    mean, scale = feature_cell_statistics(features, counts)
+    raw = raw_feature_scores(features, mean, scale, model)
+
+    race_codes = np.array([race_mapping[category] for category in RACE_CATEGORIES])
+    race = np.argmax(features[:, 3][:, None] == race_codes[None, :], axis=1)
+    female = features[:, 2] == 0
+    region = features[:, 1]
+    membership = np.vstack([np.ones(len(cells), dtype=bool)] + [region == code for code in range(1, 5)])
+    return counts, raw, race, female, features[:, 0], membership
+
+# Observed counts summed per population (rows as in _cohort_arrays)
+def _population_targets(targets):
+    region = targets['CENSREG'].fill_null(0).to_numpy().astype(int)
+    observed = np.zeros((5, len(TARGET_COLUMNS)))
+    np.add.at(observed, region, targets.select(TARGET_COLUMNS).to_numpy())
+    return observed
+
+# Negative log-likelihood of the observed population counts and its gradient in (rates..., young_boost)
+def _negative_log_likelihood(params, counts, raw, race, female, age, membership, observed, race_multiplier, young_age):
+    rates, young_boost = params[:-1], params[-1]
+    young = np.where(age < young_age, (young_age - age) / 100, 0.0)
+    boost = 1 + young * young_boost
+    base = counts * raw * race_multiplier
+    mass = base * rates[race] * boost + counts * SCORE_OFFSET  # Expected consenters per cell, up to a constant
+
+    race_onehot = np.eye(len(RACE_CATEGORIES))[race]
+    sex_onehot = np.column_stack([female, ~female]).astype(float)
+    member = membership.astype(float)
+    expected_race = member @ (mass[:, None] * race_onehot)
+    expected_sex = member @ (mass[:, None] * sex_onehot)
+    total = member @ mass
+
+    observed_race, observed_sex = observed[:, :len(RACE_CATEGORIES)], observed[:, len(RACE_CATEGORIES):]
+    tiny = np.finfo(float).tiny
+    log_likelihood = (
+        np.sum(observed_race * np.log(np.maximum(expected_race, tiny)))
+        + np.sum(observed_sex * np.log(np.maximum(expected_sex, tiny)))
+        - np.sum((observed_race.sum(axis=1) + observed_sex.sum(axis=1)) * np.log(np.maximum(total, tiny)))
+    )
+
+    # d log-likelihood / d mass_c, summed over the populations cell c belongs to
+    weight_race = np.divide(observed_race, expected_race, out=np.zeros_like(observed_race), where=expected_race > 0)
+    weight_sex = np.divide(observed_sex, expected_sex, out=np.zeros_like(observed_sex), where=expected_sex > 0)
+    weight_total = np.divide(observed.sum(axis=1), total, out=np.zeros_like(total), where=total > 0)
+    cell_weight = (
+        np.sum((member.T @ weight_race) * race_onehot, axis=1)
+        + np.sum((member.T @ weight_sex) * sex_onehot, axis=1)
+        - member.T @ weight_total
+    )
+    gradient_rates = race_onehot.T @ (cell_weight * base * boost)
+    gradient_boost = np.sum(cell_weight * base * rates[race] * young)
+    return -log_likelihood, -np.append(gradient_rates, gradient_boost)
+
+# Consenter demographic shares the adjustment implies for each population, as a frame
+def _expected_shares(adjustment, arrays):
+    counts, raw, race, female, age, membership = arrays
+    rates = np.array([adjustment['assumption_rates'][race_mapping[category]] for category in RACE_CATEGORIES])
+    young_age = adjustment['young_age']
+    boost = np.where(age < young_age, 1 + (young_age - age) / 100 * adjustment['young_boost'], 1.0)
+    mass = counts * (raw * rates[race] * adjustment['race_multiplier'] * boost + SCORE_OFFSET)
+
+    member = membership.astype(float)
+    total = member @ mass
+    shares = np.column_stack(
+        [member @ (mass * (race == i)) for i in range(len(RACE_CATEGORIES))]
+        + [member @ (mass * female), member @ (mass * ~female)]
+    )
+    return np.divide(shares, total[:, None], out=np.zeros_like(shares), where=total[:, None] > 0)
+
+# Fit the race rates and the young-age boost of an adjustment to trial baseline counts.
+# cells: cohort feature cells with counts (streaming.scan_feature_cells); targets: trial_targets_frame.
+# race_multiplier and young_age are held at their values in `initial` (DEFAULT_ADJUSTMENT by default).
+# Returns the fitted adjustment and a report comparing observed and expected consenter shares
+def fit_adjustment(cells, targets, model, initial=None):
+    from scipy.optimize import minimize
+
+    initial = initial or DEFAULT_ADJUSTMENT
+    arrays = _cohort_arrays(cells, model)
+    observed = _population_targets(targets)
+    race_multiplier, young_age = initial['race_multiplier'], initial['young_age']
+
+    x0 = np.array([initial['assumption_rates'][race_mapping[category]] for category in RACE_CATEGORIES]
+                  + [initial['young_boost']], dtype=float)
+    bounds = [RATE_BOUNDS] * len(RACE_CATEGORIES) + [BOOST_BOUNDS]
+    args = (*arrays, observed, race_multiplier, young_age)
+    # Per observed participant, so the optimizer's tolerances do not depend on the number of trials
+    participants = max(observed.sum(), 1.0)
+    objective = lambda x: tuple(value / participants for value in _negative_log_likelihood(x, *args))
+    result = minimize(objective, x0, jac=True, method='L-BFGS-B', bounds=bounds)
+
+    adjustment = {
+        'assumption_rates': {race_mapping[category]: float(rate) for category, rate in zip(RACE_CATEGORIES, result.x[:-1])},
+        'race_multiplier': race_multiplier,
+        'young_age': young_age,
+        'young_boost': float(result.x[-1])
+    }
+
+    # Populations with observed trials: the whole cohort (trials without a region) and each region
+    populations = np.flatnonzero(observed.sum(axis=1) > 0)
+    observed_shares = observed / np.maximum(observed[:, :len(RACE_CATEGORIES)].sum(axis=1), 1)[:, None]
+    observed_shares[:, len(RACE_CATEGORIES):] = (observed[:, len(RACE_CATEGORIES):]
+                                                 / np.maximum(observed[:, len(RACE_CATEGORIES):].sum(axis=1), 1)[:, None])
+    initial_shares = _expected_shares(initial, arrays)
+    fitted_shares = _expected_shares(adjustment, arrays)
+    shares = pl.DataFrame({
+        'CENSREG': np.repeat(populations, len(TARGET_COLUMNS)),
+        'category': TARGET_COLUMNS * len(populations),
+        'observed': observed_shares[populations].ravel(),
+        'initial': initial_shares[populations].ravel(),
+        'fitted': fitted_shares[populations].ravel(),
+    })
+
+    report = {
+        'trials': len(targets),
+        'converged': bool(result.success),
+        'message': str(result.message),
+        'iterations': int(result.nit),
+        'log_likelihood': float(-result.fun * participants),
+        'initial_log_likelihood': float(-_negative_log_likelihood(x0, *args)[0]),
+        'shares': shares
+    }
+    return adjustment, report
+
+def _calibration_path(name, calibration_dir):
+    return os.path.join(calibration_dir, f"{name}.json")
+
+def _write_json(value, path):
+    with open(path, 'w') as f:
+        json.dump(value, f, indent=2)
+
+# Save a fitted adjustment under a name, with the scalar entries of its report
+def save_calibration(name, adjustment, report=None, calibration_dir=CALIBRATION_DIR):
+    summary = {key: value for key, value in (report or {}).items() if key != 'shares'}
+    path = _calibration_path(name, calibration_dir)
+    # Written atomically so the app never loads a partial parameter set
+    atomic_write(path, lambda tmp_path: _write_json({'adjustment': adjustment, 'report': summary,
+                                                     'fitted_at': time.time()}, tmp_path))
+    return path
+
+# Adjustment saved under a name, in the form adjust_willingness_scores takes
+def load_calibration(name, calibration_dir=CALIBRATION_DIR):
+    with open(_calibration_path(name, calibration_dir)) as f:
+        adjustment = json.load(f)['adjustment']
+    adjustment['assumption_rates'] = {int(code): rate for code, rate in adjustment['assumption_rates'].items()}
+    return adjustment
+
+# Names of the saved parameter sets, most recently fitted first
+def list_calibrations(calibration_dir=CALIBRATION_DIR):
+    if not os.path.isdir(calibration_dir):
+        return []
+    paths = [entry.path for entry in os.scandir(calibration_dir) if entry.name.endswith('.json')]
+    return [os.path.basename(path)[:-len('.json')] for path in sorted(paths, key=os.path.getmtime, reverse=True)]
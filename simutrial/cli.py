@@ -0,0 +1,268 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+import polars as pl
+
+# Command-line entry point for batch jobs, e.g.
+#   simutrial simulate --input cohort.parquet --sims 1000 --workers 16
+#   simutrial sweep --input cohort.parquet --grid grid.json --output sweep.parquet
+#   simutrial score emr_extract.csv scored.parquet
+#   simutrial worker --processes 4        (runs jobs queued by the app, see jobs.py)
+#   simutrial calibrate --input emr_extract.csv --name diabetes   (see calibration.py)
+# Only the modules a command needs are imported; Streamlit and the plotting stack never are,
+# and Mesa only when its engine is selected.
+
+# Historical participation data the willingness model is trained on (as in app.py)
+TRAINING_DATA_PATH = 'editedclinicaltrial_copy.csv'
+
+# A JSON argument is either inline JSON or the path of a .json file
+def _json_argument(value):
+    if value is None:
+        return None
+    if os.path.exists(value):
+        with open(value) as f:
+            return json.load(f)
+    return json.loads(value)
+
+# Scalar entries of a result dict, as plain Python values for JSON output
+def _scalars(results):
+    scalars = {}
+    for key, value in results.items():
+        if isinstance(value, (np.generic, int, float, str)):
+            scalars[key] = value.item() if isinstance(value, np.generic) else value
+    return scalars
+
+# Scored cohort from a Parquet/IPC file, or from a raw EMR CSV/TSV. A raw extract always gets the derived
+# model features and normalized columns targeting specs refer to; it is only scored when needs_scores
+def _load_cohort(args, needs_scores):
+    from simutrial.targeting import scan_cohort
+
+    lf = scan_cohort(args.input)
+    if not args.input.endswith(('.csv', '.tsv')) or 'WillingnessScore' in lf.collect_schema().names():
+        return lf
+
+    from simutrial.normalize import load_column_mapping
+
+    mapping = load_column_mapping(args.mapping)
+    if needs_scores:
+        from simutrial.ingest import ingest_upload
+        from simutrial.model_cache import load_or_train_willingness_model
+
+        model = load_or_train_willingness_model(args.training_data)
+        return ingest_upload(args.input, mapping, model).lazy()
+
+    from simutrial.normalize import normalize_columns
+    from simutrial.streaming import scan_with_model_features
+
+    separator = '\t' if args.input.endswith('.tsv') else ','
+    return normalize_columns(scan_with_model_features(args.input, separator).drop('Age'), mapping)
+
+# Scored strata of the targeted patients, collected without materializing per-patient rows:
+# a raw extract is scored cell by cell while it is scanned, a scored cohort is grouped in the scan
+def _load_strata(args, spec):
+    from simutrial.ingest import scan_willingness_strata
+    from simutrial.targeting import scan_cohort, target_cohort
+
+    lf = scan_cohort(args.input)
+    if args.input.endswith(('.csv', '.tsv')) and 'WillingnessScore' not in lf.collect_schema().names():
+        from simutrial.model_cache import load_or_train_willingness_model
+        from simutrial.normalize import load_column_mapping
+        from simutrial.streaming import scan_scored_strata
+
+        model = load_or_train_willingness_model(args.training_data)
+        separator = '\t' if args.input.endswith('.tsv') else ','
+        return scan_scored_strata(args.input, model, spec, separator, mapping=load_column_mapping(args.mapping))
+    return scan_willingness_strata(target_cohort(lf, spec, ['WillingnessScore'])).collect(engine='streaming')
+
+def simulate(args):
+    from simutrial.simulation import check_engine_options, run_enrollment_simulation, run_simulations
+    from simutrial.targeting import target_cohort
+
+    engine = args.engine
+    if args.workers and args.workers > 1 and engine == "vectorized":
+        engine = "parallel"  # Asking for workers means sharding replicates across processes
+    check_engine_options(engine, args.sampling, args.target_half_width, args.workers)  # Before the cohort is loaded
+    spec = _json_argument(args.targeting) or {}
+
+    if engine == "stratified" and args.consent_model == "willingness":
+        # Memory grows with the number of distinct demographic cells, not with the number of patients
+        df = _load_strata(args, spec)
+        patients = int(df['count'].sum())
+    else:
+        # Read only the columns the engine needs; Mesa builds agents from full rows
+        lf = _load_cohort(args, needs_scores=args.consent_model == "willingness")
+        if engine == "mesa":
+            columns = None
+        elif args.consent_model == "willingness":
+            columns = ['WillingnessScore']
+        else:
+            columns = [lf.collect_schema().names()[0]]  # Only the number of patients matters
+        df = target_cohort(lf, spec, columns).collect()
+        patients = len(df)
+
+    results = run_simulations(df, args.consent_min, args.consent_max, args.sims, engine=engine, seed=args.seed,
+                              target_half_width=args.target_half_width, sampling=args.sampling,
+                              consent_model=args.consent_model, workers=args.workers)
+    output = {'patients': patients, 'engine': engine, **_scalars(results)}
+
+    if args.periods:
+        enrollment = run_enrollment_simulation(df, args.consent_min, args.consent_max, args.sims, args.periods,
+                                               args.study_size, seed=args.seed, engine=engine, sampling=args.sampling,
+                                               consent_model=args.consent_model)
+        output['enrollment'] = {
+            'engine': enrollment['engine'],
+            'time_to_target_percentiles': {str(p): float(weeks) for p, weeks in enrollment['time_to_target_percentiles'].items()},
+            'probability_target_reached': float(enrollment['probability_target_reached'])
+        }
+
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+
+def sweep(args):
+    from simutrial.sweep import run_sweep
+
+    grid = _json_argument(args.grid)
+    if 'consent_rate' in grid:
+        grid['consent_rate'] = [tuple(consent_rate) for consent_rate in grid['consent_rate']]
+    for spec in grid.get('targeting', {}).values():
+        if spec.get('age') is not None:
+            spec['age'] = tuple(spec['age'])
+
+    df_scored = _load_cohort(args, needs_scores=args.consent_model == "willingness").collect()
+    results = run_sweep(df_scored, grid, args.sims, consent_model=args.consent_model, seed=args.seed,
+                        sampling=args.sampling, workers=args.workers, output_path=args.output)
+    if not args.output:
+        with pl.Config(tbl_rows=-1, tbl_cols=-1):
+            print(results)
+
+def score(args):
+    from simutrial.model_cache import load_or_train_willingness_model
+    from simutrial.normalize import load_column_mapping
+    from simutrial.streaming import stream_willingness_scores
+
+    model = load_or_train_willingness_model(args.training_data)
+    separator = '\t' if args.input.endswith('.tsv') else ','
+    cells = stream_willingness_scores(args.input, args.output, model, load_column_mapping(args.mapping), separator=separator)
+    print(f"Scored {len(cells)} distinct feature cells into {args.output}")
+
+def worker(args):
+    from simutrial.jobs import run_worker, start_worker_pool
+
+    if args.processes > 1:
+        for process in start_worker_pool(args.processes, args.db):
+            process.wait()
+    else:
+        run_worker(args.db, poll_interval=args.poll_interval)
+
+def status(args):
+    from simutrial.jobs import job_status, list_jobs
+
+    if args.job_id:
+        print(json.dumps(job_status(args.job_id, args.db), indent=2))
+    else:
+        for job in list_jobs(db_path=args.db):
+            print(f"{job['id']}  {job['kind']:<8}  {job['status']:<7}  {job['progress'] * 100:5.1f}%")
+
+def calibrate(args):
+    from simutrial.calibration import fit_adjustment, save_calibration, trial_targets_frame
+    from simutrial.model_cache import load_or_train_willingness_model
+    from simutrial.streaming import scan_feature_cells, scan_with_model_features
+    from simutrial.trial_api import fetch_baseline_studies
+
+    if args.trials:
+        with open(args.trials) as f:
+            nct_ids = [line.strip() for line in f if line.strip()]
+    else:
+        from simutrial.trial_catalog import CATALOG_DB_PATH, catalog_nct_ids
+        nct_ids = catalog_nct_ids(args.catalog or CATALOG_DB_PATH, with_results=True)
+
+    separator = '\t' if args.input.endswith('.tsv') else ','
+    cells = scan_feature_cells(scan_with_model_features(args.input, separator)).collect(engine='streaming')
+    model = load_or_train_willingness_model(args.training_data)
+    targets = trial_targets_frame(fetch_baseline_studies(nct_ids))
+    adjustment, report = fit_adjustment(cells, targets, model)
+    path = save_calibration(args.name, adjustment, report)
+
+    summary = {key: value for key, value in report.items() if key != 'shares'}
+    print(json.dumps({**summary, 'adjustment': adjustment}, indent=2))
+    with pl.Config(tbl_rows=-1):
+        print(report['shares'])
+    print(f"Saved to {path}")
+
+def _add_cohort_arguments(parser):
+    parser.add_argument('--input', required=True, help="Scored cohort (.parquet/.arrow) or raw EMR extract (.csv/.tsv)")
+    parser.add_argument('--sims', type=int, default=100, help="Number of simulations")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (more than one shards replicates)")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--consent-model', choices=["willingness", "uniform"], default="willingness")
+    parser.add_argument('--sampling', choices=["independent", "antithetic", "sobol"], default="independent")
+    parser.add_argument('--training-data', default=TRAINING_DATA_PATH)
+    parser.add_argument('--mapping', default='column_mapping.json')
+
+def build_parser():
+    from simutrial.jobs import JOB_DB_PATH
+    from simutrial.simulation import ENGINES
+
+    parser = argparse.ArgumentParser(prog='simutrial', description="Patient recruitment simulation")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    simulate_parser = commands.add_parser('simulate', help="Simulate consent for one cohort")
+    _add_cohort_arguments(simulate_parser)
+    simulate_parser.add_argument('--engine', choices=ENGINES, default="vectorized")
+    simulate_parser.add_argument('--consent-min', type=float, default=0.2)
+    simulate_parser.add_argument('--consent-max', type=float, default=0.8)
+    simulate_parser.add_argument('--targeting', help="Targeting spec as JSON or a .json file (see targeting.py)")
+    simulate_parser.add_argument('--target-half-width', type=float, default=None,
+                                 help="Stop early once the CI half-width (percentage points) is reached")
+    simulate_parser.add_argument('--study-size', type=int, default=100)
+    simulate_parser.add_argument('--periods', type=int, default=None, help="Also simulate enrollment over this many weeks")
+    simulate_parser.add_argument('--output', help="Write the JSON results here instead of printing them")
+    simulate_parser.set_defaults(run=simulate)
+
+    sweep_parser = commands.add_parser('sweep', help="Evaluate a scenario grid (see sweep.py)")
+    _add_cohort_arguments(sweep_parser)
+    sweep_parser.add_argument('--grid', required=True, help="Scenario grid as JSON or a .json file")
+    sweep_parser.add_argument('--output', help="Write the results table to this Parquet file")
+    sweep_parser.set_defaults(run=sweep)
+
+    score_parser = commands.add_parser('score', help="Stream willingness scores for an EMR extract")
+    score_parser.add_argument('input', help="EMR extract (.csv/.tsv)")
+    score_parser.add_argument('output', help="Scored output (.parquet/.arrow)")
+    score_parser.add_argument('--training-data', default=TRAINING_DATA_PATH)
+    score_parser.add_argument('--mapping', default='column_mapping.json')
+    score_parser.set_defaults(run=score)
+
+    worker_parser = commands.add_parser('worker', help="Run queued simulation jobs (see jobs.py)")
+    worker_parser.add_argument('--db', default=JOB_DB_PATH, help="Job queue database")
+    worker_parser.add_argument('--processes', type=int, default=1, help="Number of worker processes")
+    worker_parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds between queue checks when idle")
+    worker_parser.set_defaults(run=worker)
+
+    calibrate_parser = commands.add_parser('calibrate', help="Fit the willingness adjustments to historical trial baselines")
+    calibrate_parser.add_argument('--input', required=True, help="EMR extract (.csv/.tsv) whose patients the trials drew from")
+    calibrate_parser.add_argument('--name', default='default', help="Name the app lists the fitted parameter set under")
+    calibrate_parser.add_argument('--trials', help="File of NCT IDs, one per line (default: catalog studies with results)")
+    calibrate_parser.add_argument('--catalog', help="Trial catalog database (default: the one trial_catalog.py syncs)")
+    calibrate_parser.add_argument('--training-data', default=TRAINING_DATA_PATH)
+    calibrate_parser.set_defaults(run=calibrate)
+
+    status_parser = commands.add_parser('status', help="Show queued jobs, or one job by ID")
+    status_parser.add_argument('job_id', nargs='?')
+    status_parser.add_argument('--db', default=JOB_DB_PATH, help="Job queue database")
+    status_parser.set_defaults(run=status)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.run(args)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
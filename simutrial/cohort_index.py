@@ -0,0 +1,129 @@
+import bisect
+
+import numpy as np
+import polars as pl
+
+from simutrial.patientVis import censreg_codes, model_features, race_mapping
+
+# Bitmap index over demographic strata of a scored cohort, built once at ingestion.
+# Every bitmap is a packed NumPy bool array (np.packbits), so a targeting spec (see targeting.py)
+# resolves to a row set with bitwise AND/OR over n/8 bytes instead of a scan of the frame.
+# Ages are indexed in whole years as cumulative "age <= year" bitmaps, so any range is two lookups;
+# the exact ages of the one-year bucket a fractional bound falls in are compared like targeting.targeting_expr does.
+
+def _bitmap(mask):
+    return np.packbits(np.asarray(mask, dtype=bool))
+
+# Columns holding 0/1 condition flags (hypertension, heart_disease, ...)
+def _condition_columns(df):
+    columns = []
+    for col in df.columns:
+        if col in model_features or not df.schema[col].is_integer():
+            continue
+        if set(df[col].drop_nulls().unique().to_list()) <= {0, 1}:
+            columns.append(col)
+    return columns
+
+def build_cohort_index(df):
+    bitmaps = {'all': _bitmap(np.ones(len(df), dtype=bool))}
+
+    for column in ['gender', 'RaceEthn', 'CENSREG', 'location']:
+        if column not in df.columns:
+            continue
+        values = df[column]
+        for value in values.drop_nulls().unique().to_list():
+            bitmaps[(column, value)] = _bitmap((values == value).fill_null(False).to_numpy())
+
+    for column in _condition_columns(df):
+        bitmaps[('condition', column)] = _bitmap((df[column] == 1).fill_null(False).to_numpy())
+
+    age_years, ages = [], None
+    if 'age' in df.columns:
+        ages = df['age'].cast(pl.Float64).fill_nan(None).to_numpy()  # NaN for missing ages
+        years = np.floor(ages)
+        bitmaps['age_known'] = _bitmap(~np.isnan(years))
+        age_years = sorted(int(year) for year in np.unique(years[~np.isnan(years)]))
+        for year in age_years:
+            bitmaps[('age_le', year)] = _bitmap(years <= year)
+
+    return {
+        'n_rows': len(df),
+        'bitmaps': bitmaps,
+        'age_years': age_years,
+        'ages': ages,
+        'willingness': df['WillingnessScore'].to_numpy() if 'WillingnessScore' in df.columns else None
+    }
+
+def _any_of(index, keys):
+    result = np.zeros_like(index['bitmaps']['all'])
+    for key in keys:
+        if key in index['bitmaps']:
+            result |= index['bitmaps'][key]
+    return result
+
+# Bitmap of patients whose whole-year age is <= year
+def _age_at_most(index, year):
+    years = index['age_years']
+    position = bisect.bisect_right(years, year)
+    if position == 0:
+        return np.zeros_like(index['bitmaps']['all'])
+    return index['bitmaps'][('age_le', years[position - 1])]
+
+# Bitmap of the patients in whole-year bucket `year` whose exact age satisfies compare(age, bound)
+def _age_bucket_where(index, year, compare, bound):
+    bucket = _age_at_most(index, year) & ~_age_at_most(index, year - 1)
+    rows = np.flatnonzero(np.unpackbits(bucket, count=index['n_rows']))
+    mask = np.zeros(index['n_rows'], dtype=bool)
+    mask[rows[compare(index['ages'][rows], bound)]] = True
+    return _bitmap(mask)
+
+# Bitmaps of patients with age <= age_max and age >= age_min, on the exact ages targeting_expr compares:
+# whole buckets inside the bound come from the cumulative bitmaps, the bucket holding the bound is refined
+def _age_at_most_exact(index, age_max):
+    year = int(np.floor(age_max))
+    return _age_at_most(index, year - 1) | _age_bucket_where(index, year, np.less_equal, age_max)
+
+def _age_at_least_exact(index, age_min):
+    year = int(np.floor(age_min))
+    if year == age_min:
+        return ~_age_at_most(index, year - 1)  # Whole years: floor(age) >= year exactly when age >= year
+    return ~_age_at_most(index, year) | _age_bucket_where(index, year, np.greater_equal, age_min)
+
+# Resolve a targeting spec to a packed bitmap of matching rows
+def resolve_targeting(index, spec):
+    mask = index['bitmaps']['all'].copy()
+
+    age_min, age_max = spec.get('age') or (None, None)
+    if age_min is not None or age_max is not None:
+        mask &= index['bitmaps'].get('age_known', np.zeros_like(mask))
+        if age_max is not None:
+            mask &= _age_at_most_exact(index, age_max)
+        if age_min is not None:
+            mask &= _age_at_least_exact(index, age_min)
+
+    if spec.get('gender'):
+        mask &= _any_of(index, [('gender', gender) for gender in spec['gender']])
+    if spec.get('race'):
+        mask &= _any_of(index, [('RaceEthn', race_mapping[race]) for race in spec['race']])
+    if spec.get('region'):
+        mask &= _any_of(index, [('CENSREG', float(censreg_codes[region])) for region in spec['region']])
+    if spec.get('location'):
+        mask &= _any_of(index, [('location', state) for state in spec['location']])
+    if spec.get('conditions'):
+        mask &= _any_of(index, [('condition', col) for col in spec['conditions']])
+    return mask
+
+# Row indices of the targeted patients
+def cohort_rows(index, spec):
+    return np.flatnonzero(np.unpackbits(resolve_targeting(index, spec), count=index['n_rows']))
+
+# Cohort size and aggregate willingness for a targeting spec, without touching the frame
+def cohort_summary(index, spec):
+    rows = cohort_rows(index, spec)
+    willingness = index['willingness'][rows] if index['willingness'] is not None else np.array([])
+    scored = willingness[~np.isnan(willingness)]
+    return {
+        'count': len(rows),
+        'mean_willingness': scored.mean() if len(scored) else float('nan'),
+        'expected_consents': scored.sum()
+    }
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import threading
+import time
+
+# File helpers shared by the on-disk caches under .simutrial_cache: atomic writes, and cache
+# directories of entry files evicted least recently used (a hit refreshes the entry's modification time)
+
+# Write path atomically: write(tmp_path) fills a temporary file in the same directory, which then
+# replaces path, so a concurrent reader never loads a partial file. The temporary name is unique per
+# call (mkstemp), so sessions running as threads of one process never write to the same temporary file
+def atomic_write(path, write):
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f"{os.path.basename(path)}.", suffix='.tmp', dir=directory)
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+# Refresh an entry's modification time after a hit. Returns False if it was evicted in the meantime
+def touch_entry(path):
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+def _entries(cache_dir, prefix, suffix):
+    entries = []
+    try:
+        scan = list(os.scandir(cache_dir))
+    except FileNotFoundError:
+        return entries
+    for entry in scan:
+        if entry.name.startswith(prefix) and entry.name.endswith(suffix):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    return entries
+
+# Delete entries named prefix...suffix that are unused for longer than ttl, then least recently used
+# ones until the directory fits in max_bytes. Returns the bytes left
+def evict_lru(cache_dir, max_bytes, prefix, suffix, ttl=None):
+    now = time.time()
+    entries = _entries(cache_dir, prefix, suffix)
+    total = sum(size for _, size, _ in entries)
+    for mtime, size, path in sorted(entries):
+        expired = ttl is not None and now - mtime > ttl
+        if not expired and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:  # Still open elsewhere (e.g. a memory-mapped cohort on Windows); retried next time
+            continue
+        total -= size
+    return total
+
+# Bytes per cache directory as of its last scan plus what this process wrote since. Writes only
+# rescan (and evict) once the running total exceeds the limit, rather than after every write
+_dir_bytes = {}
+_dir_bytes_lock = threading.Lock()
+
+# Eviction frees space down to this fraction of the limit, so a full directory is not rescanned on every write
+EVICT_TO_FRACTION = 0.9
+
+# Atomically write an entry into an LRU cache directory, evicting when it may have outgrown max_bytes.
+# Other processes' writes are picked up at the next scan, so the limit can be overshot by their share
+def store_lru_entry(path, write, max_bytes, prefix, suffix, ttl=None):
+    atomic_write(path, write)
+    cache_dir = os.path.abspath(os.path.dirname(path) or '.')
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:  # Already evicted by another process
+        return
+    with _dir_bytes_lock:
+        total = _dir_bytes.get(cache_dir)
+        if total is not None and total + size <= max_bytes:
+            _dir_bytes[cache_dir] = total + size
+            return
+    total = evict_lru(cache_dir, int(max_bytes * EVICT_TO_FRACTION), prefix, suffix, ttl)
+    with _dir_bytes_lock:
+        _dir_bytes[cache_dir] = total
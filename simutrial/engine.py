@@ -0,0 +1,332 @@
+import warnings
+
+import numpy as np
+
+# Staffing heuristics shared by every simulation engine
+PATIENTS_PER_STAFF = 50  # Assume 1 staff per 50 consenting patients
+PATIENTS_PER_SITE = 100  # Assume 1 site per 100 consenting patients
+
+# Upper bound on the number of consent draws held in memory at once
+MAX_BATCH_ELEMENTS = 1 << 22
+
+# Number of replicates that can be drawn together without exceeding MAX_BATCH_ELEMENTS
+def replicate_batch_size(n_patients, num_simulations):
+    return int(max(1, min(num_simulations, MAX_BATCH_ELEMENTS // max(n_patients, 1))))
+
+# How the consent uniforms are drawn. "antithetic" pairs each replicate's uniforms u with 1 - u;
+# "sobol" uses scrambled Sobol points in SOBOL_RANDOMIZATIONS independently scrambled blocks,
+# so the precision of the mean can still be estimated from the spread of the block means
+SAMPLING_METHODS = ("independent", "antithetic", "sobol")
+SOBOL_RANDOMIZATIONS = 8
+
+def _sobol_block_size(num_simulations):
+    return -(-num_simulations // SOBOL_RANDOMIZATIONS)
+
+# Group of each replicate; group means are independent draws of the Monte Carlo estimate
+def sampling_groups(num_simulations, sampling="independent"):
+    replicates = np.arange(num_simulations)
+    if sampling == "antithetic":
+        return replicates // 2
+    if sampling == "sobol":
+        return replicates // _sobol_block_size(num_simulations)
+    return replicates
+
+# Variance of the mean of per-replicate values under the given sampling method
+def mean_estimator_variance(values, sampling="independent"):
+    values = np.asarray(values, dtype=np.float64)
+    groups = sampling_groups(len(values), sampling)
+    group_means = np.bincount(groups, weights=values) / np.bincount(groups)
+    if len(group_means) < 2:
+        return np.nan
+    return np.var(group_means, ddof=1) / len(group_means)
+
+# Yield (start, stop, blocks) covering all replicates, where blocks holds one matrix of uniforms
+# per entry of widths (e.g. one column per patient) for replicates start..stop
+def uniform_batches(widths, num_simulations, sampling="independent", rng=None):
+    if sampling not in SAMPLING_METHODS:
+        raise ValueError(f"Unknown sampling method: {sampling}")
+    rng = np.random.default_rng(rng)
+    total = sum(widths)
+    splits = np.cumsum(widths)[:-1]
+    batch = replicate_batch_size(total, num_simulations)
+
+    if sampling == "sobol":
+        from scipy.stats import qmc  # SciPy's stats package is slow to import and only needed here
+
+        block = _sobol_block_size(num_simulations)
+        dims = min(total, qmc.Sobol.MAXDIM)
+        # Columns beyond Sobol's dimension limit reuse a dimension under an independent random shift,
+        # which keeps every uniform marginally exact
+        columns = np.arange(total) % dims
+        for block_start in range(0, num_simulations, block):
+            block_stop = min(block_start + block, num_simulations)
+            sampler = qmc.Sobol(dims, scramble=True, rng=rng)
+            shift = rng.random(total) if total > dims else None
+            for start in range(block_start, block_stop, batch):
+                stop = min(start + batch, block_stop)
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore", UserWarning)  # Balance warning for non power-of-2 sizes
+                    points = sampler.random(stop - start)
+                if shift is not None:
+                    points = (points[:, columns] + shift) % 1.0
+                yield start, stop, np.split(points, splits, axis=1)
+        return
+
+    if sampling == "antithetic":
+        batch = max(2, batch - batch % 2)  # Keep each antithetic pair within one batch
+    for start in range(0, num_simulations, batch):
+        stop = min(start + batch, num_simulations)
+        if sampling == "antithetic":
+            half = rng.random((-(-(stop - start) // 2), total), dtype=np.float32)
+            draws = np.empty((2 * len(half), total), dtype=np.float32)
+            draws[0::2] = half
+            draws[1::2] = 1 - half
+            yield start, stop, np.split(draws[:stop - start], splits, axis=1)
+        else:
+            yield start, stop, [rng.random((stop - start, width), dtype=np.float32) for width in widths]
+
+# Draw consent counts for all replicates from per-patient willingness scores
+def simulate_consent_counts(willingness, num_simulations, rng=None, progress=None, sampling="independent"):
+    willingness = np.asarray(willingness, dtype=np.float64)
+    n_patients = len(willingness)
+    counts = np.empty(num_simulations, dtype=np.int64)
+
+    for start, stop, (draws,) in uniform_batches((n_patients,), num_simulations, sampling, rng):
+        # One Bernoulli trial per patient per replicate; NaN scores never consent
+        counts[start:stop] = np.count_nonzero(draws < willingness, axis=1)
+        if progress is not None:
+            progress(stop / num_simulations)
+    return counts
+
+# Draw consent counts when each patient's consent probability is uniform on [min, max]
+def simulate_uniform_consent_counts(n_patients, consent_rate_min, consent_rate_max, num_simulations, rng=None, progress=None,
+                                    sampling="independent"):
+    counts = np.empty(num_simulations, dtype=np.int64)
+
+    for start, stop, (rate_draws, consent_draws) in uniform_batches((n_patients, n_patients), num_simulations, sampling, rng):
+        consent_probability = consent_rate_min + (consent_rate_max - consent_rate_min) * rate_draws
+        counts[start:stop] = np.count_nonzero(consent_draws < consent_probability, axis=1)
+        if progress is not None:
+            progress(stop / num_simulations)
+    return counts
+
+# Turn per-replicate consent counts into the result dict shown in the app
+def summarize_consent_counts(consent_results, n_patients, sampling="independent"):
+    consent_results = np.minimum(np.asarray(consent_results, dtype=np.int64), n_patients)
+    num_simulations = len(consent_results)
+
+    staff_requirements = np.maximum(1, consent_results // PATIENTS_PER_STAFF)
+    site_recommendations = np.maximum(1, consent_results // PATIENTS_PER_SITE)
+
+    mean_consent_rate = (np.mean(consent_results) / n_patients) * 100
+    confidence_interval = (np.std(consent_results) * 1.96 / np.sqrt(num_simulations)) / n_patients * 100
+    variance_reduction = 1.0
+    if sampling != "independent" and len(np.unique(sampling_groups(num_simulations, sampling))) >= 2:
+        # Replicates are not independent, so the precision comes from the spread of the group means;
+        # the reduction is relative to independent sampling with the same number of replicates.
+        # A single pair or block has no spread, and is summarized like independent replicates
+        estimator_variance = mean_estimator_variance(consent_results, sampling)
+        independent_variance = np.var(consent_results) / num_simulations
+        confidence_interval = 1.96 * np.sqrt(estimator_variance) / n_patients * 100
+        variance_reduction = independent_variance / estimator_variance if estimator_variance > 0 else np.inf
+
+    return {
+        "mean_consent_rate": mean_consent_rate,
+        "confidence_interval": confidence_interval,
+        "staff_requirements": staff_requirements.tolist(),
+        "site_recommendations": site_recommendations.tolist(),
+        "mean_staff": np.mean(staff_requirements),
+        "mean_sites": np.mean(site_recommendations),
+        "num_simulations": num_simulations,
+        "sampling": sampling,
+        "variance_reduction": variance_reduction
+    }
+
+# Consent counts for several targeted subsets of one cohort under common random numbers: a patient
+# sees the same uniforms in every scenario, so differences between scenarios are not swamped by
+# sampling noise. scenario_rows holds row indices into willingness (None for the whole cohort);
+# returns counts of shape (number of scenarios, num_simulations)
+def simulate_scenario_consent_counts(willingness, scenario_rows, num_simulations, rng=None, progress=None,
+                                     sampling="independent"):
+    willingness = np.asarray(willingness, dtype=np.float64)
+    counts = np.empty((len(scenario_rows), num_simulations), dtype=np.int64)
+
+    for start, stop, (draws,) in uniform_batches((len(willingness),), num_simulations, sampling, rng):
+        consented = draws < willingness
+        for i, rows in enumerate(scenario_rows):
+            counts[i, start:stop] = np.count_nonzero(consented if rows is None else consented[:, rows], axis=1)
+        if progress is not None:
+            progress(stop / num_simulations)
+    return counts
+
+# Consent counts for several [min, max] consent-rate ranges under common random numbers.
+# Scenario i applies consent_rate_ranges[i] to scenario_rows[i] (the whole cohort when not given)
+def simulate_uniform_scenario_consent_counts(n_patients, consent_rate_ranges, num_simulations, rng=None, progress=None,
+                                             sampling="independent", scenario_rows=None):
+    scenario_rows = scenario_rows if scenario_rows is not None else [None] * len(consent_rate_ranges)
+    counts = np.empty((len(consent_rate_ranges), num_simulations), dtype=np.int64)
+
+    for start, stop, (rate_draws, consent_draws) in uniform_batches((n_patients, n_patients), num_simulations, sampling, rng):
+        for i, ((consent_rate_min, consent_rate_max), rows) in enumerate(zip(consent_rate_ranges, scenario_rows)):
+            if rows is None:
+                rates, consents = rate_draws, consent_draws
+            else:
+                rates, consents = rate_draws[:, rows], consent_draws[:, rows]
+            consent_probability = consent_rate_min + (consent_rate_max - consent_rate_min) * rates
+            counts[i, start:stop] = np.count_nonzero(consents < consent_probability, axis=1)
+        if progress is not None:
+            progress(stop / num_simulations)
+    return counts
+
+# Each scenario's mean consent rate and its difference from the first (baseline) scenario, with the
+# variance reduction on that difference relative to independent runs of the same size
+def compare_scenarios(scenario_counts, scenario_patients, sampling="independent"):
+    rates = np.asarray(scenario_counts, dtype=np.float64) / np.asarray(scenario_patients, dtype=np.float64)[:, None] * 100
+    comparison = []
+    for rate in rates:
+        difference = rate - rates[0]
+        estimator_variance = mean_estimator_variance(difference, sampling)
+        independent_variance = (np.var(rate) + np.var(rates[0])) / len(rate)
+        comparison.append({
+            "mean_consent_rate": rate.mean(),
+            "difference": difference.mean(),
+            "difference_interval": 1.96 * np.sqrt(estimator_variance),
+            "variance_reduction": independent_variance / estimator_variance if estimator_variance > 0 else np.nan
+        })
+    return comparison
+
+# Draw cumulative enrollment per screening window; consented patients leave the pool
+def simulate_enrollment_curves(willingness, num_simulations, num_periods, rng=None, progress=None, sampling="independent"):
+    willingness = np.asarray(willingness, dtype=np.float64)
+    n_patients = len(willingness)
+    curves = np.empty((num_simulations, num_periods), dtype=np.int64)
+
+    # A patient who stays in the pool until consenting consents in a geometric window,
+    # so one inverse-CDF draw per patient replaces one Bernoulli draw per window
+    active = willingness > 0  # Zero and NaN scores never consent
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_stay = np.log1p(-np.where(active, willingness, 0.0))
+
+    for start, stop, (draws,) in uniform_batches((n_patients,), num_simulations, sampling, rng):
+        u = 1 - draws
+        with np.errstate(divide="ignore", invalid="ignore"):
+            window = np.ceil(np.log(u) / log_stay) - 1
+        window = np.where(active, np.clip(window, 0, num_periods), num_periods).astype(np.int64)
+
+        # Window index num_periods collects patients who never consent within the horizon
+        offsets = np.arange(stop - start)[:, None] * (num_periods + 1)
+        per_window = np.bincount((window + offsets).ravel(), minlength=(stop - start) * (num_periods + 1))
+        curves[start:stop] = np.cumsum(per_window.reshape(stop - start, num_periods + 1)[:, :num_periods], axis=1)
+        if progress is not None:
+            progress(stop / num_simulations)
+    return curves
+
+# Enrollment curve bands and time-to-target percentiles (in windows) across replicates
+def summarize_enrollment(curves, study_size, percentiles=(10, 50, 90)):
+    reached = curves >= study_size
+    hit = reached.any(axis=1)
+    # Replicates that miss the target within the horizon count as infinitely slow
+    time_to_target = np.where(hit, np.argmax(reached, axis=1) + 1, np.inf)
+    target_percentiles = np.percentile(time_to_target, percentiles, method="higher")
+
+    return {
+        "mean_curve": curves.mean(axis=0),
+        "curve_percentiles": {p: np.percentile(curves, p, axis=0) for p in percentiles},
+        "time_to_target": time_to_target,
+        "time_to_target_percentiles": dict(zip(percentiles, target_percentiles)),
+        "probability_target_reached": hit.mean()
+    }
+
+# Consent counts from patient strata: one binomial draw per stratum instead of one Bernoulli per patient
+def simulate_stratified_consent_counts(stratum_willingness, stratum_counts, num_simulations, rng=None, progress=None):
+    rng = np.random.default_rng(rng)
+    stratum_willingness = np.nan_to_num(np.asarray(stratum_willingness, dtype=np.float64), nan=0.0)
+    stratum_counts = np.asarray(stratum_counts, dtype=np.int64)
+    counts = np.empty(num_simulations, dtype=np.int64)
+
+    batch = replicate_batch_size(len(stratum_counts), num_simulations)
+    for start in range(0, num_simulations, batch):
+        stop = min(start + batch, num_simulations)
+        draws = rng.binomial(stratum_counts, stratum_willingness, size=(stop - start, len(stratum_counts)))
+        counts[start:stop] = draws.sum(axis=1)
+        if progress is not None:
+            progress(stop / num_simulations)
+    return counts
+
+# Enrollment curves from patient strata: each window draws consents among each stratum's remaining pool
+def simulate_stratified_enrollment_curves(stratum_willingness, stratum_counts, num_simulations, num_periods, rng=None, progress=None):
+    rng = np.random.default_rng(rng)
+    stratum_willingness = np.nan_to_num(np.asarray(stratum_willingness, dtype=np.float64), nan=0.0)
+    stratum_counts = np.asarray(stratum_counts, dtype=np.int64)
+    curves = np.empty((num_simulations, num_periods), dtype=np.int64)
+
+    batch = replicate_batch_size(len(stratum_counts), num_simulations)
+    for start in range(0, num_simulations, batch):
+        stop = min(start + batch, num_simulations)
+        remaining = np.broadcast_to(stratum_counts, (stop - start, len(stratum_counts))).copy()
+        enrolled = np.zeros(stop - start, dtype=np.int64)
+        for period in range(num_periods):
+            consented = rng.binomial(remaining, stratum_willingness)
+            remaining -= consented
+            enrolled += consented.sum(axis=1)
+            curves[start:stop, period] = enrolled
+        if progress is not None:
+            progress(stop / num_simulations)
+    return curves
+
+# Replicates drawn together that the sampling method correlates (an antithetic pair, a Sobol block),
+# i.e. the replicates averaged into one independent draw of the Monte Carlo estimate
+def _sampling_unit(batch_size, sampling):
+    if sampling == "antithetic":
+        return 2
+    if sampling == "sobol":
+        return batch_size // SOBOL_RANDOMIZATIONS
+    return 1
+
+# Draw replicates in batches until the 95% CI half-width of the mean consent rate (in percentage
+# points, as reported by summarize_consent_counts) reaches the target, or max_simulations is hit.
+# draw_batch(size, sampling=sampling) returns consent counts for `size` new replicates. No more than
+# max_simulations replicates are drawn. With antithetic sampling batches hold whole pairs (an odd cap
+# leaves one replicate undrawn); with Sobol sampling every batch has the same size, SOBOL_RANDOMIZATIONS
+# scrambled blocks, and the cap is rounded down to whole batches. The running variance is that of the
+# pair or block means, so summarize_consent_counts(counts, n_patients, sampling) groups the result the same way
+def adaptive_consent_counts(draw_batch, n_patients, target_half_width, max_simulations,
+                            batch_size=25, min_simulations=20, progress=None, sampling="independent"):
+    if sampling not in SAMPLING_METHODS:
+        raise ValueError(f"Unknown sampling method: {sampling}")
+    if sampling != "independent":
+        step = 2 if sampling == "antithetic" else SOBOL_RANDOMIZATIONS
+        if max_simulations < step:
+            # Not even one whole pair or block per batch: draw every replicate at once
+            return np.asarray(draw_batch(max_simulations, sampling=sampling)).astype(np.int64)
+        batch_size = min(-(-batch_size // step) * step, max_simulations - max_simulations % step)
+        max_simulations -= max_simulations % (step if sampling == "antithetic" else batch_size)
+    unit = _sampling_unit(batch_size, sampling)
+    ddof = 0 if sampling == "independent" else 1  # As in summarize_consent_counts
+
+    batches = []
+    count, mean, m2 = 0, 0.0, 0.0
+    while count * unit < max_simulations:
+        size = min(batch_size, max_simulations - count * unit)
+        batch = np.asarray(draw_batch(size, sampling=sampling), dtype=np.float64)
+        batches.append(batch)
+
+        # Merge the batch's pair/block means into the running Welford mean / sum of squared deviations
+        units = batch.reshape(-1, unit).mean(axis=1)
+        batch_mean = units.mean()
+        batch_m2 = np.sum((units - batch_mean) ** 2)
+        total = count + len(units)
+        delta = batch_mean - mean
+        mean += delta * len(units) / total
+        m2 += batch_m2 + delta ** 2 * count * len(units) / total
+        count = total
+
+        if progress is not None:
+            progress(count * unit / max_simulations)
+        if count <= ddof:
+            continue
+        half_width = 1.96 * np.sqrt(m2 / (count - ddof)) / np.sqrt(count) / n_patients * 100
+        if count * unit >= min_simulations and half_width <= target_half_width:
+            break
+
+    return np.concatenate(batches).astype(np.int64)
@@ -0,0 +1,38 @@
+import polars as pl
+
+from simutrial.normalize import normalize_columns
+from simutrial.patientVis import model_features
+from simutrial.streaming import model_feature_exprs, scan_feature_cells, score_cells_frame
+
+# Parse an uploaded CSV/TSV once into an Arrow-backed Polars frame
+def read_upload(data_file):
+    name = data_file if isinstance(data_file, str) else getattr(data_file, 'name', '')
+    separator = '\t' if name.endswith('.tsv') else ','
+    return pl.read_csv(data_file, separator=separator)
+
+# Attach WillingnessScore to a frame that already carries the derived model features
+def score_frame(df, model, adjustment=None):
+    cell_scores = score_cells_frame(scan_feature_cells(df.lazy()).collect(), model, adjustment=adjustment)
+    return df.join(cell_scores, on=model_features, how='left', maintain_order='left')
+
+# Single-parse ingestion: derive the model features from the raw columns, score, then normalize.
+# The result backs both the targeting UI and the simulation, so scores stay aligned with rows
+def ingest_upload(data_file, mapping, model, adjustment=None):
+    raw = read_upload(data_file)
+    df = score_frame(raw.with_columns(model_feature_exprs(raw.columns)), model, adjustment)
+    return normalize_columns(df.drop('Age'), mapping)
+
+# Strata of identical WillingnessScore with patient counts, as a LazyFrame. Takes scored rows (pandas or
+# Polars, eager or lazy) or scored feature cells that already carry a count column (streaming.scan_scored_strata).
+# Unscored rows form a null stratum, which never consents but still counts as targeted patients
+def scan_willingness_strata(df):
+    if not isinstance(df, (pl.DataFrame, pl.LazyFrame)):
+        df = pl.from_pandas(df[[col for col in ('WillingnessScore', 'count') if col in df.columns]])
+    lf = df.lazy()
+    weight = pl.col('count').sum() if 'count' in lf.collect_schema().names() else pl.len()
+    return lf.group_by('WillingnessScore').agg(weight.cast(pl.Int64).alias('count'))
+
+# Strata scores and patient counts as arrays (NaN for the unscored stratum)
+def willingness_strata(df):
+    strata = scan_willingness_strata(df).collect()
+    return strata['WillingnessScore'].to_numpy(), strata['count'].to_numpy()
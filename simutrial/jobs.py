@@ -0,0 +1,221 @@
+import json
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+import numpy as np
+import polars as pl
+
+from simutrial.disk_cache import atomic_write
+
+# Local job queue for long simulations, backed by SQLite (no broker). The app submits a job with
+# the cohort it targets, a pool of worker processes claims and runs jobs, and anyone holding the
+# job ID can poll its progress and fetch its result, so a job outlives the browser tab that submitted it.
+#   'simulate': params {'simulation': run_simulations kwargs, 'enrollment': run_enrollment_simulation kwargs or None,
+#               'result_key': result_cache key to store the result under, or None}
+#   'sweep':    params are run_sweep kwargs (grid, num_simulations, ...)
+JOB_DIR = os.path.join('.simutrial_cache', 'jobs')
+JOB_DB_PATH = os.path.join(JOB_DIR, 'jobs.sqlite')
+JOB_KINDS = ('simulate', 'sweep')
+
+# A running job whose worker has not sent a heartbeat for this long is handed to another worker
+STALE_JOB_SECONDS = 600
+# Seconds between heartbeats of a running job. They come from a timer thread in the worker, so a job
+# that reports no progress for a long time (a large analytic or Mesa run) is not mistaken for a dead worker
+HEARTBEAT_INTERVAL = 30
+# Minimum time between progress writes from a worker
+PROGRESS_INTERVAL = 0.5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    params TEXT NOT NULL,
+    input_path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    worker TEXT,
+    result_path TEXT,
+    error TEXT,
+    submitted_at REAL NOT NULL,
+    started_at REAL,
+    heartbeat_at REAL,
+    finished_at REAL
+)
+"""
+
+def _connect(db_path):
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode=WAL')  # Readers polling progress never block the workers
+    conn.execute(_SCHEMA)
+    return conn
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+# Queue a job and return its ID. The cohort is written next to the queue for the worker to read
+def submit_job(kind, params, cohort, db_path=JOB_DB_PATH):
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job_id = uuid.uuid4().hex
+    input_path = os.path.join(os.path.dirname(db_path), f"{job_id}.input.parquet")
+    os.makedirs(os.path.dirname(input_path) or '.', exist_ok=True)
+    cohort.write_parquet(input_path)
+
+    conn = _connect(db_path)
+    try:
+        conn.execute(
+            "INSERT INTO jobs (id, kind, params, input_path, status, submitted_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+            (job_id, kind, json.dumps(params, default=_json_default), input_path, time.time())
+        )
+    finally:
+        conn.close()
+    return job_id
+
+# Status row of a job as a dict (None for an unknown ID)
+def job_status(job_id, db_path=JOB_DB_PATH):
+    conn = _connect(db_path)
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    return dict(row) if row is not None else None
+
+# Most recently submitted jobs, newest first
+def list_jobs(limit=20, db_path=JOB_DB_PATH):
+    conn = _connect(db_path)
+    try:
+        rows = conn.execute("SELECT id, kind, status, progress, submitted_at, finished_at FROM jobs "
+                            "ORDER BY submitted_at DESC LIMIT ?", (limit,)).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+
+# Result of a finished job: a dict for 'simulate' jobs, a results frame for 'sweep' jobs
+def job_result(job_id, db_path=JOB_DB_PATH):
+    status = job_status(job_id, db_path)
+    if status is None or status['status'] != 'done':
+        return None
+    if status['kind'] == 'sweep':
+        return pl.read_parquet(status['result_path'])
+    with open(status['result_path']) as f:
+        return json.load(f)
+
+# Atomically take the oldest queued job, first requeueing jobs of workers that stopped reporting
+def _claim_job(conn, worker_id):
+    now = time.time()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute("UPDATE jobs SET status = 'queued', worker = NULL WHERE status = 'running' AND heartbeat_at < ?",
+                     (now - STALE_JOB_SECONDS,))
+        row = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY submitted_at LIMIT 1").fetchone()
+        if row is not None:
+            conn.execute("UPDATE jobs SET status = 'running', worker = ?, progress = 0, started_at = ?, heartbeat_at = ? "
+                         "WHERE id = ?", (worker_id, now, now, row['id']))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return dict(row) if row is not None else None
+
+def _run_job(job, progress):
+    params = json.loads(job['params'])
+    cohort = pl.read_parquet(job['input_path'])
+    job_dir = os.path.dirname(job['input_path'])
+
+    if job['kind'] == 'sweep':
+        from simutrial.sweep import run_sweep
+
+        result_path = os.path.join(job_dir, f"{job['id']}.result.parquet")
+        run_sweep(cohort, progress=progress, output_path=result_path, **params)
+        return result_path
+
+    from simutrial.simulation import run_enrollment_simulation, run_simulations
+
+    result = {'simulation': run_simulations(cohort, **params['simulation'], progress=progress)}
+    if params.get('enrollment'):
+        result['enrollment'] = run_enrollment_simulation(cohort, **params['enrollment'], progress=progress)
+    if params.get('result_key'):
+        from simutrial.result_cache import store_result
+
+        store_result(params['result_key'], result)
+    result_path = os.path.join(job_dir, f"{job['id']}.result.json")
+    atomic_write(result_path, lambda tmp_path: _write_result(result, tmp_path))
+    return result_path
+
+def _write_result(result, path):
+    with open(path, 'w') as f:
+        json.dump(result, f, default=_json_default)
+
+# Refresh a running job's heartbeat every interval seconds until stop is set (on its own connection,
+# since SQLite connections are not shared between threads)
+def _send_heartbeats(db_path, job_id, worker_id, stop, interval):
+    conn = _connect(db_path)
+    try:
+        while not stop.wait(interval):
+            conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                         (time.time(), job_id, worker_id))
+    finally:
+        conn.close()
+
+# Worker loop: claim a job, run it while sending heartbeats and reporting progress, record the outcome, repeat.
+# Returns after max_jobs jobs (runs forever when None)
+def run_worker(db_path=JOB_DB_PATH, poll_interval=1.0, max_jobs=None, heartbeat_interval=HEARTBEAT_INTERVAL):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    conn = _connect(db_path)
+    jobs_run = 0
+    try:
+        while max_jobs is None or jobs_run < max_jobs:
+            job = _claim_job(conn, worker_id)
+            if job is None:
+                time.sleep(poll_interval)
+                continue
+
+            last_report = [0.0]
+            def progress(fraction):
+                now = time.time()
+                if now - last_report[0] >= PROGRESS_INTERVAL:
+                    conn.execute("UPDATE jobs SET progress = ?, heartbeat_at = ? WHERE id = ?", (fraction, now, job['id']))
+                    last_report[0] = now
+
+            stop = threading.Event()
+            heartbeat = threading.Thread(target=_send_heartbeats, args=(db_path, job['id'], worker_id, stop, heartbeat_interval),
+                                         daemon=True)
+            heartbeat.start()
+            try:
+                result_path = _run_job(job, progress)
+                # Only while this worker still holds the job, in case it was requeued as stale meanwhile
+                conn.execute("UPDATE jobs SET status = 'done', progress = 1, result_path = ?, finished_at = ? "
+                             "WHERE id = ? AND worker = ?", (result_path, time.time(), job['id'], worker_id))
+            except Exception:
+                conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ? AND worker = ?",
+                             (traceback.format_exc(), time.time(), job['id'], worker_id))
+            finally:
+                stop.set()
+                heartbeat.join()
+            jobs_run += 1
+    finally:
+        conn.close()
+
+# Start worker processes running `simutrial worker` against the queue. They are separate
+# interpreters (not forks of the caller), so they can use the process-pool engines themselves
+def start_worker_pool(num_workers=2, db_path=JOB_DB_PATH):
+    # The directory holding the simutrial package, so workers can import it from a source checkout too
+    source_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [source_dir, os.environ.get('PYTHONPATH')]))}
+    return [
+        subprocess.Popen([sys.executable, '-m', 'simutrial.cli', 'worker', '--db', db_path], env=env)
+        for _ in range(num_workers)
+    ]
@@ -0,0 +1,69 @@
+import random
+
+import polars as pl
+from mesa import Agent, Model
+from mesa.time import RandomActivation
+
+from simutrial.engine import summarize_consent_counts
+
+# Reference agent-based engine. Mesa is only imported when this engine is selected.
+
+class PatientAgent(Agent):
+    def __init__(self, unique_id, model, age, gender, race, region, health_issues, willingness_score=None):
+        super().__init__(unique_id, model)
+        self.age = age
+        self.gender = gender
+        self.race = race
+        self.region = region
+        self.health_issues = health_issues
+        self.willingness_score = willingness_score
+        self.consented = False
+
+    def step(self):
+        if self.model.consent_model == "uniform":
+            # Determine consent based on consent rate range
+            consent_probability = random.uniform(self.model.consent_rate_min, self.model.consent_rate_max)
+            self.consented = random.random() < consent_probability
+        else:
+            self.consented = random.random() < self.willingness_score
+
+class RecruitmentModel(Model):
+    def __init__(self, df, consent_rate_min, consent_rate_max, consent_model="willingness"):
+        self.df = df
+        self.consent_rate_min = consent_rate_min
+        self.consent_rate_max = consent_rate_max
+        self.consent_model = consent_model
+        self.schedule = RandomActivation(self)
+
+        # Create agents based on the DataFrame
+        for i, row in df.iterrows():
+            age = row.get('age', None)
+            gender = row.get('gender', None)
+            race = row.get('race_ethnicity', None)
+            region = row.get('region', None)
+            health_issues = row.get('health_issues', None)
+            willingness_score = row.get('WillingnessScore', None)
+
+            agent = PatientAgent(i, self, age, gender, race, region, health_issues, willingness_score)
+            self.schedule.add(agent)
+
+    def step(self):
+        self.schedule.step()
+
+# One Mesa agent per patient, stepped one replicate at a time
+def run_mesa_simulations(df, consent_rate_min, consent_rate_max, num_simulations, consent_model="willingness", progress=None):
+    if isinstance(df, pl.DataFrame):
+        df = df.to_pandas()  # Agents are built row by row from a pandas frame
+    consent_results = []
+
+    for i in range(num_simulations):
+        model = RecruitmentModel(df, consent_rate_min, consent_rate_max, consent_model)
+        for _ in range(1):  # Run for 1 step (as we only need to determine consent)
+            model.step()
+        consented_agents = sum([1 for agent in model.schedule.agents if agent.consented])
+        consent_results.append(min(consented_agents, len(df)))
+
+        if progress is not None:
+            progress((i + 1) / num_simulations)
+
+    return summarize_consent_counts(consent_results, len(df))
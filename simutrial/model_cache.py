@@ -0,0 +1,41 @@
+import hashlib
+import json
+import os
+
+import joblib
+import pandas as pd
+import sklearn
+
+from simutrial.disk_cache import atomic_write
+from simutrial.patientVis import fit_willingness_model, model_features
+
+# Features and target used to train the willingness model
+MODEL_FEATURES = model_features
+MODEL_TARGET = 'ParticipatedClinTrial'
+
+# Directory holding trained model artifacts
+MODEL_CACHE_DIR = os.path.join('.simutrial_cache', 'models')
+
+# Hash of the training CSV contents, the feature list and the sklearn version
+def training_fingerprint(training_path, features=MODEL_FEATURES, target=MODEL_TARGET):
+    digest = hashlib.sha256()
+    with open(training_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    digest.update(json.dumps({"features": list(features), "target": target, "sklearn": sklearn.__version__}).encode())
+    return digest.hexdigest()
+
+# Load the willingness model for this training data from disk, training and saving it on a miss
+def load_or_train_willingness_model(training_path, features=MODEL_FEATURES, target=MODEL_TARGET,
+                                    cache_dir=MODEL_CACHE_DIR, fingerprint=None):
+    fingerprint = fingerprint or training_fingerprint(training_path, features, target)
+    artifact_path = os.path.join(cache_dir, f"willingness_{fingerprint[:16]}.joblib")
+    if os.path.exists(artifact_path):
+        return joblib.load(artifact_path)
+
+    training_data = pd.read_csv(training_path)
+    model = fit_willingness_model(training_data[list(features)], training_data[target])
+
+    # Written atomically so a concurrent reader never sees a partial artifact
+    atomic_write(artifact_path, lambda tmp_path: joblib.dump(model, tmp_path))
+    return model
@@ -0,0 +1,40 @@
+import polars as pl
+import json
+
+# Load JSON mapping
+def load_column_mapping(path='column_mapping.json'):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def _column_names(df):
+    return df.collect_schema().names() if isinstance(df, pl.LazyFrame) else df.columns
+
+# Function to rename columns based on mapping and aggregate one-hot race columns;
+# works on both eager DataFrames and LazyFrames
+def normalize_columns(df, mapping):
+    for standard_name, possible_names in mapping.items():
+        for col in possible_names:
+            if col in _column_names(df):
+                df = df.rename({col: standard_name})
+                break
+
+    race_cols = [col for col in _column_names(df) if col.startswith("race:")]
+    if race_cols:
+        df = df.with_columns(
+            pl.concat_list([pl.col(col) for col in race_cols]).alias("race_ethnicity")
+        )
+        df = df.drop(race_cols)
+
+    return df
+
+if __name__ == "__main__":
+    column_mapping = load_column_mapping()
+
+    # Load your dataset
+    df = pl.read_csv('diabetes_dataset.csv')
+
+    # Apply the normalization
+    df_normalized = normalize_columns(df, column_mapping)
+
+    # Display normalized DataFrame
+    print(df_normalized)
@@ -0,0 +1,113 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from simutrial.engine import simulate_consent_counts, simulate_uniform_consent_counts
+from simutrial.engine import simulate_scenario_consent_counts, simulate_uniform_scenario_consent_counts
+
+# Replicates per task. Shards (and their seeds) depend only on num_simulations,
+# so a given seed reproduces the same results on any number of workers. Even, so antithetic pairs never straddle shards
+SHARD_SIZE = 16
+
+# Patient willingness table attached from shared memory once per worker process
+_worker_state = {}
+
+def _init_worker(shm_name, n_patients, scenario_rows=None):
+    # Row sets of a scenario sweep are sent once per worker rather than with every shard
+    _worker_state["scenario_rows"] = scenario_rows
+    if shm_name is None:
+        return
+    shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_state["shm"] = shm
+    _worker_state["willingness"] = np.ndarray((n_patients,), dtype=np.float64, buffer=shm.buf)
+
+def _willingness_shard(seed, num_simulations, sampling):
+    return simulate_consent_counts(_worker_state["willingness"], num_simulations, rng=np.random.default_rng(seed),
+                                   sampling=sampling)
+
+def _uniform_shard(seed, num_simulations, n_patients, consent_rate_min, consent_rate_max, sampling):
+    return simulate_uniform_consent_counts(n_patients, consent_rate_min, consent_rate_max, num_simulations,
+                                           rng=np.random.default_rng(seed), sampling=sampling)
+
+def _scenario_shard(seed, num_simulations, sampling):
+    return simulate_scenario_consent_counts(_worker_state["willingness"], _worker_state["scenario_rows"], num_simulations,
+                                            rng=np.random.default_rng(seed), sampling=sampling)
+
+def _uniform_scenario_shard(seed, num_simulations, n_patients, consent_rate_ranges, sampling):
+    return simulate_uniform_scenario_consent_counts(n_patients, consent_rate_ranges, num_simulations,
+                                                    rng=np.random.default_rng(seed), sampling=sampling,
+                                                    scenario_rows=_worker_state["scenario_rows"])
+
+# Split replicates into fixed-size shards with independent SeedSequence streams
+def _shards(num_simulations, seed):
+    starts = list(range(0, num_simulations, SHARD_SIZE))
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    return [(start, min(start + SHARD_SIZE, num_simulations), child) for start, child in zip(starts, seeds)]
+
+def _run_sharded(shard_task, extra_args, num_simulations, workers, seed, progress, shm_name=None, n_patients=0,
+                 scenario_rows=None, num_scenarios=None):
+    # Scenario sweeps return one row of counts per scenario
+    counts = np.empty(num_simulations if num_scenarios is None else (num_scenarios, num_simulations), dtype=np.int64)
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker,
+                             initargs=(shm_name, n_patients, scenario_rows)) as pool:
+        futures = {
+            pool.submit(shard_task, child, stop - start, *extra_args): (start, stop)
+            for start, stop, child in _shards(num_simulations, seed)
+        }
+        # Stream shard results back as they finish so progress keeps moving
+        for future in as_completed(futures):
+            start, stop = futures[future]
+            counts[..., start:stop] = future.result()
+            done += stop - start
+            if progress is not None:
+                progress(done / num_simulations)
+    return counts
+
+# Copy the willingness column into shared memory for the duration of run(shm_name)
+def _with_shared_willingness(willingness, run):
+    willingness = np.ascontiguousarray(willingness, dtype=np.float64)
+    shm = shared_memory.SharedMemory(create=True, size=max(willingness.nbytes, 1))
+    try:
+        np.ndarray(willingness.shape, dtype=np.float64, buffer=shm.buf)[:] = willingness
+        return run(shm.name)
+    finally:
+        shm.close()
+        shm.unlink()
+
+# Sobol blocks span the whole replicate range, so they cannot be split into independent shards
+def _check_shardable(sampling):
+    if sampling == "sobol":
+        raise ValueError("Sobol sampling cannot be sharded across processes; use independent or antithetic sampling")
+
+# Process-pool counterpart of simulate_consent_counts; the willingness column is shared, not pickled
+def parallel_consent_counts(willingness, num_simulations, workers=None, seed=None, progress=None, sampling="independent"):
+    _check_shardable(sampling)
+    return _with_shared_willingness(willingness, lambda shm_name: _run_sharded(
+        _willingness_shard, (sampling,), num_simulations, workers, seed, progress,
+        shm_name=shm_name, n_patients=len(willingness)))
+
+# Process-pool counterpart of simulate_uniform_consent_counts
+def parallel_uniform_consent_counts(n_patients, consent_rate_min, consent_rate_max, num_simulations,
+                                    workers=None, seed=None, progress=None, sampling="independent"):
+    _check_shardable(sampling)
+    return _run_sharded(_uniform_shard, (n_patients, consent_rate_min, consent_rate_max, sampling),
+                        num_simulations, workers, seed, progress)
+
+# Process-pool counterpart of simulate_scenario_consent_counts (common random numbers within each shard)
+def parallel_scenario_consent_counts(willingness, scenario_rows, num_simulations, workers=None, seed=None, progress=None,
+                                     sampling="independent"):
+    _check_shardable(sampling)
+    return _with_shared_willingness(willingness, lambda shm_name: _run_sharded(
+        _scenario_shard, (sampling,), num_simulations, workers, seed, progress,
+        shm_name=shm_name, n_patients=len(willingness), scenario_rows=scenario_rows, num_scenarios=len(scenario_rows)))
+
+# Process-pool counterpart of simulate_uniform_scenario_consent_counts
+def parallel_uniform_scenario_consent_counts(n_patients, consent_rate_ranges, num_simulations, workers=None, seed=None,
+                                             progress=None, sampling="independent", scenario_rows=None):
+    _check_shardable(sampling)
+    return _run_sharded(_uniform_scenario_shard, (n_patients, consent_rate_ranges, sampling),
+                        num_simulations, workers, seed, progress,
+                        scenario_rows=scenario_rows, num_scenarios=len(consent_rate_ranges))
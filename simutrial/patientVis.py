@@ -0,0 +1,199 @@
+import hashlib
+import json
+
+import pandas as pd
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import StandardScaler
+
+# Define the mapping for CENSREG (region)
+state_to_censreg = {
+    'Northeast': ['Connecticut', 'Maine', 'Massachusetts', 'New Hampshire', 'New Jersey', 'New York', 'Pennsylvania', 'Rhode Island', 'Vermont'],
+    'Midwest': ['Illinois', 'Indiana', 'Iowa', 'Kansas', 'Michigan', 'Minnesota', 'Missouri', 'Nebraska', 'North Dakota', 'Ohio', 'South Dakota', 'Wisconsin'],
+    'South': ['Alabama', 'Arkansas', 'Delaware', 'District of Columbia', 'Florida', 'Georgia', 'Kentucky', 'Louisiana', 'Maryland', 'Mississippi', 'North Carolina', 'Oklahoma', 'South Carolina', 'Tennessee', 'Texas', 'Virginia', 'West Virginia'],
+    'West': ['Alaska', 'Arizona', 'California', 'Colorado', 'Hawaii', 'Idaho', 'Montana', 'Nevada', 'New Mexico', 'Oregon', 'Utah', 'Washington', 'Wyoming']
+}
+
+# Define the mapping for race
+race_mapping = {
+    'Hispanic': 1,
+    'Caucasian': 2,
+    'AfricanAmerican': 3,
+    'Asian': 4,
+    'Other': -9
+}
+
+# Assumption rates for willingness based on race
+assumption_rates = {
+    1: 0.123,  # Hispanic
+    2: 0.440,  # Caucasian
+    3: 0.164,  # African American
+    4: 0.231,  # Asian
+    -9: 0.0    # Other, assume least likely to participate
+}
+
+# Race and age adjustments applied to the raw model probabilities (see adjust_willingness_scores).
+# These are the hand-tuned values; calibration.py fits parameter sets against historical trial baselines
+DEFAULT_ADJUSTMENT = {
+    'assumption_rates': assumption_rates,
+    'race_multiplier': 1.5,  # Increase the impact of the race assumption
+    'young_age': 30,  # Participants younger than this get a boost
+    'young_boost': 2.0  # Boost per year under young_age, in percent
+}
+
+# Identity of an adjustment parameter set, for keys of cohorts scored with it
+def adjustment_key(adjustment):
+    return hashlib.sha256(json.dumps(adjustment, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+# CENSREG codes for each region
+censreg_codes = {
+    'Northeast': 1,
+    'Midwest': 2,
+    'South': 3,
+    'West': 4
+}
+
+# Flattened state -> CENSREG lookup used for column-wise mapping
+state_to_censreg_code = {state: censreg_codes[region] for region, states in state_to_censreg.items() for state in states}
+
+# Columns the willingness model is trained and scored on
+model_features = ['Age', 'CENSREG', 'BirthGender', 'RaceEthn']
+
+# Function to determine CENSREG based on location
+def map_location_to_censreg(location):
+    return state_to_censreg_code.get(location)  # None for an unknown region
+
+# Function to fit the willingness model on historical participation data
+def fit_willingness_model(X_train, y_train):
+    model = LogisticRegression(max_iter=1000)  # Increase max_iter to avoid convergence issues
+    model.fit(X_train, y_train)
+    return model
+
+# Function to derive the model features (CENSREG, RaceEthn, BirthGender, Age) as column operations
+def derive_model_features(patient_data):
+    patient_data['CENSREG'] = patient_data['location'].map(state_to_censreg_code)
+
+    # Race/ethnicity is the first one-hot race:* column set to 1, or -9 if none are
+    race_cols = [col for col in patient_data.columns if 'race:' in col]
+    race_codes = np.array([race_mapping[col.split(':')[1]] for col in race_cols] + [-9])
+    race_block = patient_data[race_cols].to_numpy() == 1
+    first_race = np.where(race_block.any(axis=1), race_block.argmax(axis=1), len(race_cols))
+    patient_data['RaceEthn'] = race_codes[first_race]
+
+    patient_data['BirthGender'] = (patient_data['gender'] == 'Male').astype(int)  # Mapping gender
+    patient_data['Age'] = patient_data['age']
+    return patient_data
+
+# Function to apply the race and age assumptions to raw model probabilities (DEFAULT_ADJUSTMENT unless given)
+def adjust_willingness_scores(raw_scores, race, age, adjustment=None):
+    adjustment = adjustment or DEFAULT_ADJUSTMENT
+    race_rates = np.asarray(pd.Series(race).map(adjustment['assumption_rates']), dtype=float)
+    willingness_scores = raw_scores * race_rates * adjustment['race_multiplier']
+
+    # Boost score for younger participants
+    age = np.asarray(age, dtype=float)
+    young_age = adjustment['young_age']
+    willingness_scores *= np.where(age < young_age, 1 + (young_age - age) / 100 * adjustment['young_boost'], 1.0)
+
+    # Add a constant boost or apply a scaling factor
+    willingness_scores += 0.01  # Add a constant boost
+    # willingness_scores *= 1.5  # Or use a scaling factor instead
+    return willingness_scores
+
+# Function to rescale adjusted scores into [0, 0.5]
+def normalize_willingness_scores(willingness_scores, max_score=None):
+    max_score = willingness_scores.max() if max_score is None else max_score
+    scaling_factor = 0.5 / max_score if max_score > 0 else 1
+
+    # Clip scores to ensure they are within the specified range
+    return np.clip(willingness_scores * scaling_factor, 0.0, 0.5)
+
+# Function to compute race/age adjusted scores for feature rows (Age, CENSREG, BirthGender, RaceEthn)
+def adjusted_feature_scores(features, mean, scale, model, adjustment=None):
+    raw_scores = raw_feature_scores(features, mean, scale, model)
+    return adjust_willingness_scores(raw_scores, features[:, 3], features[:, 0], adjustment)
+
+# Function to compute raw model probabilities for feature rows standardized with the given statistics
+def raw_feature_scores(features, mean, scale, model):
+    return model.predict_proba((features - mean) / scale)[:, 1]
+
+# Function to compute the scaler statistics of the patients feature cells stand for
+def feature_cell_statistics(features, counts):
+    weights = np.asarray(counts, dtype=float) / np.sum(counts)
+
+    # Weighted equivalent of StandardScaler().fit over every patient in the cells
+    mean = weights @ features
+    scale = np.sqrt(weights @ (features - mean) ** 2)
+    scale[scale == 0] = 1.0
+    return mean, scale
+
+# Function to score distinct feature cells; the scaler is fitted on the patients the cells stand for.
+# Scores depend on these cohort-wide statistics, so they are not cached per feature cell across cohorts
+# (see the README's Result Cache section for the caches that avoid rescoring)
+def score_feature_cells(cells, counts, model, adjustment=None):
+    features = cells[model_features].to_numpy(dtype=float)
+    mean, scale = feature_cell_statistics(features, counts)
+    return normalize_willingness_scores(adjusted_feature_scores(features, mean, scale, model, adjustment))
+
+# Function to preprocess patient data and predict willingness scores
+def predict_willingness_scores(csv_path, X_train=None, y_train=None, model=None, plot=False, adjustment=None):
+    # Load the patient data
+    patient_data = pd.read_csv(csv_path)
+
+    # Preprocess the patient data
+    derive_model_features(patient_data)
+
+    # Filter columns to match model input
+    model_input = patient_data[model_features]
+
+    # Check for missing values and drop rows with NaN values
+    model_input = model_input.dropna()
+
+    # Fit the feature scaler on the patient data
+    scaler = StandardScaler()
+    scaler.fit(model_input)
+
+    # Fit the Logistic Regression model unless an already trained one was passed in
+    if model is None:
+        model = fit_willingness_model(X_train, y_train)
+
+    # Make predictions using the trained model, then adjust them based on race and age assumptions
+    # Patients with identical features get identical scores, so each distinct feature row is scored once
+    features, inverse = np.unique(model_input.to_numpy(dtype=float), axis=0, return_inverse=True)
+    willingness_scores = adjusted_feature_scores(features, scaler.mean_, scaler.scale_, model, adjustment)[np.ravel(inverse)]
+    willingness_scores = normalize_willingness_scores(willingness_scores)
+
+    # Add predictions to the DataFrame
+    patient_data['WillingnessScore'] = np.nan  # Initialize the column
+    patient_data.loc[model_input.index, 'WillingnessScore'] = willingness_scores  # Assign scores only where predictions were made
+
+    if plot:
+        plot_willingness_distribution(willingness_scores)
+
+    return patient_data[['Age', 'CENSREG', 'BirthGender', 'RaceEthn', 'WillingnessScore']]
+
+# Plot the distribution of willingness scores (plotting libraries are only imported here)
+def plot_willingness_distribution(willingness_scores):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    plt.figure(figsize=(10, 6))
+    sns.histplot(willingness_scores, bins=30, kde=True)
+    plt.axvline(x=0.5, color='red', linestyle='--', label='Threshold (0.5)')
+    plt.title('Distribution of Willingness Scores')
+    plt.xlabel('Willingness Score')
+    plt.ylabel('Frequency')
+    plt.legend()
+    plt.show()
+
+# Example usage
+if __name__ == "__main__":
+    training_data = pd.read_csv('editedclinicaltrial_copy.csv')  # Replace with your actual training data path
+    X_train = training_data[['Age', 'CENSREG', 'BirthGender', 'RaceEthn']]  # Features
+    y_train = training_data['ParticipatedClinTrial']  # Target variable
+
+    csv_path = 'diabetes_dataset.csv'  # Path to your patient data CSV
+    results_df = predict_willingness_scores(csv_path, X_train, y_train, plot=True)
+
+    print(results_df)
+    results_df.to_csv('patient_willingness_scores.csv', index=False)  # Save to CSV if needed
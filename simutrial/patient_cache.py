@@ -0,0 +1,40 @@
+import hashlib
+import json
+import os
+
+import polars as pl
+
+from simutrial.disk_cache import store_lru_entry, touch_entry
+from simutrial.ingest import ingest_upload
+
+# Directory holding normalized, scored cohorts as Arrow IPC files
+PATIENT_CACHE_DIR = os.path.join('.simutrial_cache', 'patients')
+
+# Total size the cohort files may take on disk; least recently used cohorts are evicted beyond it
+MAX_PATIENT_CACHE_BYTES = 2 * 1024 * 1024 * 1024
+
+# Content hash of the upload, the column mapping and the willingness model it was scored with
+def cohort_key(data, mapping, model_fingerprint):
+    digest = hashlib.sha256(data)
+    digest.update(json.dumps(mapping, sort_keys=True).encode())
+    digest.update(model_fingerprint.encode())
+    return digest.hexdigest()
+
+# Load a previously ingested cohort by memory-mapping its Arrow IPC file, ingesting and saving it on a miss.
+# Returns the scored frame and its cohort key. model_fingerprint must also identify a non-default adjustment
+def load_or_ingest_upload(data_file, mapping, model, model_fingerprint, cache_dir=PATIENT_CACHE_DIR, adjustment=None,
+                          max_bytes=MAX_PATIENT_CACHE_BYTES):
+    key = cohort_key(data_file.getvalue(), mapping, model_fingerprint)
+    path = os.path.join(cache_dir, f"cohort_{key[:16]}.arrow")
+    if touch_entry(path):  # Refreshes the file's modification time for LRU eviction
+        try:
+            return pl.read_ipc(path), key  # Uncompressed IPC files are memory-mapped by default
+        except FileNotFoundError:  # Evicted by another session in the meantime
+            pass
+
+    df = ingest_upload(data_file, mapping, model, adjustment)
+
+    # Uncompressed so reloads can be memory-mapped
+    store_lru_entry(path, lambda tmp_path: df.write_ipc(tmp_path, compression='uncompressed'), max_bytes,
+                    'cohort_', '.arrow')
+    return df, key
@@ -0,0 +1,71 @@
+import hashlib
+import json
+import os
+import pickle
+
+from simutrial.disk_cache import evict_lru, store_lru_entry, touch_entry
+from simutrial.simulation import ENGINE_VERSION
+
+# Directory holding simulation results keyed by cohort, targeting and run parameters
+RESULT_CACHE_DIR = os.path.join('.simutrial_cache', 'results')
+
+# Total size the result files may take on disk; least recently used results are evicted beyond it
+MAX_RESULT_CACHE_BYTES = 256 * 1024 * 1024
+
+# Targeting spec with empty entries dropped and list entries sorted, so equivalent specs share a key
+def _canonical_spec(spec):
+    canonical = {}
+    for key, value in (spec or {}).items():
+        if not value:
+            continue
+        canonical[key] = list(value) if key == 'age' else sorted(value)
+    return canonical
+
+# Hash of the cohort content, targeting spec, run parameters and ENGINE_VERSION
+def result_key(cohort_hash, targeting_spec, params):
+    payload = {
+        'cohort': cohort_hash,
+        'targeting': _canonical_spec(targeting_spec),
+        'params': params,
+        'engine_version': ENGINE_VERSION
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+# Results are reproducible only when the run is seeded; the Mesa engine draws from Python's global random state
+def is_cacheable(params):
+    return params.get('seed') is not None and params.get('engine') != 'mesa'
+
+def _result_path(key, cache_dir):
+    return os.path.join(cache_dir, f"result_{key[:32]}.pkl")
+
+# Cached result for a key, or None. A hit refreshes the file's modification time for LRU eviction
+def load_result(key, cache_dir=RESULT_CACHE_DIR):
+    path = _result_path(key, cache_dir)
+    try:
+        with open(path, 'rb') as f:
+            result = pickle.load(f)
+    except FileNotFoundError:  # Missing, or evicted by another process in the meantime
+        return None
+    touch_entry(path)
+    return result
+
+def _write_pickle(result, path):
+    with open(path, 'wb') as f:
+        pickle.dump(result, f)
+
+def store_result(key, result, cache_dir=RESULT_CACHE_DIR, max_bytes=MAX_RESULT_CACHE_BYTES):
+    store_lru_entry(_result_path(key, cache_dir), lambda tmp_path: _write_pickle(result, tmp_path), max_bytes,
+                    'result_', '.pkl')
+
+# Delete least recently used results until the cache fits in max_bytes
+def evict_results(cache_dir=RESULT_CACHE_DIR, max_bytes=MAX_RESULT_CACHE_BYTES):
+    return evict_lru(cache_dir, max_bytes, 'result_', '.pkl')
+
+# Cached result for the key, computing and storing it on a miss. Returns the result and whether it was cached
+def load_or_compute_result(key, compute, cache_dir=RESULT_CACHE_DIR, max_bytes=MAX_RESULT_CACHE_BYTES):
+    result = load_result(key, cache_dir)
+    if result is not None:
+        return result, True
+    result = compute()
+    store_result(key, result, cache_dir, max_bytes)
+    return result, False
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+import time
+
+from simutrial.disk_cache import evict_lru, store_lru_entry, touch_entry
+
+# Content-addressed store for text fetched from ClinicalTrials.gov and LLM structuring outputs, so
+# re-running an analysis over a study catalog fetches and structures only studies that changed.
+# Scraped text is keyed by NCT ID and the study's last update date; structured outputs by the
+# input text, prompt and model. Entries expire after a TTL and are evicted least recently used
+# beyond a size limit.
+SCRAPE_CACHE_DIR = os.path.join('.simutrial_cache', 'scrape')
+
+# Total size the entries may take on disk
+MAX_SCRAPE_CACHE_BYTES = 64 * 1024 * 1024
+
+# Entries older than this are refetched; a study's last update date, when known, invalidates sooner
+SCRAPE_CACHE_TTL_SECONDS = 30 * 24 * 60 * 60
+
+def _key(kind, payload):
+    return hashlib.sha256(json.dumps({'kind': kind, **payload}, sort_keys=True).encode()).hexdigest()
+
+# Key of a study's scraped text. Without a revision (last update date) the entry lives until the TTL
+def page_key(nct_id, revision=None):
+    return _key('page', {'nct_id': nct_id, 'revision': revision})
+
+# Key of an LLM output for the given input text, prompt template and model
+def llm_key(text, prompt, model):
+    return _key('llm', {'text': text, 'prompt': prompt, 'model': model})
+
+def _entry_path(key, cache_dir):
+    return os.path.join(cache_dir, f"entry_{key}.json")
+
+# Cached value for a key, or None when missing or older than ttl seconds. A hit refreshes the
+# file's modification time for LRU eviction
+def load_entry(key, cache_dir=SCRAPE_CACHE_DIR, ttl=SCRAPE_CACHE_TTL_SECONDS):
+    path = _entry_path(key, cache_dir)
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except FileNotFoundError:  # Missing, or evicted by another process in the meantime
+        return None
+    if ttl is not None and time.time() - entry['stored_at'] > ttl:
+        return None
+    touch_entry(path)
+    return entry['value']
+
+def _write_entry(value, path):
+    with open(path, 'w') as f:
+        json.dump({'stored_at': time.time(), 'value': value}, f)
+
+# Store a value; the directory is only scanned for eviction once the bytes written push it past max_bytes
+def store_entry(key, value, cache_dir=SCRAPE_CACHE_DIR, max_bytes=MAX_SCRAPE_CACHE_BYTES, ttl=SCRAPE_CACHE_TTL_SECONDS):
+    store_lru_entry(_entry_path(key, cache_dir), lambda tmp_path: _write_entry(value, tmp_path), max_bytes,
+                    'entry_', '.json', ttl)
+
+# Delete entries unused for longer than the TTL, then least recently used ones until the cache fits in max_bytes
+def evict_entries(cache_dir=SCRAPE_CACHE_DIR, max_bytes=MAX_SCRAPE_CACHE_BYTES, ttl=SCRAPE_CACHE_TTL_SECONDS):
+    return evict_lru(cache_dir, max_bytes, 'entry_', '.json', ttl)
+
+# Cached value for the key, computing and storing it on a miss. Returns the value and whether it was cached
+def load_or_compute_entry(key, compute, cache_dir=SCRAPE_CACHE_DIR, max_bytes=MAX_SCRAPE_CACHE_BYTES,
+                          ttl=SCRAPE_CACHE_TTL_SECONDS):
+    value = load_entry(key, cache_dir, ttl)
+    if value is not None:
+        return value, True
+    value = compute()
+    store_entry(key, value, cache_dir, max_bytes, ttl)
+    return value, False
@@ -0,0 +1,141 @@
+import numpy as np
+
+from simutrial.engine import SAMPLING_METHODS, adaptive_consent_counts, simulate_consent_counts
+from simutrial.engine import simulate_enrollment_curves, simulate_stratified_consent_counts
+from simutrial.engine import simulate_stratified_enrollment_curves, simulate_uniform_consent_counts
+from simutrial.engine import summarize_consent_counts, summarize_enrollment
+from simutrial.parallel import parallel_consent_counts, parallel_uniform_consent_counts
+
+# Side-effect-free entry points shared by the Streamlit apps and the command line.
+# df holds one row per targeted patient (pandas or Polars); consent_model="willingness" draws consent from its
+# WillingnessScore column (app.py), "uniform" from a probability uniform on [min, max] (streamlit.py).
+# The stratified engine also takes a LazyFrame of such rows, or scored strata with a count column
+# (ingest.scan_willingness_strata, streaming.scan_scored_strata), so no per-patient frame is ever collected.
+# progress, when given, is called with the completed fraction. Engines with heavy dependencies
+# (Mesa, SciPy, the scoring stack) are imported when selected, so batch jobs start quickly.
+
+ENGINES = ("vectorized", "stratified", "parallel", "analytic", "mesa")
+
+# Sampling methods each engine draws with. Stratified draws one binomial per stratum (no per-patient
+# uniforms to pair), Sobol blocks cannot be split into parallel shards, and the analytic and Mesa
+# engines do not draw from engine.uniform_batches
+ENGINE_SAMPLING = {
+    "vectorized": SAMPLING_METHODS,
+    "stratified": ("independent",),
+    "parallel": ("independent", "antithetic"),
+    "analytic": ("independent",),
+    "mesa": ("independent",)
+}
+
+# Engines that can stop early at a target precision (they draw replicates batch by batch in this process)
+ADAPTIVE_ENGINES = ("vectorized", "stratified")
+
+# Engines that shard replicates across worker processes; the others run in the calling process
+PARALLEL_ENGINES = ("parallel",)
+
+# Reject combinations an engine would otherwise silently ignore
+def check_engine_options(engine, sampling="independent", target_half_width=None, workers=None):
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown simulation engine: {engine}")
+    if sampling not in ENGINE_SAMPLING[engine]:
+        raise ValueError(f"The {engine} engine does not support {sampling} sampling "
+                         f"(supported: {', '.join(ENGINE_SAMPLING[engine])})")
+    if target_half_width and engine not in ADAPTIVE_ENGINES:
+        raise ValueError(f"The {engine} engine cannot stop early at a target precision "
+                         f"(supported by: {', '.join(ADAPTIVE_ENGINES)})")
+    if workers and workers > 1 and engine not in PARALLEL_ENGINES:
+        raise ValueError(f"The {engine} engine runs in one process and cannot use {workers} workers "
+                         f"(supported by: {', '.join(PARALLEL_ENGINES)})")
+
+# Engine that draws the enrollment curves for a simulation engine. Only the stratified engine (under the
+# willingness model) has its own enrollment simulation; the others draw the curves with the vectorized engine,
+# which samples the same distribution. The result of run_enrollment_simulation names the engine used
+def enrollment_engine(engine, consent_model="willingness"):
+    if engine == "stratified" and consent_model == "willingness":
+        return "stratified"
+    return "vectorized"
+
+# Bump whenever a change alters the results produced for a given seed; keys the result cache
+ENGINE_VERSION = 2
+
+def run_simulations(df, consent_rate_min, consent_rate_max, num_simulations, engine="vectorized", seed=None,
+                    target_half_width=None, sampling="independent", consent_model="willingness", workers=None,
+                    progress=None):
+    check_engine_options(engine, sampling, target_half_width, workers)
+    if engine == "mesa":
+        from simutrial.mesa_engine import run_mesa_simulations
+        return run_mesa_simulations(df, consent_rate_min, consent_rate_max, num_simulations, consent_model, progress)
+    if engine == "analytic":
+        from simutrial.analytic import analytic_consent_results, analytic_uniform_consent_results
+
+        # Exact consent-count distribution; no replicates are drawn
+        if progress is not None:
+            progress(1.0)
+        if consent_model == "uniform":
+            return analytic_uniform_consent_results(len(df), consent_rate_min, consent_rate_max)
+        return analytic_consent_results(df['WillingnessScore'].to_numpy())
+    if engine == "parallel":
+        # Replicates are sharded across a process pool with SeedSequence-spawned streams
+        if consent_model == "uniform":
+            consent_results = parallel_uniform_consent_counts(len(df), consent_rate_min, consent_rate_max, num_simulations,
+                                                              workers=workers, seed=seed, progress=progress,
+                                                              sampling=sampling)
+        else:
+            consent_results = parallel_consent_counts(df['WillingnessScore'].to_numpy(), num_simulations,
+                                                      workers=workers, seed=seed, progress=progress, sampling=sampling)
+        return summarize_consent_counts(consent_results, len(df), sampling=sampling)
+
+    rng = np.random.default_rng(seed)
+    if engine == "stratified":
+        if consent_model == "uniform":
+            raise ValueError("The stratified engine draws from willingness scores")
+        from simutrial.ingest import willingness_strata
+
+        # One binomial draw per distinct willingness score instead of one Bernoulli draw per patient
+        strata_willingness, strata_counts = willingness_strata(df)
+        n_patients = int(strata_counts.sum())
+
+        def draw_batch(size, progress=None, sampling="independent"):
+            return simulate_stratified_consent_counts(strata_willingness, strata_counts, size, rng=rng, progress=progress)
+    elif consent_model == "uniform":
+        n_patients = len(df)
+
+        def draw_batch(size, progress=None, sampling="independent"):
+            return simulate_uniform_consent_counts(len(df), consent_rate_min, consent_rate_max, size, rng=rng,
+                                                   progress=progress, sampling=sampling)
+    else:
+        # Draw every replicate's consent decisions from the willingness scores in one batch
+        willingness = df['WillingnessScore'].to_numpy()
+        n_patients = len(df)
+
+        def draw_batch(size, progress=None, sampling="independent"):
+            return simulate_consent_counts(willingness, size, rng=rng, progress=progress, sampling=sampling)
+
+    if target_half_width:
+        # Sequential mode: stop once the mean consent rate is as precise as requested
+        consent_results = adaptive_consent_counts(draw_batch, n_patients, target_half_width, num_simulations,
+                                                  progress=progress, sampling=sampling)
+        return summarize_consent_counts(consent_results, n_patients, sampling=sampling)
+    consent_results = draw_batch(num_simulations, progress=progress, sampling=sampling)
+    return summarize_consent_counts(consent_results, n_patients, sampling=sampling)
+
+# Multi-window recruitment: each step is a screening window and consented patients leave the pool
+def run_enrollment_simulation(df, consent_rate_min, consent_rate_max, num_simulations, num_periods, study_size, seed=None,
+                              engine="vectorized", sampling="independent", consent_model="willingness", progress=None):
+    check_engine_options(engine, sampling)
+    used_engine = enrollment_engine(engine, consent_model)
+    if used_engine == "stratified":
+        from simutrial.ingest import willingness_strata
+
+        curves = simulate_stratified_enrollment_curves(*willingness_strata(df), num_simulations, num_periods,
+                                                       rng=seed, progress=progress)
+        return {**summarize_enrollment(curves, study_size), "engine": used_engine}
+
+    if consent_model == "uniform":
+        # A fresh uniform draw every window averages to a constant per-window consent probability
+        willingness = np.full(len(df), (consent_rate_min + consent_rate_max) / 2)
+    else:
+        willingness = df['WillingnessScore'].to_numpy()
+    curves = simulate_enrollment_curves(willingness, num_simulations, num_periods,
+                                        rng=seed, progress=progress, sampling=sampling)
+    return {**summarize_enrollment(curves, study_size), "engine": used_engine}
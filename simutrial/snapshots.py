@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import re
+
+import polars as pl
+
+from simutrial.disk_cache import atomic_write
+from simutrial.ingest import read_upload
+from simutrial.normalize import normalize_columns
+from simutrial.patientVis import model_features
+from simutrial.streaming import model_feature_exprs, scan_feature_cells, score_cells_frame
+
+# Directory holding the latest snapshot of each EMR panel, one store per panel (see panel_store_dir)
+SNAPSHOT_DIR = os.path.join('.simutrial_cache', 'snapshots')
+
+# A panel's store keeps the normalized rows of its last snapshot (keyed by a stable patient ID,
+# with a hash of each raw row) and the feature-cell counts of those rows with their scores.
+# A new export is diffed against it by ID and hash: only inserted and updated rows are
+# normalized, and cell counts are adjusted by the delta. Scores depend on cohort-wide
+# statistics, so the cells (not the rows) are rescored, which costs O(number of cells).
+
+# Store of one panel: its name (e.g. the export's source system) and patient ID column, so panels
+# refreshed in turn never diff against or overwrite each other
+def panel_store_dir(panel, id_column, snapshot_dir=SNAPSHOT_DIR):
+    slug = re.sub(r'[^A-Za-z0-9_-]+', '_', panel).strip('_') or 'panel'
+    digest = hashlib.sha256(json.dumps([panel, id_column]).encode()).hexdigest()[:12]
+    return os.path.join(snapshot_dir, f"{slug}_{digest}")
+
+def _store_paths(store_dir):
+    return (
+        os.path.join(store_dir, 'rows.parquet'),
+        os.path.join(store_dir, 'cells.parquet'),
+        os.path.join(store_dir, 'meta.json'),
+    )
+
+def _load_store(store_dir, meta):
+    rows_path, cells_path, meta_path = _store_paths(store_dir)
+    if not os.path.exists(meta_path):
+        return None, None
+    with open(meta_path) as f:
+        previous_meta = json.load(f)
+    # Row hashes and normalized columns are only comparable under the same layout and Polars version
+    if previous_meta != meta:
+        return None, None
+    return pl.read_parquet(rows_path), pl.read_parquet(cells_path)
+
+def _write_json(value, path):
+    with open(path, 'w') as f:
+        json.dump(value, f)
+
+# Every file, meta.json included, is replaced atomically, so a reader never sees a partially written one
+def _save_store(store_dir, rows, cells, meta):
+    os.makedirs(store_dir, exist_ok=True)
+    rows_path, cells_path, meta_path = _store_paths(store_dir)
+    for df, path in [(rows, rows_path), (cells, cells_path)]:
+        atomic_write(path, df.write_parquet)
+    atomic_write(meta_path, lambda tmp_path: _write_json(meta, tmp_path))
+
+# Names of the panels with a stored snapshot, most recently refreshed first
+def list_panels(snapshot_dir=SNAPSHOT_DIR):
+    if not os.path.isdir(snapshot_dir):
+        return []
+    metas = []
+    for entry in os.scandir(snapshot_dir):
+        meta_path = _store_paths(entry.path)[2]
+        if entry.is_dir() and os.path.exists(meta_path):
+            with open(meta_path) as f:
+                panel = json.load(f).get('panel')
+            if panel is not None:
+                metas.append((os.path.getmtime(meta_path), panel))
+    return list(dict.fromkeys(panel for _, panel in sorted(metas, reverse=True)))
+
+# Feature-cell counts of stored (normalized) rows
+def _row_cells(rows):
+    cells = scan_feature_cells(rows.lazy().with_columns(pl.col('age').cast(pl.Float64).alias('Age'))).collect()
+    return cells.with_columns(pl.col('count').cast(pl.Int64))  # Signed so removals can be subtracted
+
+# Apply today's export to the panel's stored snapshot. Returns the scored frame (same layout as
+# ingest_upload) and a summary of the change counts and cohort aggregates. Call it once per export:
+# applying the same export again diffs it against itself and reports no changes
+def apply_snapshot(data_file, id_column, mapping, model, panel, snapshot_dir=SNAPSHOT_DIR, adjustment=None):
+    store_dir = panel_store_dir(panel, id_column, snapshot_dir)
+    raw = read_upload(data_file)
+    current = raw.select(id_column).with_columns(raw.hash_rows(seed=0).alias('_row_hash'))
+
+    meta = {'panel': panel, 'id_column': id_column, 'columns': raw.columns, 'mapping': mapping, 'polars': pl.__version__}
+    previous_rows, previous_cells = _load_store(store_dir, meta)
+
+    if previous_rows is None:
+        changed_ids = current[id_column]
+        kept_rows = None
+        cells = None
+        changes = {'inserted': len(current), 'updated': 0, 'deleted': 0}
+    else:
+        diff = current.join(previous_rows.select(id_column, '_row_hash'), on=id_column,
+                            how='full', suffix='_previous', coalesce=True)
+        inserted = diff.filter(pl.col('_row_hash_previous').is_null())
+        deleted = diff.filter(pl.col('_row_hash').is_null())
+        updated = diff.filter(pl.col('_row_hash').is_not_null() & pl.col('_row_hash_previous').is_not_null()
+                              & (pl.col('_row_hash') != pl.col('_row_hash_previous')))
+
+        changed_ids = pl.concat([inserted[id_column], updated[id_column]])
+        removed_ids = pl.concat([deleted[id_column], updated[id_column]])
+        removed_rows = previous_rows.filter(pl.col(id_column).is_in(removed_ids.implode()))
+        kept_rows = previous_rows.filter(~pl.col(id_column).is_in(removed_ids.implode()))
+        cells = previous_cells.drop('WillingnessScore')
+        changes = {'inserted': len(inserted), 'updated': len(updated), 'deleted': len(deleted)}
+
+    # Only new and changed rows are normalized and have their features derived
+    delta_raw = raw.filter(pl.col(id_column).is_in(changed_ids.implode()))
+    delta_rows = normalize_columns(
+        delta_raw.with_columns(model_feature_exprs(raw.columns)).drop('Age')
+        .join(current, on=id_column, how='left', maintain_order='left'),
+        mapping
+    )
+
+    # Adjust cell counts by the delta instead of regrouping the whole panel
+    cell_parts = [_row_cells(delta_rows)]
+    if cells is not None:
+        cell_parts += [cells, _row_cells(removed_rows).with_columns(-pl.col('count'))]
+    cells = (
+        pl.concat(cell_parts, how='vertical_relaxed')
+        .group_by(model_features)
+        .agg(pl.col('count').sum())
+        .filter(pl.col('count') > 0)
+    )
+    cell_scores = score_cells_frame(cells, model, adjustment)
+
+    rows = delta_rows if kept_rows is None else pl.concat([kept_rows, delta_rows], how='vertical_relaxed')
+    rows = current.select(id_column).join(rows, on=id_column, how='left', maintain_order='left')  # Export order
+    _save_store(store_dir, rows, cells.join(cell_scores, on=model_features, how='left'), meta)
+
+    scored = (
+        rows.with_columns(pl.col('age').cast(pl.Float64).alias('Age'))
+        .join(cell_scores, on=model_features, how='left', maintain_order='left')
+        .drop('Age', '_row_hash')
+    )
+    scored_cells = cells.join(cell_scores, on=model_features, how='left')
+    changes['unchanged'] = len(current) - changes['inserted'] - changes['updated']
+    changes['patients'] = len(current)
+    changes['expected_consents'] = (scored_cells['count'] * scored_cells['WillingnessScore']).sum()
+    return scored, changes
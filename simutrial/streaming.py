@@ -0,0 +1,94 @@
+import polars as pl
+
+from simutrial.normalize import normalize_columns
+from simutrial.patientVis import model_features, race_mapping, score_feature_cells, state_to_censreg_code
+from simutrial.targeting import targeting_expr
+
+# Polars expressions deriving the model features from raw EMR columns (see derive_model_features)
+def model_feature_exprs(columns):
+    race_cols = [col for col in columns if 'race:' in col]
+    return [
+        pl.col('location').replace_strict(state_to_censreg_code, default=None, return_dtype=pl.Float64).alias('CENSREG'),
+        # Race/ethnicity is the first one-hot race:* column set to 1, or -9 if none are
+        pl.coalesce(
+            [pl.when(pl.col(col) == 1).then(pl.lit(race_mapping[col.split(':')[1]])) for col in race_cols]
+            + [pl.lit(-9)]
+        ).cast(pl.Int64).alias('RaceEthn'),
+        (pl.col('gender') == 'Male').fill_null(False).cast(pl.Int64).alias('BirthGender'),
+        pl.col('age').cast(pl.Float64).alias('Age'),
+    ]
+
+# Lazily scan an EMR extract and attach the derived model features
+def scan_with_model_features(input_path, separator=','):
+    lf = pl.scan_csv(input_path, separator=separator)
+    return lf.with_columns(model_feature_exprs(lf.collect_schema().names()))
+
+# Distinct feature cells with patient counts, computed in one streaming pass
+def scan_feature_cells(lf):
+    complete = pl.all_horizontal([pl.col(col).cast(pl.Float64).is_not_nan().fill_null(False) for col in model_features])
+    return (
+        lf.filter(complete)
+        .group_by(model_features)
+        .agg(pl.len().alias('count'))
+    )
+
+# Willingness score for every feature cell, as a frame to join back onto patient rows
+def score_cells_frame(cells, model, adjustment=None):
+    if len(cells) == 0:
+        return cells.drop('count').with_columns(pl.lit(None, dtype=pl.Float64).alias('WillingnessScore'))
+    scores = score_feature_cells(cells.to_pandas(), cells['count'].to_numpy(), model, adjustment)
+    return cells.drop('count').with_columns(pl.Series('WillingnessScore', scores))
+
+# Score a CSV/TSV of any size with bounded memory and write normalized rows plus WillingnessScore.
+# Pass one collects feature cells (scores depend on cohort-wide scaler statistics and maximum),
+# pass two joins the cell scores back onto the rows and sinks them to Parquet or Arrow IPC
+# (the normalized race_ethnicity list column cannot be written as CSV)
+def stream_willingness_scores(input_path, output_path, model, mapping, separator=',', adjustment=None):
+    cells = scan_feature_cells(scan_with_model_features(input_path, separator)).collect(engine='streaming')
+    cell_scores = score_cells_frame(cells, model, adjustment=adjustment)
+
+    scored = (
+        scan_with_model_features(input_path, separator)
+        .join(cell_scores.lazy(), on=model_features, how='left', maintain_order='left')
+        .drop('Age')  # The raw age column is kept and normalized instead
+    )
+    scored = normalize_columns(scored, mapping)
+
+    if str(output_path).endswith('.parquet'):
+        scored.sink_parquet(output_path)
+    elif str(output_path).endswith(('.arrow', '.ipc')):
+        scored.sink_ipc(output_path)
+    else:
+        raise ValueError(f"Unsupported output format: {output_path}")
+    return cell_scores
+
+# Scored feature cells of the targeted patients in an extract, without materializing any rows.
+# Scores use the whole extract's statistics, as when the full upload is scored and then targeted.
+# With a column mapping the spec is matched on the normalized columns, as after ingest.ingest_upload.
+# Targeted rows missing a model feature form cells with a null score, like unscored rows of a scored upload
+def scan_scored_strata(input_path, model, spec=None, separator=',', adjustment=None, mapping=None):
+    lf = scan_with_model_features(input_path, separator)
+    cell_scores = score_cells_frame(scan_feature_cells(lf).collect(engine='streaming'), model, adjustment=adjustment)
+
+    if mapping is not None:
+        # Normalization would rename the derived Age onto the raw age column, so Age is re-derived after it
+        lf = normalize_columns(lf.drop('Age'), mapping).with_columns(pl.col('age').cast(pl.Float64).alias('Age'))
+    predicate = targeting_expr(spec or {})
+    targeted = lf.filter(predicate) if predicate is not None else lf
+    return (
+        targeted.group_by(model_features).agg(pl.len().alias('count')).collect(engine='streaming')
+        .join(cell_scores, on=model_features, how='left')
+    )
+
+if __name__ == "__main__":
+    import sys
+
+    from simutrial.model_cache import load_or_train_willingness_model
+    from simutrial.normalize import load_column_mapping
+
+    # Usage: python -m simutrial.streaming <emr_extract.csv> <scored_output.parquet>
+    input_path, output_path = sys.argv[1], sys.argv[2]
+    model = load_or_train_willingness_model('editedclinicaltrial_copy.csv')
+    separator = '\t' if input_path.endswith('.tsv') else ','
+    cells = stream_willingness_scores(input_path, output_path, model, load_column_mapping(), separator=separator)
+    print(f"Scored {len(cells)} distinct feature cells into {output_path}")
@@ -0,0 +1,140 @@
+import itertools
+
+import numpy as np
+import polars as pl
+
+from simutrial.cohort_index import build_cohort_index, cohort_rows
+from simutrial.engine import simulate_scenario_consent_counts, simulate_uniform_scenario_consent_counts
+from simutrial.engine import summarize_consent_counts
+from simutrial.parallel import parallel_scenario_consent_counts, parallel_uniform_scenario_consent_counts
+from simutrial.patientVis import censreg_codes, state_to_censreg_code
+
+# A scenario grid is a dict of axis -> values; every combination of values is one scenario:
+#   'consent_rate': list of (min, max) consent-rate ranges; only with consent_model="uniform", since
+#                   willingness-based consent does not depend on them
+#   'targeting':    dict of name -> targeting spec (see targeting.py); disease areas are expressed
+#                   here as specs on their condition columns, e.g. {'conditions': ['heart_disease']}
+#   'location':     list of states; each restricts targeting to the state's patients (None for any)
+#   'study_size':   list of study sizes
+# Missing axes default to a single value that does not restrict the scenario.
+DEFAULT_GRID = {
+    'consent_rate': [(0.2, 0.8)],
+    'targeting': {'All Patients': {}},
+    'location': [None],
+    'study_size': [100]
+}
+
+# Per-scenario result columns of the sweep table
+RESULT_COLUMNS = ['mean_consents', 'mean_consent_rate', 'confidence_interval', 'mean_staff', 'mean_sites',
+                  'probability_study_size_met']
+
+_censreg_regions = {code: region for region, code in censreg_codes.items()}
+
+# One dict per scenario, in grid order
+def expand_grid(grid):
+    grid = {**DEFAULT_GRID, **grid}
+    scenarios = []
+    for (consent_rate_min, consent_rate_max), targeting, location, study_size in itertools.product(
+            grid['consent_rate'], grid['targeting'], grid['location'], grid['study_size']):
+        scenarios.append({
+            'consent_rate_min': consent_rate_min,
+            'consent_rate_max': consent_rate_max,
+            'targeting': targeting,
+            'location': location,
+            'study_size': study_size
+        })
+    return scenarios
+
+# Targeting spec of a scenario with its location folded in as a state restriction on the raw location column.
+# None when the spec's regions or locations exclude the state, so no patient can match (an empty
+# list would not restrict the cohort at all)
+def scenario_spec(spec, location):
+    if location is None:
+        return spec
+    if location not in state_to_censreg_code:
+        raise ValueError(f"Unknown location: {location}")
+    region = _censreg_regions[state_to_censreg_code[location]]
+    if spec.get('region') and region not in spec['region']:
+        return None
+    if spec.get('location') and location not in spec['location']:
+        return None
+    return {**spec, 'location': [location]}
+
+# Evaluate every scenario of a grid against one scored cohort (the output of ingest_upload).
+# consent_model="willingness" draws consent from each patient's WillingnessScore (app.py), and
+# "uniform" from a probability uniform on the scenario's [min, max] range (streamlit.py).
+# All scenarios are drawn together on common random numbers, so the only work per scenario is a
+# column selection and a count; workers > 1 shards replicates across a process pool.
+# Returns a tidy frame with one row per scenario, written to Parquet when output_path is given
+def run_sweep(df_scored, grid, num_simulations=100, consent_model="willingness", seed=None,
+              sampling="independent", workers=None, index=None, progress=None, output_path=None):
+    if consent_model not in ("willingness", "uniform"):
+        raise ValueError(f"Unknown consent model: {consent_model}")
+    if consent_model == "willingness" and 'consent_rate' in grid:
+        raise ValueError("The consent_rate axis only applies to the uniform consent model; "
+                         "willingness-based consent would repeat the same results for every range")
+    if any(location is not None for location in grid.get('location', [])) and 'location' not in df_scored.columns:
+        raise ValueError("The location axis needs the cohort's location column")
+    scenarios = expand_grid(grid)
+    targeting = {**DEFAULT_GRID, **grid}['targeting']
+    index = index if index is not None else build_cohort_index(df_scored)
+
+    # Resolve each distinct (targeting, location) cohort once through the bitmap index
+    populations = {}
+    for scenario in scenarios:
+        key = (scenario['targeting'], scenario['location'])
+        if key not in populations:
+            spec = scenario_spec(targeting[key[0]], key[1])
+            populations[key] = cohort_rows(index, spec) if spec is not None else np.array([], dtype=np.int64)
+
+    if consent_model == "willingness":
+        # Consent does not depend on the consent-rate range, so only distinct cohorts are simulated
+        population_keys = list(populations)
+        rows = [populations[key] for key in population_keys]
+        willingness = df_scored['WillingnessScore'].to_numpy()
+        if workers and workers > 1:
+            counts = parallel_scenario_consent_counts(willingness, rows, num_simulations, workers=workers, seed=seed,
+                                                      progress=progress, sampling=sampling)
+        else:
+            counts = simulate_scenario_consent_counts(willingness, rows, num_simulations, rng=seed,
+                                                      progress=progress, sampling=sampling)
+        scenario_counts = {key: counts[i] for i, key in enumerate(population_keys)}
+        count_key = lambda scenario: (scenario['targeting'], scenario['location'])
+    else:
+        draw_keys = list(dict.fromkeys(
+            (s['consent_rate_min'], s['consent_rate_max'], s['targeting'], s['location']) for s in scenarios))
+        ranges = [key[:2] for key in draw_keys]
+        rows = [populations[key[2:]] for key in draw_keys]
+        if workers and workers > 1:
+            counts = parallel_uniform_scenario_consent_counts(index['n_rows'], ranges, num_simulations, workers=workers,
+                                                              seed=seed, progress=progress, sampling=sampling,
+                                                              scenario_rows=rows)
+        else:
+            counts = simulate_uniform_scenario_consent_counts(index['n_rows'], ranges, num_simulations, rng=seed,
+                                                              progress=progress, sampling=sampling, scenario_rows=rows)
+        scenario_counts = {key: counts[i] for i, key in enumerate(draw_keys)}
+        count_key = lambda scenario: (scenario['consent_rate_min'], scenario['consent_rate_max'],
+                                      scenario['targeting'], scenario['location'])
+
+    records = []
+    for scenario_id, scenario in enumerate(scenarios):
+        n_patients = len(populations[(scenario['targeting'], scenario['location'])])
+        consent_results = scenario_counts[count_key(scenario)]
+        record = {'scenario': scenario_id, **scenario, 'patients': n_patients}
+        record.update(dict.fromkeys(RESULT_COLUMNS))  # Left null for empty cohorts
+        if n_patients:
+            summary = summarize_consent_counts(consent_results, n_patients, sampling=sampling)
+            record.update({
+                'mean_consents': float(np.mean(consent_results)),
+                'mean_consent_rate': float(summary['mean_consent_rate']),
+                'confidence_interval': float(summary['confidence_interval']),
+                'mean_staff': float(summary['mean_staff']),
+                'mean_sites': float(summary['mean_sites']),
+                'probability_study_size_met': float(np.mean(consent_results >= scenario['study_size']))
+            })
+        records.append(record)
+
+    results = pl.DataFrame(records, schema_overrides={'location': pl.String, **dict.fromkeys(RESULT_COLUMNS, pl.Float64)})
+    if output_path is not None:
+        results.write_parquet(output_path)
+    return results
@@ -0,0 +1,68 @@
+from functools import reduce
+
+import polars as pl
+
+from simutrial.patientVis import censreg_codes, race_mapping
+
+# A targeting spec is a plain dict, like the targeted_demographics dict in simulate.py:
+#   'age':        (min_age, max_age), inclusive; either bound may be None
+#   'gender':     list of gender values, e.g. ['Female']
+#   'race':       list of race_mapping keys, e.g. ['AfricanAmerican', 'Asian'], matched on RaceEthn
+#   'region':     list of census regions, e.g. ['South', 'West'], matched on CENSREG
+#   'location':   list of states, e.g. ['Texas'], matched on the raw location column
+#   'conditions': list of 0/1 condition columns; a patient matches if any of them is 1
+# Missing or empty entries do not restrict the cohort.
+
+# Compile a targeting spec into a single Polars predicate (None when nothing is targeted)
+def targeting_expr(spec):
+    predicates = []
+
+    age_min, age_max = spec.get('age') or (None, None)
+    if age_min is not None:
+        predicates.append(pl.col('age') >= age_min)
+    if age_max is not None:
+        predicates.append(pl.col('age') <= age_max)
+
+    if spec.get('gender'):
+        predicates.append(pl.col('gender').is_in(list(spec['gender'])))
+
+    if spec.get('race'):
+        predicates.append(pl.col('RaceEthn').is_in([race_mapping[race] for race in spec['race']]))
+
+    if spec.get('region'):
+        predicates.append(pl.col('CENSREG').is_in([float(censreg_codes[region]) for region in spec['region']]))
+
+    if spec.get('location'):
+        predicates.append(pl.col('location').is_in(list(spec['location'])))
+
+    if spec.get('conditions'):
+        predicates.append(pl.any_horizontal([pl.col(col) == 1 for col in spec['conditions']]))
+
+    if not predicates:
+        return None
+    return reduce(lambda left, right: left & right, predicates)
+
+# Open a cohort file lazily so filters and column selections are pushed into the scan
+def scan_cohort(path, separator=','):
+    path = str(path)
+    if path.endswith('.parquet'):
+        return pl.scan_parquet(path)
+    if path.endswith(('.arrow', '.ipc')):
+        return pl.scan_ipc(path)
+    return pl.scan_csv(path, separator='\t' if path.endswith('.tsv') else separator)
+
+# Apply a targeting spec to a cohort path, LazyFrame or DataFrame; only `columns` are read when given
+def target_cohort(source, spec, columns=None):
+    if isinstance(source, pl.LazyFrame):
+        lf = source
+    elif isinstance(source, pl.DataFrame):
+        lf = source.lazy()
+    else:
+        lf = scan_cohort(source)
+
+    predicate = targeting_expr(spec)
+    if predicate is not None:
+        lf = lf.filter(predicate)
+    if columns is not None:
+        lf = lf.select(columns)
+    return lf
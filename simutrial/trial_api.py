@@ -0,0 +1,213 @@
+import asyncio
+import sys
+
+import pandas as pd
+
+# Baseline characteristics of completed trials from the ClinicalTrials.gov v2 API, the endpoint
+# trials_display.py already queries. The results section comes back as structured JSON, so the
+# race and gender tables trial_scraper.py recovers from rendered pages (with Selenium, and an LLM
+# for structuring) are built directly. The table builders take a study record as returned by the
+# API, so they also run on recorded JSON responses.
+
+STUDIES_API_URL = "https://clinicaltrials.gov/api/v2/studies"
+
+# Only the parts of each study record the tables are built from
+BASELINE_FIELDS = [
+    "protocolSection.identificationModule.nctId",
+    "protocolSection.statusModule.lastUpdatePostDateStruct",
+    "resultsSection.baselineCharacteristicsModule",
+]
+
+# Studies requested per call (through filter.ids), and calls in flight at once over the pooled connections
+IDS_PER_REQUEST = 100
+MAX_CONCURRENT_REQUESTS = 4
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+SEX_MEASURE = "Sex: Female, Male"
+RACE_MEASURE = "Race (NIH/OMB)"
+ETHNICITY_MEASURE = "Ethnicity (NIH/OMB)"
+
+# Row labels of the arm/group part of the baseline table (as in extract_baseline_characteristics)
+BASELINE_ROWS = [
+    'Arm/Group Description',
+    'Overall Number of Baseline Participants',
+    'Baseline Analysis Population Description'
+]
+
+# JSON body of a GET, retrying connection errors, rate limiting and server errors with exponential backoff
+async def get_json(client, url, params, retries=3, backoff=1.0):
+    import httpx
+
+    for attempt in range(retries + 1):
+        try:
+            response = await client.get(url, params=params)
+        except httpx.TransportError:
+            if attempt == retries:
+                raise
+        else:
+            if response.status_code not in RETRY_STATUS_CODES or attempt == retries:
+                response.raise_for_status()
+                return response.json()
+        await asyncio.sleep(backoff * 2 ** attempt)
+
+async def _fetch_studies(client, semaphore, url, nct_ids, retries):
+    params = {
+        'filter.ids': ','.join(nct_ids),
+        'fields': ','.join(BASELINE_FIELDS),
+        'pageSize': len(nct_ids),
+        'format': 'json'
+    }
+    studies = []
+    async with semaphore:
+        while True:
+            page = await get_json(client, url, params, retries)
+            studies.extend(page.get('studies', []))
+            if not page.get('nextPageToken'):
+                return studies
+            params['pageToken'] = page['nextPageToken']
+
+# Study records for many NCT IDs, requested in batches of ids_per_request over one pooled async client.
+# Returns {nct_id: study}; IDs the API does not know are missing from the result
+async def fetch_baseline_studies_async(nct_ids, url=STUDIES_API_URL, ids_per_request=IDS_PER_REQUEST,
+                                       max_concurrent=MAX_CONCURRENT_REQUESTS, retries=3, timeout=30.0):
+    import httpx
+
+    nct_ids = list(dict.fromkeys(nct_ids))
+    batches = [nct_ids[i:i + ids_per_request] for i in range(0, len(nct_ids), ids_per_request)]
+    limits = httpx.Limits(max_connections=max_concurrent, max_keepalive_connections=max_concurrent)
+    semaphore = asyncio.Semaphore(max_concurrent)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        pages = await asyncio.gather(*(_fetch_studies(client, semaphore, url, batch, retries) for batch in batches))
+    return {study_nct_id(study): study for page in pages for study in page}
+
+def fetch_baseline_studies(nct_ids, **kwargs):
+    return asyncio.run(fetch_baseline_studies_async(nct_ids, **kwargs))
+
+def study_nct_id(study):
+    return study['protocolSection']['identificationModule']['nctId']
+
+# Date the study record was last updated, e.g. '2023-05-04' (None if not reported)
+def study_last_update(study):
+    return study['protocolSection'].get('statusModule', {}).get('lastUpdatePostDateStruct', {}).get('date')
+
+def has_baseline(study):
+    return bool(study.get('resultsSection', {}).get('baselineCharacteristicsModule', {}).get('groups'))
+
+def _baseline_module(study):
+    if not has_baseline(study):
+        raise ValueError(f"{study_nct_id(study)} has no posted baseline characteristics")
+    return study['resultsSection']['baselineCharacteristicsModule']
+
+def _count(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):  # 'NA' and missing values
+        return 0
+
+# The measure with the given title; otherwise the first whose title starts with the same word
+# (e.g. 'Race/Ethnicity, Customized' when the NIH/OMB race categories were not used)
+def _find_measure(module, title):
+    measures = module.get('measures', [])
+    for measure in measures:
+        if measure.get('title') == title:
+            return measure
+    prefix = title.split()[0].rstrip(':')
+    for measure in measures:
+        if measure.get('title', '').startswith(prefix):
+            return measure
+    return None
+
+# Participants per group title from a list of denominators
+def _participants(denoms, group_titles):
+    denom = next((denom for denom in denoms or [] if denom.get('units') == 'Participants'), None)
+    if denom is None and denoms:
+        denom = denoms[0]
+    if denom is None:
+        return {}
+    return {group_titles[count['groupId']]: _count(count.get('value')) for count in denom.get('counts', [])}
+
+# Participants analyzed for a measure, per group title
+def measure_analyzed(study, title):
+    module = _baseline_module(study)
+    group_titles = {group['id']: group['title'] for group in module['groups']}
+    measure = _find_measure(module, title)
+    if measure is None:
+        return {}
+    return _participants(measure.get('denoms') or module.get('denoms'), group_titles)
+
+# Participant counts of a count measure: one row per category, one column per group (including 'Total')
+def measure_counts(study, title):
+    module = _baseline_module(study)
+    group_titles = {group['id']: group['title'] for group in module['groups']}
+    columns = list(group_titles.values())
+    measure = _find_measure(module, title)
+    if measure is None:
+        return pd.DataFrame(columns=columns, dtype=int)
+
+    counts = {}
+    for measure_class in measure.get('classes', []):
+        for category in measure_class.get('categories', []):
+            row = counts.setdefault(category.get('title') or measure_class.get('title', ''), {})
+            for measurement in category.get('measurements', []):
+                group = group_titles[measurement['groupId']]
+                row[group] = row.get(group, 0) + _count(measurement.get('value'))
+    return pd.DataFrame.from_dict(counts, orient='index', columns=columns).fillna(0).astype(int)
+
+# Arm/group descriptions followed by the race counts, in the layout of extract_baseline_characteristics
+def baseline_table(study):
+    module = _baseline_module(study)
+    group_titles = {group['id']: group['title'] for group in module['groups']}
+    overall = _participants(module.get('denoms'), group_titles)
+    population = module.get('populationDescription') or '[Not Specified]'
+
+    baseline_df = pd.DataFrame({
+        group['title']: [group.get('description', ''), str(overall.get(group['title'], '')), population]
+        for group in module['groups']
+    }, index=BASELINE_ROWS)
+
+    analyzed = measure_analyzed(study, RACE_MEASURE)
+    race_df = pd.concat([
+        pd.DataFrame({group: [f"{n} participants"] for group, n in analyzed.items()}, index=['Number Analyzed']),
+        measure_counts(study, RACE_MEASURE).astype(object)
+    ])
+
+    # Combine baseline and race data
+    return pd.concat([baseline_df, race_df])
+
+# One row per group with female and male counts and shares, in the layout of extract_gender_data
+def gender_table(study):
+    counts = measure_counts(study, SEX_MEASURE)
+    analyzed = measure_analyzed(study, SEX_MEASURE)
+
+    rows = []
+    for group in counts.columns:
+        n = analyzed.get(group, 0)
+        row = {'Number Analyzed': f"{n} participants"}
+        for gender in ('Female', 'Male'):
+            count = int(counts.at[gender, group]) if gender in counts.index else 0
+            row[f'{gender} Count'] = count
+            row[f'{gender} Percentage'] = f"{100 * count / n:.1f}%" if n else '0.0%'
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+# Baseline and gender tables of every study with posted baseline characteristics, {nct_id: (baseline_df, gender_df)}
+def fetch_baseline_tables(nct_ids, **kwargs):
+    studies = fetch_baseline_studies(nct_ids, **kwargs)
+    return {
+        nct_id: (baseline_table(study), gender_table(study))
+        for nct_id, study in studies.items() if has_baseline(study)
+    }
+
+if __name__ == "__main__":
+    # Usage: python -m simutrial.trial_api [NCT_ID ...]
+    nct_ids = sys.argv[1:] or ['NCT03653091']
+    tables = fetch_baseline_tables(nct_ids)
+
+    for nct_id in nct_ids:
+        if nct_id not in tables:
+            print(f"{nct_id}: no posted baseline characteristics")
+            continue
+        baseline_df, gender_df = tables[nct_id]
+        print(nct_id)
+        print(gender_df)
+        print(baseline_df)
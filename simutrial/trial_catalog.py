@@ -0,0 +1,208 @@
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from simutrial.disk_cache import atomic_write
+from simutrial.trial_api import STUDIES_API_URL, get_json
+
+# Local catalog of ClinicalTrials.gov studies, synced from the v2 API into SQLite. A sync follows
+# nextPageToken through every page of a query, upserting each page by NCT ID as it arrives (the
+# next page is already being fetched while one is written), and later syncs of the same query only
+# request studies updated since the newest update date already in the catalog. trials_display.py
+# reads the catalog a screenful at a time.
+CATALOG_DIR = os.path.join('.simutrial_cache', 'catalog')
+CATALOG_DB_PATH = os.path.join(CATALOG_DIR, 'studies.sqlite')
+
+# Study query as in trials_display.py (parameters of /api/v2/studies)
+DEFAULT_QUERY = {'query.cond': 'diabetes', 'filter.overallStatus': 'COMPLETED'}
+
+# Largest page the API serves
+PAGE_SIZE = 1000
+
+CATALOG_FIELDS = [
+    "protocolSection.identificationModule.nctId",
+    "protocolSection.identificationModule.briefTitle",
+    "protocolSection.statusModule.overallStatus",
+    "protocolSection.statusModule.startDateStruct",
+    "protocolSection.statusModule.completionDateStruct",
+    "protocolSection.statusModule.lastUpdatePostDateStruct",
+    "protocolSection.conditionsModule.conditions",
+    "documentSection.largeDocumentModule.largeDocs",
+    "hasResults",
+]
+
+CATALOG_COLUMNS = ['nct_id', 'title', 'status', 'conditions', 'start_date', 'completion_date',
+                   'has_results', 'study_documents', 'study_url', 'last_update']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS studies (
+    nct_id TEXT PRIMARY KEY,
+    title TEXT,
+    status TEXT,
+    conditions TEXT,
+    start_date TEXT,
+    completion_date TEXT,
+    has_results INTEGER,
+    study_documents TEXT,
+    study_url TEXT,
+    last_update TEXT
+);
+CREATE TABLE IF NOT EXISTS syncs (
+    query TEXT PRIMARY KEY,
+    last_update TEXT,
+    synced_at REAL NOT NULL
+);
+"""
+
+def _connect(db_path):
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    # Pages are written from a worker thread while the event loop fetches the next one; one at a time
+    conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')  # The viewer can read while a sync writes
+    conn.executescript(_SCHEMA)
+    return conn
+
+# Study documents as 'label, url' entries separated by '|' (the 'Study Documents' column of the CSV export)
+def _study_documents(nct_id, study):
+    documents = study.get('documentSection', {}).get('largeDocumentModule', {}).get('largeDocs', [])
+    if not documents:
+        return None
+    return '|'.join(
+        f"{document.get('label', document.get('typeAbbrev', ''))}, "
+        f"https://cdn.clinicaltrials.gov/large-docs/{nct_id[-2:]}/{nct_id}/{document.get('filename', '')}"
+        for document in documents
+    )
+
+# Catalog row of a study record, in CATALOG_COLUMNS order
+def catalog_row(study):
+    protocol = study['protocolSection']
+    status = protocol.get('statusModule', {})
+    nct_id = protocol['identificationModule']['nctId']
+    return (
+        nct_id,
+        protocol['identificationModule'].get('briefTitle'),
+        status.get('overallStatus'),
+        ', '.join(protocol.get('conditionsModule', {}).get('conditions', [])),
+        status.get('startDateStruct', {}).get('date'),
+        status.get('completionDateStruct', {}).get('date'),
+        int(bool(study.get('hasResults'))),
+        _study_documents(nct_id, study),
+        f"https://clinicaltrials.gov/study/{nct_id}",
+        status.get('lastUpdatePostDateStruct', {}).get('date'),
+    )
+
+def _upsert(conn, rows):
+    columns = ', '.join(CATALOG_COLUMNS)
+    placeholders = ', '.join('?' for _ in CATALOG_COLUMNS)
+    updates = ', '.join(f"{column} = excluded.{column}" for column in CATALOG_COLUMNS[1:])
+    with conn:
+        conn.executemany(f"INSERT INTO studies ({columns}) VALUES ({placeholders}) "
+                         f"ON CONFLICT(nct_id) DO UPDATE SET {updates}", rows)
+
+def _query_key(query):
+    return json.dumps(query, sort_keys=True)
+
+# Newest update date already synced for a query (None before its first sync)
+def last_synced_update(query, db_path=CATALOG_DB_PATH):
+    conn = _connect(db_path)
+    try:
+        row = conn.execute("SELECT last_update FROM syncs WHERE query = ?", (_query_key(query),)).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row is not None else None
+
+# Sync the studies matching query into the catalog and return the number of studies written.
+# Only studies updated since the last sync of the same query are requested unless full=True.
+# progress, when given, is called with the fraction of matching studies written
+async def sync_catalog_async(query=DEFAULT_QUERY, db_path=CATALOG_DB_PATH, url=STUDIES_API_URL, page_size=PAGE_SIZE,
+                             full=False, progress=None, timeout=30.0):
+    import httpx
+
+    since = None if full else last_synced_update(query, db_path)
+    params = {**query, 'fields': ','.join(CATALOG_FIELDS), 'pageSize': page_size, 'format': 'json'}
+    if since is not None:
+        # Inclusive range: studies updated on the day of the last sync are requested again and upserted
+        updated = f"AREA[LastUpdatePostDate]RANGE[{since},MAX]"
+        params['filter.advanced'] = f"({params['filter.advanced']}) AND {updated}" if 'filter.advanced' in params else updated
+
+    conn = _connect(db_path)
+    written, total, newest = 0, None, since
+    try:
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            next_page = asyncio.ensure_future(get_json(client, url, {**params, 'countTotal': 'true'}))
+            while next_page is not None:
+                page = await next_page
+                total = page.get('totalCount', total)
+                # Request the following page before writing this one, so the fetch overlaps the write
+                token = page.get('nextPageToken')
+                next_page = asyncio.ensure_future(get_json(client, url, {**params, 'pageToken': token})) if token else None
+
+                rows = [catalog_row(study) for study in page.get('studies', [])]
+                await asyncio.to_thread(_upsert, conn, rows)
+                written += len(rows)
+                newest = max([newest, *(row[-1] for row in rows)], key=lambda date: date or '')
+                if progress is not None and total:
+                    progress(min(written / total, 1.0))
+
+        with conn:
+            conn.execute("INSERT INTO syncs (query, last_update, synced_at) VALUES (?, ?, ?) "
+                         "ON CONFLICT(query) DO UPDATE SET last_update = excluded.last_update, synced_at = excluded.synced_at",
+                         (_query_key(query), newest, time.time()))
+    finally:
+        conn.close()
+    return written
+
+def sync_catalog(query=DEFAULT_QUERY, **kwargs):
+    return asyncio.run(sync_catalog_async(query, **kwargs))
+
+def _where(with_documents):
+    return "WHERE study_documents IS NOT NULL" if with_documents else ""
+
+def catalog_count(db_path=CATALOG_DB_PATH, with_documents=False):
+    conn = _connect(db_path)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM studies {_where(with_documents)}").fetchone()[0]
+    finally:
+        conn.close()
+
+# One window of catalog rows (tuples in CATALOG_COLUMNS order), most recently updated first
+def catalog_rows(offset, limit, db_path=CATALOG_DB_PATH, with_documents=False):
+    conn = _connect(db_path)
+    try:
+        return conn.execute(f"SELECT {', '.join(CATALOG_COLUMNS)} FROM studies {_where(with_documents)} "
+                            "ORDER BY last_update DESC, nct_id LIMIT ? OFFSET ?", (limit, offset)).fetchall()
+    finally:
+        conn.close()
+
+# NCT IDs in the catalog, optionally only studies with posted results (e.g. to calibrate against)
+def catalog_nct_ids(db_path=CATALOG_DB_PATH, with_results=False):
+    conn = _connect(db_path)
+    try:
+        where = "WHERE has_results = 1" if with_results else ""
+        return [row[0] for row in conn.execute(f"SELECT nct_id FROM studies {where} ORDER BY nct_id")]
+    finally:
+        conn.close()
+
+# Write the catalog to a Parquet file for analysis with Polars
+def export_catalog(output_path, db_path=CATALOG_DB_PATH):
+    import polars as pl
+
+    conn = _connect(db_path)
+    try:
+        rows = conn.execute(f"SELECT {', '.join(CATALOG_COLUMNS)} FROM studies ORDER BY nct_id").fetchall()
+    finally:
+        conn.close()
+    catalog = pl.DataFrame(rows, schema=CATALOG_COLUMNS, orient='row')
+    atomic_write(output_path, catalog.write_parquet)
+    return catalog
+
+if __name__ == "__main__":
+    # Usage: python -m simutrial.trial_catalog [catalog.parquet]; set SIMUTRIAL_STUDIES_API_URL to sync from a local stand-in
+    written = sync_catalog(url=os.getenv("SIMUTRIAL_STUDIES_API_URL", STUDIES_API_URL),
+                           progress=lambda fraction: print(f"\r{fraction * 100:5.1f}%", end='', flush=True))
+    print(f"\nSynced {written} studies ({catalog_count()} in the catalog)")
+    if len(sys.argv) > 1:
+        export_catalog(sys.argv[1])
@@ -2,12 +2,10 @@ import streamlit as st
 import pandas as pd
 import polars as pl
 import json
-from mesa import Agent, Model
-from mesa.time import RandomActivation
-import random
 import numpy as np
 import time
 import openai
+from simutrial.simulation import ADAPTIVE_ENGINES, ENGINE_SAMPLING, run_simulations, run_enrollment_simulation
 
 # Load JSON mapping
 column_mapping = {
@@ -27,79 +25,20 @@ def normalize_columns(df, mapping):
                 break
     return df
 
-class PatientAgent(Agent):
-    def __init__(self, unique_id, model, age, gender, race, region, health_issues):
-        super().__init__(unique_id, model)
-        self.age = age
-        self.gender = gender
-        self.race = race
-        self.region = region
-        self.health_issues = health_issues
-        self.consented = False
-
-    def step(self):
-        # Determine consent based on consent rate range
-        consent_probability = random.uniform(self.model.consent_rate_min, self.model.consent_rate_max)
-        self.consented = random.random() < consent_probability
-
-class RecruitmentModel(Model):
-    def __init__(self, df, consent_rate_min, consent_rate_max):
-        self.df = df
-        self.consent_rate_min = consent_rate_min
-        self.consent_rate_max = consent_rate_max
-        self.schedule = RandomActivation(self)
-
-        # Create agents based on the DataFrame
-        for i, row in df.iterrows():
-            age = row.get('age', None)
-            gender = row.get('gender', None)
-            race = row.get('race_ethnicity', None)
-            region = row.get('region', None)
-            health_issues = row.get('health_issues', None)
-            
-            agent = PatientAgent(i, self, age, gender, race, region, health_issues)
-            self.schedule.add(agent)
-
-    def step(self):
-        self.schedule.step()
-
-# Function to run multiple simulations and calculate scores
-def run_simulations(df, consent_rate_min, consent_rate_max, num_simulations):
-    consent_results = []
-    staff_requirements = []
-    site_recommendations = []
-
-    for i in range(num_simulations):
-        model = RecruitmentModel(df, consent_rate_min, consent_rate_max)
-        for _ in range(1):  # Run for 1 step (as we only need to determine consent)
-            model.step()
-        consented_agents = sum([1 for agent in model.schedule.agents if agent.consented])
-        consent_results.append(min(consented_agents, len(df)))
-        
-        # Use a simple heuristic to estimate staff and sites
-        staff_needed = max(1, int(consented_agents / 50))  # Assume 1 staff per 50 consenting patients
-        sites_needed = max(1, int(consented_agents / 100))  # Assume 1 site per 100 consenting patients
-        staff_requirements.append(staff_needed)
-        site_recommendations.append(sites_needed)
-
-        # Update progress bar
-        st.session_state.progress.progress((i + 1) / num_simulations)
-    
-    # Calculate statistics
-    mean_consent_rate = (np.mean(consent_results) / len(df)) * 100
-    confidence_interval = (np.std(consent_results) * 1.96 / np.sqrt(num_simulations)) / len(df) * 100
-    mean_staff = np.mean(staff_requirements)
-    mean_sites = np.mean(site_recommendations)
-    
-    return {
-        "mean_consent_rate": mean_consent_rate,
-        "confidence_interval": confidence_interval,
-        "staff_requirements": staff_requirements,
-        "site_recommendations": site_recommendations,
-        "mean_staff": mean_staff,
-        "mean_sites": mean_sites
-    }
+# Ways of drawing the consent uniforms (see engine.uniform_batches); simulation.ENGINE_SAMPLING lists each engine's
+SAMPLING_METHODS = {
+    "Independent": "independent",
+    "Antithetic Pairs": "antithetic",
+    "Sobol (Quasi-Random)": "sobol"
+}
 
+# Engines selectable in the UI
+SIMULATION_ENGINES = {
+    "Vectorized": "vectorized",
+    "Parallel": "parallel",
+    "Analytic": "analytic",
+    "Mesa (reference)": "mesa"
+}
 
 # Streamlit App Configuration
 st.set_page_config(page_title="Patient Recruitment Simulation", layout="wide")
@@ -137,6 +76,23 @@ if data_file is not None:
     # Number of simulations
     num_simulations = st.number_input("Number of Simulations", min_value=1, max_value=500, value=100)
 
+    # Simulation engine; the Mesa agent model is kept as a slower reference
+    engine = st.selectbox("Simulation Engine", list(SIMULATION_ENGINES))
+    seed = st.number_input("Random Seed", min_value=0, value=0)
+    # Only the sampling methods and early stopping the selected engine supports are offered
+    sampling = st.selectbox("Sampling", [name for name, method in SAMPLING_METHODS.items()
+                                         if method in ENGINE_SAMPLING[SIMULATION_ENGINES[engine]]],
+                            help="Variance reduction: Antithetic Pairs for the Vectorized and Parallel engines, "
+                                 "Sobol for the Vectorized engine")
+
+    # Sequential mode: Number of Simulations becomes a cap and replicates stop once precise enough
+    target_half_width = None
+    can_stop_early = SIMULATION_ENGINES[engine] in ADAPTIVE_ENGINES
+    stop_early = st.checkbox("Stop Early at Target Precision", disabled=not can_stop_early,
+                             help=None if can_stop_early else f"Not available for the {engine} engine")
+    if stop_early and can_stop_early:
+        target_half_width = st.number_input("Target Confidence Interval (+/- % points)", min_value=0.001, max_value=10.0, value=0.1)
+
     # Dropdown for disease area
     disease_area = st.selectbox(
         "Disease Area Focus",
@@ -162,6 +118,11 @@ if data_file is not None:
     # Number input for study size
     study_size = st.number_input("Study Size", min_value=1, max_value=10000, value=100)
 
+    # Time-resolved recruitment over repeated screening windows
+    time_resolved = st.checkbox("Simulate Enrollment Over Time")
+    if time_resolved:
+        num_periods = st.number_input("Screening Windows (Weeks)", min_value=1, max_value=260, value=52)
+
     # Run Simulation button
     if st.button("Run Simulation"):
         # Initialize progress bar
@@ -171,13 +132,41 @@ if data_file is not None:
         df_normalized_pd = df_normalized.to_pandas()
         
         # Run the simulations
-        simulation_results = run_simulations(df_normalized_pd, consent_rate_min, consent_rate_max, num_simulations)
+        simulation_results = run_simulations(df_normalized_pd, consent_rate_min, consent_rate_max, num_simulations,
+                                             engine=SIMULATION_ENGINES[engine], seed=seed,
+                                             target_half_width=target_half_width,
+                                             sampling=SAMPLING_METHODS[sampling], consent_model="uniform",
+                                             progress=st.session_state.progress.progress)
         
         # Display results
         st.write(f"Mean Consent Rate: {simulation_results['mean_consent_rate']}%")
-        st.write(f"Confidence Interval: +/- {simulation_results['confidence_interval']}")
+        if "consent_rate_interval" in simulation_results:
+            # Analytic engine: the mean is exact, so show the range of a single trial's consent rate instead
+            low, high = simulation_results['consent_rate_interval']
+            coverage = simulation_results['consent_rate_coverage'] * 100
+            st.write(f"{coverage:g}% Range of a Single Trial's Consent Rate: {low}% to {high}%")
+        else:
+            st.write(f"Confidence Interval: +/- {simulation_results['confidence_interval']}")
+        if target_half_width and "num_simulations" in simulation_results:
+            st.write(f"Simulations Run: {simulation_results['num_simulations']}")
+        if simulation_results.get("sampling", "independent") != "independent":
+            st.write(f"Variance Reduction: {simulation_results['variance_reduction']:.1f}x over independent sampling")
         st.write(f"Average Staff Needed: {simulation_results['mean_staff']}")
         st.write(f"Average Sites Needed: {simulation_results['mean_sites']}")
+
+        if time_resolved:
+            enrollment = run_enrollment_simulation(df_normalized_pd, consent_rate_min, consent_rate_max,
+                                                   num_simulations, num_periods, study_size, seed=seed,
+                                                   sampling=SAMPLING_METHODS[sampling], consent_model="uniform",
+                                                   progress=st.session_state.progress.progress)
+            st.subheader("Enrollment Over Time")
+            curve = pd.DataFrame({"Mean": enrollment["mean_curve"]}, index=pd.RangeIndex(1, num_periods + 1, name="Week"))
+            for p, band in enrollment["curve_percentiles"].items():
+                curve[f"P{p}"] = band
+            st.line_chart(curve)
+            for p, weeks in enrollment["time_to_target_percentiles"].items():
+                st.write(f"P{p} Weeks to Reach Study Size: {weeks if np.isfinite(weeks) else f'not within {num_periods} weeks'}")
+            st.write(f"Probability of Reaching Study Size: {enrollment['probability_target_reached'] * 100}%")
         
         
         # Clear progress bar
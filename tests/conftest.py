@@ -0,0 +1,41 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from simutrial.patientVis import fit_willingness_model, model_features
+
+RACES = ['AfricanAmerican', 'Asian', 'Caucasian', 'Hispanic', 'Other']
+STATES = ['Texas', 'California', 'New York', 'Ohio', 'Florida']
+
+# EMR extract in the layout the app ingests (one-hot race:* columns, 0/1 condition flags)
+def make_emr(n, seed=0, first_id=0):
+    rng = np.random.default_rng(seed)
+    race = rng.integers(0, len(RACES), n)
+    return pl.DataFrame({
+        'patient_id': np.arange(first_id, first_id + n),
+        'year': np.full(n, 2020),
+        'gender': rng.choice(['Male', 'Female'], n),
+        'age': rng.integers(18, 90, n).astype(float),
+        'location': rng.choice(STATES, n),
+        **{f'race:{name}': (race == i).astype(int) for i, name in enumerate(RACES)},
+        'hypertension': rng.integers(0, 2, n),
+        'heart_disease': rng.integers(0, 2, n),
+    })
+
+@pytest.fixture(scope='session')
+def willingness_model():
+    rng = np.random.default_rng(0)
+    n = 2000
+    features = pl.DataFrame({
+        'Age': rng.integers(18, 90, n).astype(float),
+        'CENSREG': rng.integers(1, 5, n).astype(float),
+        'BirthGender': rng.integers(0, 2, n),
+        'RaceEthn': rng.choice([1, 2, 3, 4, -9], n),
+    }).to_pandas()[model_features]
+    participated = rng.random(n) < 0.2 + 0.3 * (features['Age'] < 40)
+    return fit_willingness_model(features, participated)
+
+@pytest.fixture
+def column_mapping():
+    from simutrial.normalize import load_column_mapping
+    return load_column_mapping()
@@ -0,0 +1,142 @@
+import json
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for ClinicalTrials.gov, for the tests and for trying the sync and scraping code offline:
+#   /api/v2/studies  the v2 studies endpoint as trial_api.py and trial_catalog.py call it (filter.ids,
+#                    pageSize/pageToken paging, countTotal, and the LastUpdatePostDate RANGE of filter.advanced)
+#   /study/<NCT ID>  a study page with its baseline characteristics text, as trial_scraper.py renders it
+# Run it with `python tests/studies_api_server.py [port]` and point SIMUTRIAL_STUDIES_API_URL at
+# http://localhost:<port>/api/v2/studies (or SIMUTRIAL_TRIALS_BASE_URL at http://localhost:<port>)
+
+# Study record in the shape the API returns (only the modules the repo reads)
+def make_study(nct_id, last_update, title=None, has_results=False, documents=(), conditions=('Diabetes',),
+               baseline=None):
+    study = {
+        'protocolSection': {
+            'identificationModule': {'nctId': nct_id, 'briefTitle': title or f"Study {nct_id}"},
+            'statusModule': {'overallStatus': 'COMPLETED', 'lastUpdatePostDateStruct': {'date': last_update}},
+            'conditionsModule': {'conditions': list(conditions)},
+        },
+        'hasResults': has_results,
+    }
+    if documents:
+        study['documentSection'] = {'largeDocumentModule': {'largeDocs': [
+            {'label': label, 'filename': filename} for label, filename in documents
+        ]}}
+    if baseline is not None:
+        study['resultsSection'] = {'baselineCharacteristicsModule': baseline}
+    return study
+
+def _nct_id(study):
+    return study['protocolSection']['identificationModule']['nctId']
+
+def _last_update(study):
+    return study['protocolSection']['statusModule']['lastUpdatePostDateStruct']['date']
+
+def _study_page(nct_id):
+    return (f"<html><body><h1>{nct_id}</h1><p>Participant Flow</p><h2>Baseline Characteristics</h2>"
+            f"<p>{nct_id} Overall Number of Baseline Participants 9</p><footer>About ClinicalTrials.gov</footer>"
+            f"</body></html>")
+
+class StudiesAPIServer:
+    def __init__(self, studies=(), port=0):
+        self.studies = {_nct_id(study): study for study in studies}
+        self.requests = []  # (path, query) of every request served
+        self.failures = 0  # The next this many requests get a 503
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def studies_url(self):
+        return f"{self.url}/api/v2/studies"
+
+    def put(self, study):
+        with self._lock:
+            self.studies[_nct_id(study)] = study
+
+    def fail_next(self, count):
+        with self._lock:
+            self.failures = count
+
+    def _page(self, query):
+        studies = sorted(self.studies.values(), key=_nct_id)
+        if 'filter.ids' in query:
+            ids = set(query['filter.ids'].split(','))
+            studies = [study for study in studies if _nct_id(study) in ids]
+        advanced = query.get('filter.advanced', '')
+        if 'RANGE[' in advanced:
+            since = advanced.split('RANGE[', 1)[1].split(',', 1)[0]
+            studies = [study for study in studies if (_last_update(study) or '') >= since]
+
+        size = int(query.get('pageSize', 10))
+        start = int(query.get('pageToken', 0))
+        page = {'studies': studies[start:start + size]}
+        if query.get('countTotal') == 'true':
+            page['totalCount'] = len(studies)
+        if start + size < len(studies):
+            page['nextPageToken'] = str(start + size)
+        return page
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urllib.parse.urlparse(self.path)
+                query = dict(urllib.parse.parse_qsl(parsed.query))
+                with server._lock:
+                    server.requests.append((parsed.path, query))
+                    failing = server.failures > 0
+                    server.failures -= failing
+                if failing:
+                    self._send(503, 'text/plain', b'Service Unavailable')
+                elif parsed.path == '/api/v2/studies':
+                    with server._lock:
+                        body = json.dumps(server._page(query)).encode()
+                    self._send(200, 'application/json', body)
+                elif parsed.path.startswith('/study/'):
+                    self._send(200, 'text/html', _study_page(parsed.path.rsplit('/', 1)[1]).encode())
+                else:
+                    self._send(404, 'text/plain', b'Not Found')
+
+            def _send(self, status, content_type, body):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+if __name__ == "__main__":
+    import sys
+
+    # A small catalog of completed diabetes trials, a third of them with study documents
+    catalog = [
+        make_study(f"NCT{i:08d}", f"2024-{1 + i % 12:02d}-01", has_results=i % 2 == 0,
+                   documents=[('Study Protocol', 'Prot_000.pdf')] if i % 3 == 0 else ())
+        for i in range(250)
+    ]
+    with StudiesAPIServer(catalog, port=int(sys.argv[1]) if len(sys.argv) > 1 else 8000) as stand_in:
+        print(f"Serving {len(catalog)} studies at {stand_in.studies_url}")
+        stand_in._thread.join()
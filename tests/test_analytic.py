@@ -0,0 +1,18 @@
+import numpy as np
+
+from simutrial.analytic import analytic_consent_results, analytic_uniform_consent_results
+
+def test_exact_mean_has_no_confidence_interval():
+    results = analytic_consent_results(np.full(200, 0.3))
+    assert results['confidence_interval'] == 0.0
+    assert np.isclose(results['mean_consent_rate'], 30.0)
+
+def test_consent_rate_interval_is_the_single_trial_range():
+    n, p = 400, 0.25
+    results = analytic_uniform_consent_results(n, 0.2, 0.3)
+    low, high = results['consent_rate_interval']
+    # Binomial(400, 0.25): standard deviation of the rate is about 2.17 percentage points
+    half_width = 1.96 * np.sqrt(p * (1 - p) / n) * 100
+    assert abs((high - low) / 2 - half_width) < 0.5
+    assert low < 25.0 < high
+    assert results['consent_rate_coverage'] == 0.95
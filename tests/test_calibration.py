@@ -0,0 +1,114 @@
+import json
+import os
+
+import numpy as np
+import polars as pl
+import pytest
+
+from studies_api_server import make_study
+from simutrial.calibration import (RACE_CATEGORIES, TARGET_COLUMNS, _cohort_arrays, _expected_shares, fit_adjustment,
+                                   load_calibration, save_calibration, trial_targets, trial_targets_frame)
+from simutrial.streaming import model_feature_exprs, scan_feature_cells
+
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'NCT03653091.json')
+
+# Count measure of a single-arm study (its only group doubles as the total)
+def _measure(title, counts):
+    return {'title': title, 'classes': [{'categories': [
+        {'title': category, 'measurements': [{'groupId': 'BG000', 'value': str(count)}]}
+        for category, count in counts.items()
+    ]}]}
+
+def _study(*measures):
+    baseline = {
+        'groups': [{'id': 'BG000', 'title': 'Arm A'}],
+        'denoms': [{'units': 'Participants', 'counts': [{'groupId': 'BG000', 'value': '40'}]}],
+        'measures': list(measures),
+    }
+    return make_study('NCT00000001', '2024-01-01', baseline=baseline)
+
+def _targets(study):
+    return dict(zip(TARGET_COLUMNS, trial_targets(study)))
+
+def test_trial_targets_split_race_by_ethnicity():
+    study = _study(
+        _measure('Race (NIH/OMB)', {'White': 24, 'Black or African American': 8, 'Asian': 4,
+                                    'Unknown or Not Reported': 4}),
+        _measure('Ethnicity (NIH/OMB)', {'Hispanic or Latino': 10, 'Not Hispanic or Latino': 30,
+                                         'Unknown or Not Reported': 0}),
+        _measure('Sex: Female, Male', {'Female': 22, 'Male': 18}),
+    )
+    targets = _targets(study)
+    # A quarter of the participants with a known ethnicity are Hispanic; the known-race counts are split alike
+    assert targets['Hispanic'] == pytest.approx(36 * 0.25)
+    assert targets['Caucasian'] == pytest.approx(24 * 0.75)
+    assert targets['AfricanAmerican'] == pytest.approx(8 * 0.75)
+    assert targets['Asian'] == pytest.approx(4 * 0.75)
+    assert targets['Other'] == 0
+    assert (targets['Female'], targets['Male']) == (22, 18)
+
+def test_trial_targets_without_hispanic_participants():
+    study = _study(
+        _measure('Race (NIH/OMB)', {'White': 30, 'Black or African American': 10}),
+        _measure('Ethnicity (NIH/OMB)', {'Not Hispanic or Latino': 40}),
+    )
+    targets = _targets(study)
+    assert targets['Hispanic'] == 0
+    assert (targets['Caucasian'], targets['AfricanAmerican']) == (30, 10)
+
+def test_trial_targets_customized_race_categories():
+    study = _study(_measure('Race/Ethnicity, Customized', {
+        'White, Non-Hispanic': 20, 'Black, Not Hispanic or Latino': 6, 'Hispanic or Latino': 9, 'Not Hispanic or Latino': 5,
+    }))
+    targets = _targets(study)
+    assert (targets['Caucasian'], targets['AfricanAmerican'], targets['Hispanic']) == (20, 6, 9)
+    assert targets['Other'] == 0  # The bare non-Hispanic row reports no race
+
+def test_trial_targets_frame_of_fixture():
+    with open(FIXTURE_PATH) as f:
+        study = json.load(f)
+    frame = trial_targets_frame({'NCT03653091': study, 'NCT00000002': make_study('NCT00000002', '2024-01-01')},
+                                regions={'NCT03653091': 3})
+    assert frame['nct_id'].to_list() == ['NCT03653091']  # Studies without results are left out
+    row = frame.row(0, named=True)
+    assert row['CENSREG'] == 3
+    assert (row['Caucasian'], row['AfricanAmerican'], row['Asian'], row['Hispanic']) == (6, 2, 1, 0)
+    assert (row['Female'], row['Male']) == (3, 6)
+
+@pytest.fixture(scope='module')
+def cells():
+    from conftest import make_emr
+
+    emr = make_emr(5000, seed=1)
+    return scan_feature_cells(emr.lazy().with_columns(model_feature_exprs(emr.columns))).collect()
+
+def test_fit_adjustment_recovers_known_rates(cells, willingness_model):
+    known = {'assumption_rates': {1: 0.1, 2: 0.4, 3: 0.2, 4: 0.3, -9: 0.25}, 'race_multiplier': 1.5,
+             'young_age': 30, 'young_boost': 2.0}
+
+    # Noise-free baseline counts: 10,000 participants per population in the shares the known adjustment implies
+    shares = _expected_shares(known, _cohort_arrays(cells, willingness_model))
+    schema = {'nct_id': pl.String, 'CENSREG': pl.Float64, **{column: pl.Float64 for column in TARGET_COLUMNS}}
+    targets = pl.DataFrame([[f"NCT{region:08d}", float(region) if region else None] + list(shares[region] * 10_000)
+                            for region in range(5)], schema=schema, orient='row')
+
+    # Start from equal rates; the boost is held at its known value since baseline tables barely identify it
+    initial = {**known, 'assumption_rates': dict.fromkeys(known['assumption_rates'], 0.5)}
+    adjustment, report = fit_adjustment(cells, targets, willingness_model, initial=initial)
+    assert report['converged']
+    assert report['log_likelihood'] > report['initial_log_likelihood']
+
+    # Only the rate ratios are well identified (the score offset alone pins their scale)
+    fitted, expected = adjustment['assumption_rates'], known['assumption_rates']
+    for code in expected:
+        assert fitted[code] / fitted[2] == pytest.approx(expected[code] / expected[2], rel=0.05)
+    report_shares = report['shares']
+    assert len(report_shares) == 5 * len(TARGET_COLUMNS)
+    assert np.abs(report_shares['observed'] - report_shares['fitted']).max() < 0.005
+    assert set(report_shares['category']) == set(RACE_CATEGORIES) | {'Female', 'Male'}
+
+def test_save_and_load_calibration(tmp_path):
+    adjustment = {'assumption_rates': {1: 0.1, 2: 0.4, 3: 0.2, 4: 0.3, -9: 0.25}, 'race_multiplier': 1.5,
+                  'young_age': 30, 'young_boost': 1.0}
+    save_calibration('diabetes', adjustment, {'trials': 3, 'shares': None}, calibration_dir=tmp_path)
+    assert load_calibration('diabetes', calibration_dir=tmp_path) == adjustment
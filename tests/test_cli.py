@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+from simutrial.cli import main
+from conftest import make_emr
+
+@pytest.mark.parametrize('targeting', [{'race': ['Asian']}, {'region': ['West']}, {'gender': ['Female']}])
+def test_uniform_consent_targets_a_raw_extract(tmp_path, targeting):
+    extract = tmp_path / 'extract.csv'
+    make_emr(500, seed=5).write_csv(extract)
+    output = tmp_path / 'results.json'
+
+    assert main(['simulate', '--input', str(extract), '--consent-model', 'uniform', '--sims', '20', '--seed', '1',
+                 '--targeting', json.dumps(targeting), '--output', str(output)]) == 0
+    results = json.loads(output.read_text())
+    assert 0 < results['patients'] < 500
+    assert 20 <= results['mean_consent_rate'] <= 80
+
+def test_stratified_engine_reads_strata_of_a_scored_cohort(tmp_path, willingness_model, column_mapping):
+    from simutrial.ingest import ingest_upload
+
+    extract = tmp_path / 'extract.csv'
+    make_emr(500, seed=6).write_csv(extract)
+    cohort = tmp_path / 'cohort.parquet'
+    ingest_upload(str(extract), column_mapping, willingness_model).write_parquet(cohort)
+
+    outputs = {}
+    for engine in ('vectorized', 'stratified'):
+        output = tmp_path / f'{engine}.json'
+        assert main(['simulate', '--input', str(cohort), '--engine', engine, '--sims', '2000', '--seed', '1',
+                     '--targeting', json.dumps({'region': ['South', 'West']}), '--output', str(output)]) == 0
+        outputs[engine] = json.loads(output.read_text())
+    assert outputs['stratified']['patients'] == outputs['vectorized']['patients'] > 0
+    assert outputs['stratified']['mean_consent_rate'] == pytest.approx(outputs['vectorized']['mean_consent_rate'], abs=1)
+
+@pytest.mark.parametrize('engine', ['stratified', 'analytic', 'mesa'])
+def test_workers_are_rejected_for_single_process_engines(tmp_path, engine):
+    extract = tmp_path / 'extract.csv'
+    make_emr(50, seed=5).write_csv(extract)
+    with pytest.raises(ValueError, match='workers'):
+        main(['simulate', '--input', str(extract), '--engine', engine, '--workers', '4', '--consent-model', 'uniform'])
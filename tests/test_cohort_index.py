@@ -0,0 +1,51 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from conftest import make_emr
+from simutrial.cohort_index import build_cohort_index, cohort_rows
+from simutrial.patientVis import censreg_codes
+from simutrial.streaming import model_feature_exprs
+from simutrial.targeting import target_cohort
+
+RACES = ['AfricanAmerican', 'Asian', 'Caucasian', 'Hispanic', 'Other']
+
+@pytest.fixture(scope='module')
+def cohort():
+    rng = np.random.default_rng(7)
+    emr = make_emr(5000, seed=7)
+    # Fractional ages (as exported from birth dates), with some missing
+    ages = np.round(rng.uniform(17, 91, len(emr)), 2)
+    missing = pl.Series(rng.random(len(emr)) < 0.02)
+    emr = emr.with_columns(pl.when(missing).then(None).otherwise(pl.Series(ages)).alias('age'))
+    return emr.with_columns(model_feature_exprs(emr.columns)).drop('Age')
+
+def _random_spec(rng):
+    spec = {}
+    if rng.random() < 0.8:
+        bounds = [None, float(rng.integers(18, 90)), float(np.round(rng.uniform(18, 90), 2))]
+        age_min, age_max = bounds[rng.integers(3)], bounds[rng.integers(3)]
+        if age_min is not None and age_max is not None and age_min > age_max:
+            age_min, age_max = age_max, age_min
+        spec['age'] = (age_min, age_max)
+    if rng.random() < 0.4:
+        spec['gender'] = list(rng.choice(['Male', 'Female'], rng.integers(1, 3), replace=False))
+    if rng.random() < 0.4:
+        spec['race'] = list(rng.choice(RACES, rng.integers(1, 4), replace=False))
+    if rng.random() < 0.4:
+        spec['region'] = list(rng.choice(list(censreg_codes), rng.integers(1, 3), replace=False))
+    if rng.random() < 0.3:
+        spec['location'] = list(rng.choice(['Texas', 'California', 'New York', 'Ohio', 'Florida'], rng.integers(1, 3),
+                                           replace=False))
+    if rng.random() < 0.3:
+        spec['conditions'] = list(rng.choice(['hypertension', 'heart_disease'], rng.integers(1, 3), replace=False))
+    return spec
+
+def test_bitmap_matches_the_targeting_predicate(cohort):
+    index = build_cohort_index(cohort)
+    rows = cohort.with_row_index('row')
+    rng = np.random.default_rng(0)
+    specs = [{'age': (18, 65)}, {'age': (None, 30)}, {'age': (40.5, None)}, {'age': (30.25, 30.75)}, {}]
+    for spec in specs + [_random_spec(rng) for _ in range(200)]:
+        expected = target_cohort(rows, spec, ['row']).collect()['row'].to_numpy()
+        np.testing.assert_array_equal(cohort_rows(index, spec), expected, err_msg=str(spec))
@@ -0,0 +1,115 @@
+import io
+import os
+import threading
+
+from conftest import make_emr
+from simutrial.disk_cache import atomic_write, evict_lru, store_lru_entry
+from simutrial.patient_cache import load_or_ingest_upload
+from simutrial.result_cache import load_result, store_result
+
+def test_concurrent_writers_in_one_process_never_leave_partial_files(tmp_path):
+    path = str(tmp_path / 'entry.bin')
+    payloads = [bytes([i]) * 200_000 for i in range(8)]
+    errors = []
+
+    def write(payload):
+        def fill(tmp_path):
+            with open(tmp_path, 'wb') as f:
+                for start in range(0, len(payload), 4096):
+                    f.write(payload[start:start + 4096])
+        try:
+            for _ in range(10):
+                atomic_write(path, fill)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(payload,)) for payload in payloads]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    with open(path, 'rb') as f:
+        assert f.read() in payloads
+    assert os.listdir(tmp_path) == ['entry.bin']  # No temporary files left behind
+
+def test_failed_write_leaves_nothing_behind(tmp_path):
+    def fail(tmp_path):
+        raise RuntimeError("disk full")
+    try:
+        atomic_write(str(tmp_path / 'entry.bin'), fail)
+    except RuntimeError:
+        pass
+    assert os.listdir(tmp_path) == []
+
+def _write_bytes(path, n):
+    with open(path, 'wb') as f:
+        f.write(b'x' * n)
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    for i in range(5):
+        path = tmp_path / f"entry_{i}.bin"
+        _write_bytes(path, 100)
+        os.utime(path, (1000 + i, 1000 + i))
+    os.utime(tmp_path / 'entry_0.bin')  # Used just now
+    assert evict_lru(str(tmp_path), 300, 'entry_', '.bin') == 300
+    assert sorted(os.listdir(tmp_path)) == ['entry_0.bin', 'entry_3.bin', 'entry_4.bin']
+
+def test_store_rescans_only_past_the_limit(tmp_path):
+    cache_dir = tmp_path / 'cache'
+    for i in range(20):
+        store_lru_entry(str(cache_dir / f"entry_{i}.bin"), lambda p: _write_bytes(p, 100), 1000, 'entry_', '.bin')
+    assert sum(os.path.getsize(cache_dir / name) for name in os.listdir(cache_dir)) <= 1000
+    assert 'entry_19.bin' in os.listdir(cache_dir)
+
+def test_result_cache_round_trip(tmp_path):
+    store_result('abc', {'mean_consent_rate': 12.5}, cache_dir=str(tmp_path))
+    assert load_result('abc', cache_dir=str(tmp_path)) == {'mean_consent_rate': 12.5}
+    assert load_result('missing', cache_dir=str(tmp_path)) is None
+
+def test_patient_cache_is_bounded(tmp_path, willingness_model, column_mapping):
+    cache_dir = str(tmp_path / 'patients')
+    uploads = []
+    for seed in range(4):
+        buffer = io.BytesIO()
+        make_emr(2000, seed=seed).write_csv(buffer)
+        upload = io.BytesIO(buffer.getvalue())
+        upload.name = f"panel_{seed}.csv"
+        uploads.append(upload)
+
+    load_or_ingest_upload(uploads[0], column_mapping, willingness_model, 'model', cache_dir=cache_dir)
+    one_cohort = os.path.getsize(os.path.join(cache_dir, os.listdir(cache_dir)[0]))
+    for upload in uploads[1:]:
+        load_or_ingest_upload(upload, column_mapping, willingness_model, 'model', cache_dir=cache_dir,
+                              max_bytes=2 * one_cohort)
+    assert len(os.listdir(cache_dir)) == 2
+
+    uploads[3].seek(0)
+    reloaded, _ = load_or_ingest_upload(uploads[3], column_mapping, willingness_model, 'model', cache_dir=cache_dir,
+                                        max_bytes=2 * one_cohort)
+    assert len(reloaded) == 2000
+    assert len(os.listdir(cache_dir)) == 2
+
+def test_scrape_cache_scans_for_eviction_only_past_the_limit(tmp_path, monkeypatch):
+    from simutrial import disk_cache
+    from simutrial.scrape_cache import load_entry, page_key, store_entry
+
+    scans = []
+    evict = disk_cache.evict_lru
+    monkeypatch.setattr(disk_cache, 'evict_lru', lambda *args, **kwargs: scans.append(args) or evict(*args, **kwargs))
+
+    cache_dir = str(tmp_path / 'scrape')
+    for i in range(500):
+        store_entry(page_key(f"NCT{i:08d}"), 'x' * 1000, cache_dir, max_bytes=100_000)
+    assert len(scans) < 50  # Not once per write
+    assert sum(os.path.getsize(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir)) <= 100_000
+    assert load_entry(page_key('NCT00000499'), cache_dir) == 'x' * 1000
+    assert load_entry(page_key('NCT00000000'), cache_dir) is None  # Least recently used, evicted
+
+def test_scrape_cache_entries_expire(tmp_path):
+    from simutrial.scrape_cache import load_entry, store_entry
+
+    store_entry('key', {'text': 'baseline'}, str(tmp_path))
+    assert load_entry('key', str(tmp_path)) == {'text': 'baseline'}
+    assert load_entry('key', str(tmp_path), ttl=-1) is None
@@ -0,0 +1,127 @@
+import time
+
+import numpy as np
+import polars as pl
+import pytest
+
+from simutrial import jobs
+from simutrial.jobs import STALE_JOB_SECONDS, _claim_job, _connect, job_result, job_status, list_jobs, run_worker, submit_job
+
+def _cohort(n=500, seed=0):
+    rng = np.random.default_rng(seed)
+    return pl.DataFrame({
+        'age': rng.integers(18, 90, n).astype(float),
+        'gender': rng.choice(['Male', 'Female'], n),
+        'RaceEthn': rng.choice([1, 2, 3, 4, -9], n),
+        'CENSREG': rng.choice([1.0, 2.0, 3.0, 4.0], n),
+        'WillingnessScore': rng.uniform(0, 0.5, n),
+    })
+
+def _simulate_params(**simulation):
+    return {'simulation': {'consent_rate_min': 0.2, 'consent_rate_max': 0.8, 'num_simulations': 50, 'seed': 1,
+                           **simulation},
+            'enrollment': None, 'result_key': None}
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / 'jobs' / 'jobs.sqlite')
+
+def test_jobs_are_claimed_oldest_first_and_once(db_path):
+    first = submit_job('simulate', _simulate_params(), _cohort(), db_path)
+    second = submit_job('simulate', _simulate_params(), _cohort(), db_path)
+    conn = _connect(db_path)
+    try:
+        assert _claim_job(conn, 'worker-a')['id'] == first
+        assert _claim_job(conn, 'worker-b')['id'] == second
+        assert _claim_job(conn, 'worker-c') is None
+    finally:
+        conn.close()
+    assert job_status(first, db_path)['worker'] == 'worker-a'
+    assert {job['status'] for job in list_jobs(db_path=db_path)} == {'running'}
+
+def test_stale_jobs_are_requeued(db_path):
+    job_id = submit_job('simulate', _simulate_params(), _cohort(), db_path)
+    conn = _connect(db_path)
+    try:
+        _claim_job(conn, 'worker-a')
+        assert _claim_job(conn, 'worker-b') is None  # Still heartbeating
+
+        conn.execute("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", (time.time() - STALE_JOB_SECONDS - 1, job_id))
+        assert _claim_job(conn, 'worker-b')['id'] == job_id
+    finally:
+        conn.close()
+    assert job_status(job_id, db_path)['worker'] == 'worker-b'
+
+def test_simulate_result_round_trip(db_path):
+    from simutrial.simulation import run_simulations
+
+    cohort = _cohort()
+    params = _simulate_params(sampling='antithetic')
+    params['enrollment'] = {'consent_rate_min': 0.2, 'consent_rate_max': 0.8, 'num_simulations': 20, 'num_periods': 6,
+                            'study_size': 50, 'seed': 1}
+    job_id = submit_job('simulate', params, cohort, db_path)
+    assert job_result(job_id, db_path) is None  # Not run yet
+
+    run_worker(db_path, max_jobs=1)
+    status = job_status(job_id, db_path)
+    assert (status['status'], status['progress'], status['error']) == ('done', 1, None)
+
+    result = job_result(job_id, db_path)
+    expected = run_simulations(cohort.select('WillingnessScore'), **params['simulation'])
+    assert result['simulation']['mean_consent_rate'] == pytest.approx(expected['mean_consent_rate'])
+    assert result['simulation']['staff_requirements'] == expected['staff_requirements']
+    assert len(result['enrollment']['mean_curve']) == 6
+
+def test_sweep_result_round_trip(db_path):
+    cohort = _cohort()
+    grid = {'targeting': {'All': {}, 'South': {'region': ['South']}}, 'study_size': [50, 100]}
+    job_id = submit_job('sweep', {'grid': grid, 'num_simulations': 20, 'seed': 1}, cohort, db_path)
+    run_worker(db_path, max_jobs=1)
+
+    result = job_result(job_id, db_path)
+    assert isinstance(result, pl.DataFrame) and len(result) == 4
+    assert result.filter(pl.col('targeting') == 'South')['patients'].to_list() == [int((cohort['CENSREG'] == 3).sum())] * 2
+
+def test_failed_job_records_the_error(db_path):
+    job_id = submit_job('simulate', _simulate_params(engine='unknown'), _cohort(), db_path)
+    run_worker(db_path, max_jobs=1)
+    status = job_status(job_id, db_path)
+    assert status['status'] == 'failed' and 'Unknown simulation engine' in status['error']
+    assert job_result(job_id, db_path) is None
+
+def test_heartbeat_is_sent_while_a_job_reports_no_progress(db_path, monkeypatch):
+    job_id = submit_job('simulate', _simulate_params(), _cohort(), db_path)
+    heartbeats = []
+
+    def silent_job(job, progress):
+        started = job_status(job['id'], db_path)['heartbeat_at']
+        time.sleep(0.5)  # A long step that never calls progress
+        heartbeats.append(job_status(job['id'], db_path)['heartbeat_at'] - started)
+        return None
+
+    monkeypatch.setattr(jobs, '_run_job', silent_job)
+    run_worker(db_path, max_jobs=1, heartbeat_interval=0.05)
+    assert heartbeats[0] > 0.3
+    assert job_status(job_id, db_path)['status'] == 'done'
+
+def test_requeued_job_is_not_finished_by_its_previous_worker(db_path, monkeypatch):
+    job_id = submit_job('simulate', _simulate_params(), _cohort(), db_path)
+
+    def overtaken_job(job, progress):
+        # Another worker took over the job meanwhile
+        conn = _connect(db_path)
+        try:
+            conn.execute("UPDATE jobs SET worker = 'worker-b' WHERE id = ?", (job['id'],))
+        finally:
+            conn.close()
+        return None
+
+    monkeypatch.setattr(jobs, '_run_job', overtaken_job)
+    run_worker(db_path, max_jobs=1)
+    status = job_status(job_id, db_path)
+    assert (status['status'], status['worker']) == ('running', 'worker-b')
+
+def test_unknown_job_kind_is_rejected(db_path):
+    with pytest.raises(ValueError):
+        submit_job('train', {}, _cohort(), db_path)
+    assert job_status('missing', db_path) is None
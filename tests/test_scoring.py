@@ -0,0 +1,46 @@
+import numpy as np
+
+from conftest import make_emr
+from simutrial.ingest import ingest_upload
+from simutrial.patientVis import DEFAULT_ADJUSTMENT, adjustment_key, predict_willingness_scores
+
+def test_distinct_feature_rows_share_scores(tmp_path, willingness_model):
+    path = tmp_path / 'panel.csv'
+    make_emr(500, seed=3).write_csv(path)
+    scores = predict_willingness_scores(str(path), model=willingness_model)
+    by_cell = scores.groupby(['Age', 'CENSREG', 'BirthGender', 'RaceEthn'])['WillingnessScore'].nunique()
+    assert (by_cell == 1).all()
+    assert scores['WillingnessScore'].between(0, 0.5).all()
+
+def test_ingest_matches_row_by_row_scoring(tmp_path, willingness_model, column_mapping):
+    path = tmp_path / 'panel.csv'
+    make_emr(500, seed=4).write_csv(path)
+    ingested = ingest_upload(str(path), column_mapping, willingness_model)
+    expected = predict_willingness_scores(str(path), model=willingness_model)
+    assert np.allclose(ingested['WillingnessScore'].to_numpy(), expected['WillingnessScore'].to_numpy())
+
+def test_adjustment_key_identifies_parameter_set():
+    assert adjustment_key(DEFAULT_ADJUSTMENT) == adjustment_key(dict(DEFAULT_ADJUSTMENT))
+    assert adjustment_key(DEFAULT_ADJUSTMENT) != adjustment_key({**DEFAULT_ADJUSTMENT, 'young_boost': 1.0})
+
+def test_scanned_strata_match_the_ingested_upload(tmp_path, willingness_model, column_mapping):
+    import polars as pl
+
+    from simutrial.ingest import willingness_strata
+    from simutrial.streaming import scan_scored_strata
+    from simutrial.targeting import target_cohort
+
+    path = tmp_path / 'panel.csv'
+    make_emr(800, seed=6).with_columns(
+        pl.when(pl.col('patient_id') % 50 == 0).then(None).otherwise(pl.col('age')).alias('age')  # Unscorable rows
+    ).write_csv(path)
+    spec = {'gender': ['Female'], 'conditions': ['health_issues']}  # A normalized column name
+
+    ingested = target_cohort(ingest_upload(str(path), column_mapping, willingness_model), spec).collect()
+    assert ingested['WillingnessScore'].null_count() > 0
+    strata = scan_scored_strata(str(path), willingness_model, spec, mapping=column_mapping)
+    assert strata['count'].sum() == len(ingested)
+
+    def as_dict(scores, counts):
+        return {(None if np.isnan(score) else round(score, 12)): count for score, count in zip(scores, counts)}
+    assert as_dict(*willingness_strata(strata)) == as_dict(*willingness_strata(ingested))
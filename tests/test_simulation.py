@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from simutrial.engine import adaptive_consent_counts, simulate_consent_counts
+from simutrial.simulation import run_enrollment_simulation, run_simulations
+
+def _cohort(n=400, seed=0):
+    return pd.DataFrame({'WillingnessScore': np.random.default_rng(seed).uniform(0, 0.5, n)})
+
+@pytest.mark.parametrize('sampling', ['antithetic', 'sobol'])
+def test_stop_early_keeps_the_sampling_method(sampling):
+    results = run_simulations(_cohort(), 0.2, 0.8, 400, seed=1, target_half_width=0.5, sampling=sampling)
+    assert results['sampling'] == sampling
+    assert results['num_simulations'] < 400
+    assert results['variance_reduction'] > 1
+
+def test_adaptive_batches_keep_pairs_and_blocks_whole():
+    willingness = _cohort()['WillingnessScore'].to_numpy()
+    rng = np.random.default_rng(0)
+    sizes = []
+
+    def draw_batch(size, progress=None, sampling="independent"):
+        sizes.append((size, sampling))
+        return simulate_consent_counts(willingness, size, rng=rng, sampling=sampling)
+
+    counts = adaptive_consent_counts(draw_batch, len(willingness), 0.0, 100, sampling='sobol')
+    assert {size for size, _ in sizes} == {32} and {method for _, method in sizes} == {'sobol'}
+    assert len(counts) == 96  # The cap is rounded down to whole batches
+
+    sizes.clear()
+    counts = adaptive_consent_counts(draw_batch, len(willingness), 0.0, 101, sampling='antithetic')
+    assert [size for size, _ in sizes] == [26, 26, 26, 22]  # The last batch is clamped to the remaining pairs
+    assert len(counts) == 100
+
+@pytest.mark.parametrize('sampling', ['independent', 'antithetic', 'sobol'])
+@pytest.mark.parametrize('num_simulations', [1, 3, 10, 31])
+def test_stop_early_never_exceeds_the_replicate_cap(sampling, num_simulations):
+    results = run_simulations(_cohort(), 0.2, 0.8, num_simulations, seed=1, target_half_width=1e-6, sampling=sampling)
+    assert 0 < results['num_simulations'] <= num_simulations
+    assert np.isfinite(results['confidence_interval'])
+    assert np.isfinite(results['variance_reduction'])
+
+@pytest.mark.parametrize('sampling', ['antithetic', 'sobol'])
+def test_single_group_is_summarized_like_independent_replicates(sampling):
+    results = run_simulations(_cohort(), 0.2, 0.8, 1, seed=1, sampling=sampling)
+    assert results['num_simulations'] == 1
+    assert results['confidence_interval'] == 0.0
+    assert results['variance_reduction'] == 1.0
+
+def test_parallel_engine_honours_antithetic_sampling():
+    results = run_simulations(_cohort(), 0.2, 0.8, 64, engine='parallel', seed=1, sampling='antithetic', workers=2)
+    assert results['sampling'] == 'antithetic'
+    assert results['num_simulations'] == 64
+
+@pytest.mark.parametrize('engine, options', [
+    ('parallel', {'sampling': 'sobol'}),
+    ('parallel', {'target_half_width': 0.5}),
+    ('stratified', {'sampling': 'antithetic'}),
+    ('analytic', {'target_half_width': 0.5}),
+    ('vectorized', {'workers': 4}),
+    ('mesa', {'workers': 4}),
+])
+def test_unsupported_engine_options_are_rejected(engine, options):
+    with pytest.raises(ValueError):
+        run_simulations(_cohort(), 0.2, 0.8, 64, engine=engine, seed=1, **options)
+
+def test_stratified_counts_match_expected_consents():
+    import polars as pl
+
+    cohort = _cohort(n=300, seed=2)
+    cohort['WillingnessScore'] = cohort['WillingnessScore'].round(2)  # Few distinct scores, so strata hold many patients
+    cohort.loc[::30, 'WillingnessScore'] = np.nan  # Unscored patients never consent but count as targeted
+    expected = np.nansum(cohort['WillingnessScore']) / len(cohort) * 100
+
+    for df in (cohort, pl.from_pandas(cohort), pl.from_pandas(cohort).lazy()):
+        results = run_simulations(df, 0.2, 0.8, 4000, engine='stratified', seed=1)
+        assert results['mean_consent_rate'] == pytest.approx(expected, abs=3 * results['confidence_interval'])
+    vectorized = run_simulations(cohort, 0.2, 0.8, 4000, seed=1)
+    assert vectorized['mean_consent_rate'] == pytest.approx(expected, abs=3 * vectorized['confidence_interval'])
+
+# Reference enrollment: every window, each patient still in the pool consents with their own probability
+def _naive_enrollment_curves(willingness, num_simulations, num_periods, rng):
+    curves = np.zeros((num_simulations, num_periods), dtype=np.int64)
+    for replicate in range(num_simulations):
+        in_pool = np.ones(len(willingness), dtype=bool)
+        enrolled = 0
+        for period in range(num_periods):
+            consented = in_pool & (rng.random(len(willingness)) < willingness)
+            in_pool &= ~consented
+            enrolled += consented.sum()
+            curves[replicate, period] = enrolled
+    return curves
+
+@pytest.mark.parametrize('engine, sampling', [('vectorized', 'independent'), ('vectorized', 'antithetic'),
+                                              ('stratified', 'independent')])
+def test_enrollment_curves_match_a_per_window_simulation(engine, sampling):
+    cohort = _cohort(n=60, seed=3)
+    cohort['WillingnessScore'] = (cohort['WillingnessScore'] / 5).round(3)  # Slow enough to fill several windows
+    willingness = cohort['WillingnessScore'].to_numpy()
+    num_simulations, num_periods, study_size = 2000, 12, 15
+
+    naive = _naive_enrollment_curves(willingness, num_simulations, num_periods, np.random.default_rng(2))
+    results = run_enrollment_simulation(cohort, 0.2, 0.8, num_simulations, num_periods, study_size, seed=1,
+                                        engine=engine, sampling=sampling)
+    assert results['engine'] == engine
+
+    # Both means match the exact expectation sum_i 1 - (1 - w_i)^t within a few standard errors
+    expected = np.array([np.sum(1 - (1 - willingness) ** t) for t in range(1, num_periods + 1)])
+    standard_error = naive.std(axis=0) / np.sqrt(num_simulations)
+    np.testing.assert_array_less(np.abs(naive.mean(axis=0) - expected), 4 * standard_error)
+    np.testing.assert_array_less(np.abs(results['mean_curve'] - expected), 4 * standard_error)
+
+    naive_reached = (naive[:, -1] >= study_size).mean()
+    assert results['probability_target_reached'] == pytest.approx(naive_reached, abs=0.05)
+    for p in (10, 50, 90):
+        assert results['curve_percentiles'][p] == pytest.approx(np.percentile(naive, p, axis=0), abs=1)
+
+def test_enrollment_names_the_engine_that_drew_it():
+    cohort = _cohort(n=50)
+    for engine in ('parallel', 'analytic', 'mesa'):
+        assert run_enrollment_simulation(cohort, 0.2, 0.8, 20, 4, 10, seed=1, engine=engine)['engine'] == 'vectorized'
+    with pytest.raises(ValueError):
+        run_enrollment_simulation(cohort, 0.2, 0.8, 20, 4, 10, engine='stratified', sampling='antithetic')
+    with pytest.raises(ValueError):
+        run_enrollment_simulation(cohort, 0.2, 0.8, 20, 4, 10, engine='unknown')
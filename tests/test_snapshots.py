@@ -0,0 +1,60 @@
+import polars as pl
+
+from simutrial.snapshots import apply_snapshot, panel_store_dir
+
+def _write(df, path):
+    df.write_csv(path)
+    return str(path)
+
+def test_panels_keep_separate_stores(tmp_path, willingness_model, column_mapping):
+    from conftest import make_emr
+
+    store = tmp_path / 'snapshots'
+    panel_a = make_emr(300, seed=1)
+    panel_b = make_emr(200, seed=2, first_id=10_000)
+
+    _, changes = apply_snapshot(_write(panel_a, tmp_path / 'a.csv'), 'patient_id', column_mapping, willingness_model,
+                                'clinic_a', snapshot_dir=store)
+    assert changes['inserted'] == 300
+    _, changes = apply_snapshot(_write(panel_b, tmp_path / 'b.csv'), 'patient_id', column_mapping, willingness_model,
+                                'clinic_b', snapshot_dir=store)
+    assert changes['inserted'] == 200
+
+    # Panel A's next export is diffed against panel A's snapshot, not against the panel refreshed last
+    updated = panel_a.with_columns(
+        pl.when(pl.col('patient_id') < 5).then(pl.col('age') + 1).otherwise(pl.col('age')).alias('age')
+    ).filter(pl.col('patient_id') != 299)
+    scored, changes = apply_snapshot(_write(updated, tmp_path / 'a2.csv'), 'patient_id', column_mapping,
+                                     willingness_model, 'clinic_a', snapshot_dir=store)
+    assert (changes['inserted'], changes['updated'], changes['deleted'], changes['unchanged']) == (0, 5, 1, 294)
+    assert len(scored) == 299
+
+def test_panel_store_dir_depends_on_panel_and_id_column(tmp_path):
+    assert panel_store_dir('clinic a', 'patient_id', tmp_path) != panel_store_dir('clinic b', 'patient_id', tmp_path)
+    assert panel_store_dir('clinic a', 'patient_id', tmp_path) != panel_store_dir('clinic a', 'mrn', tmp_path)
+    assert panel_store_dir('clinic a', 'patient_id', tmp_path).startswith(str(tmp_path / 'clinic_a_'))
+
+def test_dated_exports_of_one_panel_are_diffed_incrementally(tmp_path, willingness_model, column_mapping):
+    import json
+    import os
+
+    from conftest import make_emr
+    from simutrial.snapshots import list_panels
+
+    store = tmp_path / 'snapshots'
+    panel = make_emr(200, seed=3)
+    apply_snapshot(_write(panel, tmp_path / 'export_2026-10-01.csv'), 'patient_id', column_mapping, willingness_model,
+                   'emr', snapshot_dir=store)
+    # The next day's export has a new file name but the same panel, so it is diffed against yesterday's snapshot
+    _, changes = apply_snapshot(_write(panel, tmp_path / 'export_2026-10-02.csv'), 'patient_id', column_mapping,
+                                willingness_model, 'emr', snapshot_dir=store)
+    assert (changes['inserted'], changes['unchanged']) == (0, 200)
+
+    apply_snapshot(_write(make_emr(50, seed=4), tmp_path / 'other.csv'), 'patient_id', column_mapping, willingness_model,
+                   'clinic_b', snapshot_dir=store)
+    assert set(list_panels(store)) == {'emr', 'clinic_b'}
+
+    store_dir = panel_store_dir('emr', 'patient_id', store)
+    assert sorted(os.listdir(store_dir)) == ['cells.parquet', 'meta.json', 'rows.parquet']  # No temporary files left
+    with open(os.path.join(store_dir, 'meta.json')) as f:
+        assert json.load(f)['panel'] == 'emr'
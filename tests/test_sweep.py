@@ -0,0 +1,57 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from simutrial.patientVis import state_to_censreg_code
+from simutrial.sweep import run_sweep, scenario_spec
+
+def _cohort(n=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    return pl.DataFrame({
+        'age': rng.integers(18, 90, n).astype(float),
+        'gender': rng.choice(['Male', 'Female'], n),
+        'RaceEthn': rng.choice([1, 2, 3, 4, -9], n),
+        'location': rng.choice(['Texas', 'Florida', 'Georgia', 'California', 'Ohio'], n),
+        'WillingnessScore': rng.uniform(0, 0.5, n),
+    }).with_columns(
+        pl.col('location').replace_strict(state_to_censreg_code, return_dtype=pl.Float64).alias('CENSREG')
+    )
+
+def test_scenario_spec_restricts_to_location():
+    assert scenario_spec({}, 'Texas') == {'location': ['Texas']}
+    assert scenario_spec({'region': ['South', 'West']}, 'Texas') == {'region': ['South', 'West'], 'location': ['Texas']}
+    assert scenario_spec({'region': ['West']}, None) == {'region': ['West']}
+
+def test_scenario_spec_excluded_region_matches_nobody():
+    assert scenario_spec({'region': ['West']}, 'Texas') is None
+    assert scenario_spec({'location': ['Ohio']}, 'Texas') is None
+
+def test_sweep_location_outside_targeted_regions_has_no_patients():
+    df = _cohort()
+    grid = {'targeting': {'West': {'region': ['West']}}, 'location': ['Texas', 'California']}
+    for consent_model in ('willingness', 'uniform'):
+        results = run_sweep(df, grid, num_simulations=20, consent_model=consent_model, seed=1)
+        patients = dict(zip(results['location'], results['patients']))
+        assert patients['Texas'] == 0
+        assert patients['California'] == int((df['location'] == 'California').sum())
+        assert results.filter(pl.col('location') == 'Texas')['mean_consent_rate'].is_null().all()
+
+def test_sweep_location_counts_only_the_state():
+    df = _cohort()
+    results = run_sweep(df, {'location': ['Texas', 'Florida', None]}, num_simulations=20, seed=1)
+    patients = dict(zip(results['location'], results['patients']))
+    assert patients['Texas'] == int((df['location'] == 'Texas').sum())
+    assert patients['Florida'] == int((df['location'] == 'Florida').sum())
+    assert patients[None] == len(df)
+    assert patients['Texas'] < int((df['CENSREG'] == state_to_censreg_code['Texas']).sum())  # Not the whole South
+
+def test_sweep_rejects_consent_rate_axis_under_willingness():
+    df = _cohort()
+    with pytest.raises(ValueError):
+        run_sweep(df, {'consent_rate': [(0.1, 0.3), (0.2, 0.8)]}, num_simulations=20)
+    results = run_sweep(df, {'consent_rate': [(0.1, 0.3), (0.2, 0.8)]}, num_simulations=20, consent_model='uniform', seed=1)
+    assert results['mean_consent_rate'][0] < results['mean_consent_rate'][1]
+
+def test_sweep_location_needs_the_location_column():
+    with pytest.raises(ValueError):
+        run_sweep(_cohort().drop('location'), {'location': ['Texas']}, num_simulations=20)
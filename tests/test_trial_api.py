@@ -0,0 +1,78 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from studies_api_server import StudiesAPIServer, make_study
+from simutrial.trial_api import (RACE_MEASURE, SEX_MEASURE, baseline_table, fetch_baseline_studies, gender_table, has_baseline,
+                       measure_analyzed, measure_counts, study_last_update)
+
+# Study record of NCT03653091 in the v2 API's JSON shape, restricted to trial_api.BASELINE_FIELDS. The arm
+# groups, participant counts and race counts are those trial_scraper.extract_baseline_characteristics
+# records for this study; the sex split and update date stand in for values not recorded in the repo.
+# Refresh it from https://clinicaltrials.gov/api/v2/studies/NCT03653091?fields=<BASELINE_FIELDS>
+FIXTURE_PATH = os.path.join(os.path.dirname(__file__), 'fixtures', 'NCT03653091.json')
+
+DMR, SHAM = 'Duodenal Mucosal Resurfacing Procedure (DMR)', 'Sham Procedure (Sham)'
+
+@pytest.fixture(scope='module')
+def study():
+    with open(FIXTURE_PATH) as f:
+        return json.load(f)
+
+def test_measure_counts(study):
+    race = measure_counts(study, RACE_MEASURE)
+    assert list(race.columns) == [DMR, SHAM, 'Total']
+    assert race.loc['White'].tolist() == [4, 2, 6]
+    assert race.loc['Black or African American'].tolist() == [0, 2, 2]
+    assert race.loc['Asian'].tolist() == [1, 0, 1]
+    assert race['Total'].sum() == 9
+    assert measure_counts(study, SEX_MEASURE).loc['Female'].tolist() == [2, 1, 3]
+    assert measure_analyzed(study, RACE_MEASURE) == {DMR: 5, SHAM: 4, 'Total': 9}
+
+def test_baseline_table_matches_the_scraped_layout(study):
+    scraper = pytest.importorskip('trial_scraper')  # Needs the scraping extras (Selenium, OpenAI)
+
+    expected = scraper.extract_baseline_characteristics('')
+    table = baseline_table(study)
+    assert list(table.index) == list(expected.index)
+    pd.testing.assert_frame_equal(table.astype(str), expected.astype(str))
+
+def test_gender_table(study):
+    table = gender_table(study)
+    assert table['Number Analyzed'].tolist() == ['5 participants', '4 participants', '9 participants']
+    assert table['Female Count'].tolist() == [2, 1, 3]
+    assert table['Male Count'].tolist() == [3, 3, 6]
+    assert table['Female Percentage'].tolist() == ['40.0%', '25.0%', '33.3%']
+
+def test_missing_and_customized_measures():
+    baseline = {
+        'groups': [{'id': 'BG000', 'title': 'Arm A'}, {'id': 'BG001', 'title': 'Total'}],
+        'denoms': [{'units': 'Participants', 'counts': [{'groupId': 'BG000', 'value': '3'},
+                                                        {'groupId': 'BG001', 'value': '3'}]}],
+        'measures': [{'title': 'Race/Ethnicity, Customized', 'classes': [{'categories': [
+            {'title': 'White', 'measurements': [{'groupId': 'BG000', 'value': '2'}, {'groupId': 'BG001', 'value': '2'}]},
+            {'title': 'Other', 'measurements': [{'groupId': 'BG000', 'value': 'NA'}, {'groupId': 'BG001', 'value': '1'}]},
+        ]}]}],
+    }
+    study = make_study('NCT00000001', '2024-01-01', baseline=baseline)
+    race = measure_counts(study, RACE_MEASURE)
+    assert race.loc['Other'].tolist() == [0, 1]
+    assert baseline_table(study).loc['Baseline Analysis Population Description'].tolist() == ['[Not Specified]'] * 2
+    assert gender_table(study)['Female Count'].tolist() == [0, 0]  # No sex measure reported
+
+    without_results = make_study('NCT00000002', '2024-01-01')
+    assert not has_baseline(without_results)
+    with pytest.raises(ValueError):
+        baseline_table(without_results)
+
+def test_fetch_baseline_studies_in_batches(study):
+    others = [make_study(f"NCT{i:08d}", '2024-01-01') for i in range(5)]
+    with StudiesAPIServer([study, *others]) as stand_in:
+        studies = fetch_baseline_studies(['NCT03653091', *(f"NCT{i:08d}" for i in range(5)), 'NCT99999999'],
+                                         url=stand_in.studies_url, ids_per_request=2)
+        assert len(stand_in.requests) == 4
+    assert sorted(studies) == sorted(['NCT03653091', *(f"NCT{i:08d}" for i in range(5))])
+    assert study_last_update(studies['NCT03653091']) == '2021-03-18'
+    assert has_baseline(studies['NCT03653091']) and not has_baseline(studies['NCT00000000'])
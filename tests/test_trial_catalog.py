@@ -0,0 +1,75 @@
+import polars as pl
+import pytest
+
+from studies_api_server import StudiesAPIServer, make_study
+from simutrial.trial_catalog import (CATALOG_COLUMNS, catalog_count, catalog_nct_ids, catalog_rows, export_catalog,
+                           last_synced_update, sync_catalog)
+
+QUERY = {'query.cond': 'diabetes', 'filter.overallStatus': 'COMPLETED'}
+
+def _studies(n):
+    return [
+        make_study(f"NCT{i:08d}", f"2024-{1 + i % 9:02d}-01", has_results=i % 2 == 0,
+                   documents=[('Study Protocol', 'Prot_000.pdf')] if i % 3 == 0 else ())
+        for i in range(n)
+    ]
+
+@pytest.fixture
+def stand_in():
+    with StudiesAPIServer(_studies(25)) as server:
+        yield server
+
+def test_sync_follows_every_page(tmp_path, stand_in):
+    db_path = str(tmp_path / 'catalog.sqlite')
+    fractions = []
+    written = sync_catalog(QUERY, db_path=db_path, url=stand_in.studies_url, page_size=10, progress=fractions.append)
+
+    assert written == 25
+    assert catalog_count(db_path) == 25
+    assert catalog_count(db_path, with_documents=True) == 9
+    assert len(catalog_nct_ids(db_path, with_results=True)) == 13
+    assert fractions[-1] == 1.0
+    assert len(stand_in.requests) == 3  # Pages of 10, 10 and 5
+    assert last_synced_update(QUERY, db_path) == '2024-09-01'
+
+    row = dict(zip(CATALOG_COLUMNS, catalog_rows(0, 1, db_path)[0]))
+    assert row['last_update'] == '2024-09-01'
+    assert row['study_url'] == f"https://clinicaltrials.gov/study/{row['nct_id']}"
+
+def test_resync_requests_only_updated_studies(tmp_path, stand_in):
+    db_path = str(tmp_path / 'catalog.sqlite')
+    sync_catalog(QUERY, db_path=db_path, url=stand_in.studies_url, page_size=10)
+    stand_in.requests.clear()
+
+    stand_in.put(make_study('NCT00000003', '2024-10-15', title='Updated title'))
+    stand_in.put(make_study('NCT00000100', '2024-10-20'))
+    written = sync_catalog(QUERY, db_path=db_path, url=stand_in.studies_url, page_size=10)
+
+    # Only studies updated on or after the newest synced date: the two changes and the studies of 2024-09-01
+    assert 'AREA[LastUpdatePostDate]RANGE[2024-09-01,MAX]' in stand_in.requests[0][1]['filter.advanced']
+    assert written == 2 + sum(1 for i in range(25) if 1 + i % 9 == 9)
+    assert catalog_count(db_path) == 26
+    assert last_synced_update(QUERY, db_path) == '2024-10-20'
+    titles = dict(row[:2] for row in catalog_rows(0, 30, db_path))
+    assert titles['NCT00000003'] == 'Updated title'
+
+    stand_in.requests.clear()
+    sync_catalog(QUERY, db_path=db_path, url=stand_in.studies_url, page_size=10, full=True)
+    assert 'filter.advanced' not in stand_in.requests[0][1]
+
+def test_sync_retries_server_errors(tmp_path, stand_in):
+    stand_in.fail_next(1)  # Retried after a one-second backoff
+    assert sync_catalog(QUERY, db_path=str(tmp_path / 'catalog.sqlite'), url=stand_in.studies_url, page_size=10) == 25
+
+def test_export_writes_the_catalog_to_parquet(tmp_path, stand_in):
+    db_path = str(tmp_path / 'catalog.sqlite')
+    sync_catalog(QUERY, db_path=db_path, url=stand_in.studies_url, page_size=10)
+    output_path = tmp_path / 'catalog.parquet'
+    export_catalog(str(output_path), db_path)
+
+    exported = pl.read_parquet(output_path)
+    assert exported.columns == CATALOG_COLUMNS
+    assert exported['nct_id'].to_list() == [f"NCT{i:08d}" for i in range(25)]
+    assert exported.filter(pl.col('study_documents').is_not_null())['study_documents'][0] == (
+        'Study Protocol, https://cdn.clinicaltrials.gov/large-docs/00/NCT00000000/Prot_000.pdf')
+    assert not [p for p in tmp_path.iterdir() if p.name.endswith('.tmp')]
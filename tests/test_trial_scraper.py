@@ -0,0 +1,128 @@
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+pytest.importorskip('selenium')  # The scraping extras
+from selenium.common.exceptions import WebDriverException
+
+from studies_api_server import StudiesAPIServer
+from trial_scraper import DriverPool, HostRateLimiter, fetch_page_source, scrape_studies, study_url
+
+# Stands in for a headless Chrome driver: loads pages over plain HTTP, and fails like a crashed
+# browser (WebDriverException) when the server errors or when told to crash on its next page
+class FakeDriver:
+    def __init__(self, log):
+        self.log = log
+        self.page_source = None
+        self.crash_next = False
+        self.quit_called = False
+
+    def get(self, url):
+        self.log.append((time.monotonic(), self, url))
+        if self.crash_next:
+            self.crash_next = False
+            raise WebDriverException("chrome not reachable")
+        try:
+            with urllib.request.urlopen(url, timeout=10) as response:
+                self.page_source = response.read().decode()
+        except urllib.error.HTTPError as error:
+            raise WebDriverException(f"HTTP {error.code}") from error
+
+    def quit(self):
+        self.quit_called = True
+
+class FakeDriverFactory:
+    def __init__(self):
+        self.drivers = []
+        self.log = []
+        self.live = 0
+        self.max_live = 0
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        driver = FakeDriver(self.log)
+        original_quit = driver.quit
+
+        def quit():
+            original_quit()
+            with self._lock:
+                self.live -= 1
+        driver.quit = quit
+        with self._lock:
+            self.drivers.append(driver)
+            self.live += 1
+            self.max_live = max(self.max_live, self.live)
+        return driver
+
+@pytest.fixture
+def stand_in():
+    with StudiesAPIServer() as server:
+        yield server
+
+def test_scrape_studies_with_a_pool_of_drivers(tmp_path, stand_in):
+    factory = FakeDriverFactory()
+    nct_ids = [f"NCT{i:08d}" for i in range(12)]
+    texts, errors = scrape_studies(nct_ids, pool_size=3, base_url=stand_in.url, min_interval=0, driver_factory=factory,
+                                   cache_dir=str(tmp_path))
+
+    assert not errors
+    assert sorted(texts) == nct_ids
+    assert texts['NCT00000004'].startswith('Baseline Characteristics\nNCT00000004 Overall Number')
+    assert 'About ClinicalTrials.gov' not in texts['NCT00000004']
+    assert len(factory.drivers) <= 3 and factory.live == 0  # Drivers are reused, then quit with the pool
+
+    # Cached texts are not fetched again
+    factory = FakeDriverFactory()
+    assert scrape_studies(nct_ids, base_url=stand_in.url, min_interval=0, driver_factory=factory,
+                          cache_dir=str(tmp_path))[0] == texts
+    assert not factory.drivers
+
+def test_server_errors_are_retried(tmp_path, stand_in):
+    factory = FakeDriverFactory()
+    stand_in.fail_next(2)
+    texts, errors = scrape_studies(['NCT00000001'], pool_size=1, base_url=stand_in.url, min_interval=0, retries=3,
+                                   backoff=0.01, driver_factory=factory, use_cache=False)
+    assert not errors and 'NCT00000001' in texts['NCT00000001']
+    assert len(factory.log) == 3
+
+    stand_in.fail_next(3)
+    texts, errors = scrape_studies(['NCT00000002'], pool_size=1, base_url=stand_in.url, min_interval=0, retries=1,
+                                   backoff=0.01, driver_factory=factory, use_cache=False)
+    assert not texts and isinstance(errors['NCT00000002'], WebDriverException)
+
+def test_crashed_driver_is_discarded_and_replaced(stand_in):
+    factory = FakeDriverFactory()
+    with DriverPool(size=1, driver_factory=factory) as pool:
+        with pool.driver():
+            pass
+        crashed = factory.drivers[0]
+        crashed.crash_next = True
+
+        page = fetch_page_source(pool, study_url('NCT00000007', stand_in.url), retries=2, backoff=0.01)
+        assert 'NCT00000007' in page
+        assert crashed.quit_called
+        assert len(factory.drivers) == 2 and factory.log[-1][1] is factory.drivers[1]
+        assert factory.max_live == 1  # The replacement is only started once the crashed driver is gone
+    assert factory.live == 0
+
+def test_rate_limiter_spaces_requests_to_a_host(tmp_path, stand_in):
+    factory = FakeDriverFactory()
+    min_interval = 0.05
+    scrape_studies([f"NCT{i:08d}" for i in range(6)], pool_size=3, base_url=stand_in.url, min_interval=min_interval,
+                   driver_factory=factory, use_cache=False)
+
+    starts = sorted(start for start, _, _ in factory.log)
+    assert len(starts) == 6
+    assert min(b - a for a, b in zip(starts, starts[1:])) >= min_interval * 0.9
+
+def test_rate_limiter_is_per_host():
+    limiter = HostRateLimiter(min_interval=0.2)
+    start = time.monotonic()
+    limiter.wait('http://a.example/study/1')
+    limiter.wait('http://b.example/study/1')
+    assert time.monotonic() - start < 0.1
+    limiter.wait('http://a.example/study/2')
+    assert time.monotonic() - start >= 0.19
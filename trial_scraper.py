@@ -1,4 +1,5 @@
 from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.chrome.service import Service
 from webdriver_manager.chrome import ChromeDriverManager
 from selenium.webdriver.chrome.options import Options
@@ -10,25 +11,187 @@ from dotenv import load_dotenv
 import os
 import tiktoken
 import csv
+import functools
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+from simutrial.scrape_cache import SCRAPE_CACHE_DIR, llm_key, load_entry, load_or_compute_entry, page_key, store_entry
 
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
-def scrape_with_selenium(url):
-    # Set up Selenium with Chrome
-    options = Options()
-    options.headless = True  # Run in headless mode (no UI)
-    driver = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=options)
+# Study pages are fetched from here; point it at a local HTTP server serving saved pages to test offline
+CLINICALTRIALS_BASE_URL = 'https://clinicaltrials.gov'
 
-    # Open the URL
-    driver.get(url)
+def study_url(nct_id, base_url=CLINICALTRIALS_BASE_URL):
+    return f"{base_url}/study/{nct_id}?tab=results#baseline-characteristics"
 
-    # Get the page source
-    page_source = driver.page_source
+# The chromedriver binary is resolved once per process instead of once per page
+_chromedriver_path = None
+_chromedriver_lock = threading.Lock()
 
-    # Close the driver
-    driver.quit()
+def chromedriver_path():
+    global _chromedriver_path
+    with _chromedriver_lock:
+        if _chromedriver_path is None:
+            _chromedriver_path = ChromeDriverManager().install()
+    return _chromedriver_path
 
+def new_headless_driver(page_load_timeout=60):
+    options = Options()
+    options.add_argument('--headless=new')  # Run in headless mode (no UI); Options.headless was removed in Selenium 4
+    options.add_argument('--disable-gpu')
+    options.add_argument('--disable-dev-shm-usage')
+    driver = webdriver.Chrome(service=Service(chromedriver_path()), options=options)
+    driver.set_page_load_timeout(page_load_timeout)
+    return driver
+
+# Bounded pool of warm headless drivers. Drivers are started on first use and reused across pages;
+# a driver that raises a WebDriverException is quit and replaced on the next acquire
+class DriverPool:
+    def __init__(self, size=4, driver_factory=new_headless_driver):
+        self.size = size
+        self._driver_factory = driver_factory
+        self._idle = queue.LifoQueue()  # Most recently used first, so idle drivers stay warm
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            create = self._created < self.size
+            if create:
+                self._created += 1
+        if not create:
+            return self._idle.get(timeout=timeout)
+        try:
+            return self._driver_factory()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def release(self, driver):
+        self._idle.put(driver)
+
+    def discard(self, driver):
+        try:
+            driver.quit()
+        except WebDriverException:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    @contextmanager
+    def driver(self):
+        driver = self.acquire()
+        try:
+            yield driver
+        except WebDriverException:
+            self.discard(driver)
+            raise
+        except BaseException:
+            self.release(driver)
+            raise
+        self.release(driver)
+
+    def close(self):
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(driver)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Spaces out requests to the same host by at least min_interval seconds, across threads
+class HostRateLimiter:
+    def __init__(self, min_interval=1.0):
+        self.min_interval = min_interval
+        self._next_request = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_request.get(host, now))
+            self._next_request[host] = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+
+# Page source of a URL through a pooled driver, retrying browser errors with exponential backoff
+def fetch_page_source(pool, url, rate_limiter=None, retries=3, backoff=2.0):
+    for attempt in range(retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.wait(url)
+        try:
+            with pool.driver() as driver:
+                driver.get(url)
+                return driver.page_source
+        except WebDriverException:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+def scrape_with_selenium(url, pool=None):
+    if pool is None:
+        with DriverPool(size=1) as single_pool:
+            page_source = fetch_page_source(single_pool, url)
+    else:
+        page_source = fetch_page_source(pool, url)
+    return extract_baseline_text(page_source)
+
+# Scrape the baseline characteristics text of many studies concurrently with a pool of warm drivers.
+# Texts are cached per NCT ID and revision ({nct_id: last update date}, e.g. from trial_api.study_last_update),
+# so only new or updated studies are fetched; drivers are only started for those.
+# Returns ({nct_id: text}, {nct_id: exception}) for the studies that succeeded and failed
+def scrape_studies(nct_ids, pool_size=4, base_url=CLINICALTRIALS_BASE_URL, min_interval=1.0, retries=3,
+                   driver_factory=new_headless_driver, revisions=None, cache_dir=SCRAPE_CACHE_DIR, use_cache=True,
+                   backoff=2.0):
+    nct_ids = list(dict.fromkeys(nct_ids))
+    revisions = revisions or {}
+    texts, errors = {}, {}
+    if use_cache:
+        for nct_id in nct_ids:
+            text = load_entry(page_key(nct_id, revisions.get(nct_id)), cache_dir)
+            if text is not None:
+                texts[nct_id] = text
+    to_fetch = [nct_id for nct_id in nct_ids if nct_id not in texts]
+    if not to_fetch:
+        return texts, errors
+
+    rate_limiter = HostRateLimiter(min_interval)
+    with DriverPool(pool_size, driver_factory) as pool, ThreadPoolExecutor(max_workers=pool_size) as executor:
+        futures = {
+            nct_id: executor.submit(fetch_page_source, pool, study_url(nct_id, base_url), rate_limiter, retries, backoff)
+            for nct_id in to_fetch
+        }
+        for nct_id, future in futures.items():
+            try:
+                texts[nct_id] = extract_baseline_text(future.result())
+            except Exception as error:
+                errors[nct_id] = error
+                continue
+            if use_cache:
+                store_entry(page_key(nct_id, revisions.get(nct_id)), texts[nct_id], cache_dir)
+    return texts, errors
+
+# Baseline characteristics section of a study results page
+def extract_baseline_text(page_source):
     # Parse the HTML content using BeautifulSoup
     soup = BeautifulSoup(page_source, 'html.parser')
 
@@ -46,9 +209,14 @@ def scrape_with_selenium(url):
     return all_text
 
 
+# Tokenizers are built once per model and process
+@functools.lru_cache(maxsize=None)
+def _encoding(model):
+    return tiktoken.encoding_for_model(model)
+
 def count_tokens(text, model="gpt-4-turbo"):
-    # Initialize the tokenizer for the specified model
-    encoding = tiktoken.encoding_for_model(model)
+    # Tokenizer for the specified model
+    encoding = _encoding(model)
     
     # Tokenize the text
     tokens = encoding.encode(text)
@@ -57,18 +225,29 @@ def count_tokens(text, model="gpt-4-turbo"):
     return len(tokens)
 
 
-def structure_data_with_openai(input_text):
-    # Define the prompt for the LLM
-    prompt = f"""
+STRUCTURING_PROMPT = """
     You are a data formatter. Please format the following unstructured text into CSV format.
     
     Unstructured Text:
     {input_text}
     """
 
+# Outputs are cached by input text, prompt and model (the call runs at temperature 0), so the
+# same text is only sent once
+def structure_data_with_openai(input_text, model="gpt-4-turbo", cache_dir=SCRAPE_CACHE_DIR, use_cache=True):
+    if not use_cache:
+        return _structure_data_with_openai(input_text, model)
+    raw_response, _ = load_or_compute_entry(llm_key(input_text, STRUCTURING_PROMPT, model),
+                                            lambda: _structure_data_with_openai(input_text, model), cache_dir)
+    return raw_response
+
+def _structure_data_with_openai(input_text, model):
+    # Define the prompt for the LLM
+    prompt = STRUCTURING_PROMPT.format(input_text=input_text)
+
     # Call the OpenAI API using the updated method
     response = openai.ChatCompletion.create(
-        model="gpt-4-turbo",  # or "gpt-3.5-turbo"
+        model=model,  # "gpt-4-turbo" or "gpt-3.5-turbo"
         messages=[
             {"role": "user", "content": prompt}
         ],
@@ -96,6 +275,7 @@ def save_to_csv(structured_data, output_file="clinical_structured_data.csv"):
             writer.writerow(row.split(','))
 
 
+# Example tables for NCT03653091; trial_api.baseline_table builds them for any study from the v2 API
 def extract_baseline_characteristics(text):
     data = {
         'Duodenal Mucosal Resurfacing Procedure (DMR)': [
@@ -222,13 +402,19 @@ def extract_gender_data(text):
     return df
 
 
-# URL of the study page you want to scrape
-url = 'https://clinicaltrials.gov/study/NCT03653091?tab=results#baseline-characteristics'  # Replace with the actual URL
-text = scrape_with_selenium(url)
-# print(text)
+if __name__ == "__main__":
+    # Usage: python trial_scraper.py [NCT_ID ...]; set SIMUTRIAL_TRIALS_BASE_URL to scrape a local mirror
+    nct_ids = sys.argv[1:] or ['NCT03653091']
+    texts, errors = scrape_studies(nct_ids, base_url=os.getenv("SIMUTRIAL_TRIALS_BASE_URL", CLINICALTRIALS_BASE_URL))
+
+    for nct_id, text in texts.items():
+        print(nct_id)
+
+        gender_df = extract_gender_data(text)
+        print(gender_df)
 
-gender_df = extract_gender_data(text)
-print(gender_df)
+        baseline_df = extract_baseline_characteristics(text)
+        print(baseline_df)
 
-baseline_df = extract_baseline_characteristics(text)
-print(baseline_df)
+    for nct_id, error in errors.items():
+        print(f"{nct_id}: failed ({error})")
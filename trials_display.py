@@ -1,84 +1,91 @@
-import requests
-import pandas as pd
+import os
 import tkinter as tk
 from tkinter import ttk
 import webbrowser
 
-# Define the base URL for the studies endpoint
-base_url = "https://clinicaltrials.gov/api/v2/studies"
+from simutrial.trial_api import STUDIES_API_URL
+from simutrial.trial_catalog import CATALOG_COLUMNS, CATALOG_DB_PATH, DEFAULT_QUERY, catalog_count, catalog_rows, sync_catalog
 
-# Set up query parameters for CSV
-params = {
-    "format": "csv",  # Request format as CSV
-    "query.cond": "diabetes",  # Condition to filter studies
-    "filter.overallStatus": "COMPLETED",  # Status filter
-    "pageSize": 100,  # Adjust the number of studies per page as needed
-    "countTotal": "true"  # Include total count in response
-}
-
-# Make the GET request
-response = requests.get(base_url, params=params)
+# Rows read from the catalog at a time; more are read as the view is scrolled near its end
+ROWS_PER_FETCH = 200
 
-# Check response
-if response.status_code == 200:
-    # Save the response content to a CSV file
-    with open('clinical_trials.csv', 'w', encoding='utf-8') as f:
-        f.write(response.text)
-    
-    # Read the saved CSV file into a DataFrame
-    df = pd.read_csv('clinical_trials.csv')
+# Column headings (as in the CSV export the viewer used to display)
+HEADINGS = {
+    'nct_id': 'NCT Number',
+    'title': 'Study Title',
+    'status': 'Study Status',
+    'conditions': 'Conditions',
+    'start_date': 'Start Date',
+    'completion_date': 'Completion Date',
+    'has_results': 'Study Results',
+    'study_documents': 'Study Documents',
+    'study_url': 'Study URL',
+    'last_update': 'Last Update Posted'
+}
 
-    # Filter out studies without patient information in "Study Documents"
-    filtered_df = df[df['Study Documents'].notna()]
+# Treeview over the local trial catalog that reads rows only as they are scrolled into view,
+# instead of inserting the whole catalog up front
+class LazyCatalogView:
+    def __init__(self, root, db_path=CATALOG_DB_PATH, with_documents=True):
+        self.db_path = db_path
+        self.with_documents = with_documents
+        self.total = catalog_count(db_path, with_documents)
+        self.loaded = 0
 
-    # Create a popup window to display the filtered DataFrame
-    root = tk.Tk()
-    root.title("Clinical Trials with Patient Information")
+        # Create a Treeview to display the catalog
+        self.tree = ttk.Treeview(root, columns=CATALOG_COLUMNS, show="headings")
 
-    # Create a Treeview to display the DataFrame
-    tree = ttk.Treeview(root)
-    tree.pack(expand=True, fill='both')
+        # Create scrollbars for vertical and horizontal scrolling
+        self.scrollbar_y = ttk.Scrollbar(root, orient="vertical", command=self.tree.yview)
+        self.tree.configure(yscroll=self.on_scroll)
+        self.scrollbar_y.pack(side='right', fill='y')
 
-    # Define columns
-    tree["columns"] = list(filtered_df.columns)
-    tree["show"] = "headings"
+        scrollbar_x = ttk.Scrollbar(root, orient="horizontal", command=self.tree.xview)
+        self.tree.configure(xscroll=scrollbar_x.set)
+        scrollbar_x.pack(side='bottom', fill='x')
+        self.tree.pack(expand=True, fill='both')
 
-    # Create a scrollbar for vertical scrolling
-    scrollbar_y = ttk.Scrollbar(root, orient="vertical", command=tree.yview)
-    tree.configure(yscroll=scrollbar_y.set)
-    scrollbar_y.pack(side='right', fill='y')
+        # Set column widths and headings
+        for column in CATALOG_COLUMNS:
+            self.tree.heading(column, text=HEADINGS[column])
+            self.tree.column(column, anchor="center", width=150)
 
-    # Create a scrollbar for horizontal scrolling
-    scrollbar_x = ttk.Scrollbar(root, orient="horizontal", command=tree.xview)
-    tree.configure(xscroll=scrollbar_x.set)
-    scrollbar_x.pack(side='bottom', fill='x')
+        # Open the study page in a web browser when a row is double-clicked
+        self.tree.bind("<Double-1>", self.open_url)
+        self.load_more()
 
-    # Set column widths and headings
-    for col in filtered_df.columns:
-        tree.heading(col, text=col)  # Set the column headings
-        tree.column(col, anchor="center", width=150)  # Center the column content and set fixed width
+    # Append the next window of rows from the catalog
+    def load_more(self):
+        if self.loaded >= self.total:
+            return
+        rows = catalog_rows(self.loaded, ROWS_PER_FETCH, self.db_path, self.with_documents)
+        for row in rows:
+            self.tree.insert("", "end", values=['' if value is None else value for value in row])
+        self.loaded += len(rows)
+        if not rows:
+            self.total = self.loaded  # The catalog shrank since it was counted
 
-    # Insert rows into the treeview
-    for index, row in filtered_df.iterrows():
-        # Prepare row data, making the Study URL clickable
-        row_data = list(row)
-        if 'Study URL' in filtered_df.columns:  # Check if the Study URL column exists
-            row_data[filtered_df.columns.get_loc('Study URL')] = f"{row['Study URL']}"  # Convert URL to string
-        tree.insert("", "end", values=row_data)
+    def on_scroll(self, first, last):
+        self.scrollbar_y.set(first, last)
+        if float(last) > 0.9:
+            self.load_more()
 
-    # Function to open URL in a web browser when a cell is double-clicked
-    def open_url(event):
-        item = tree.selection()
+    def open_url(self, event):
+        item = self.tree.selection()
         if item:
-            selected_item = tree.item(item)
-            url = selected_item['values'][filtered_df.columns.get_loc('Study URL')]
+            url = self.tree.item(item[0])['values'][CATALOG_COLUMNS.index('study_url')]
             if url:
                 webbrowser.open(url)  # Open URL in the default web browser
 
-    # Bind double-click event to the Treeview
-    tree.bind("<Double-1>", open_url)
+if __name__ == "__main__":
+    # Bring the catalog up to date (only studies updated since the last run are requested);
+    # set SIMUTRIAL_STUDIES_API_URL to sync from a local stand-in for the API
+    sync_catalog(DEFAULT_QUERY, url=os.getenv("SIMUTRIAL_STUDIES_API_URL", STUDIES_API_URL))
+
+    # Create a popup window listing studies with patient information in "Study Documents"
+    root = tk.Tk()
+    root.title("Clinical Trials with Patient Information")
+    LazyCatalogView(root)
 
     # Start the GUI event loop
     root.mainloop()
-else:
-    print(f"Error: {response.status_code} - {response.text}")